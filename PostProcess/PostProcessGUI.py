@@ -15,29 +15,32 @@ from os.path import normpath, isdir, isfile, split, join
 from os import mkdir
 from glob import glob
 import sys
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QLabel, QWidget, QApplication, QHBoxLayout, QVBoxLayout, QGridLayout, \
-                                                             QPushButton, QCheckBox, QFileDialog, QLineEdit
+                                                    QPushButton, QCheckBox, QFileDialog, QLineEdit, QComboBox, QProgressBar
 from time import sleep
 
 from initialise_pst_prcss import initiation, read_config_file, write_config_file
-from input_output_funcs import read_study_definition, ecosse_results_files, change_create_rslts_dir, cut_csv_files
-from input_output_funcs import check_cut_csv_files, aggregate_csv_create_coards, clean_and_zip, chng_study_create_co2e
+from input_output_funcs import read_study_definition, ecosse_results_files, change_create_rslts_dir
+from input_output_funcs import check_cut_csv_files, study_settings, clean_and_zip, chng_study_create_co2e
+from input_output_funcs import CUT_200_NYEARS, CUT_160_NYEARS
 
-from aggregate_rslts_to_csv import aggreg_metrics_to_csv, aggregate_soil_data_to_csv
-from aggr_osgb_rslts_to_csv import aggreg_osgb_metrics_to_csv
-from generate_npp_nc import sims_results_to_nc
-from csv_to_raw_nc import csv_to_raw_netcdf
+from generate_npp_nc import NPP_OUT_DIR
 from csv_to_co2e_nc import csv_to_co2e_netcdf
-from csv_to_coards_nc import csv_to_coards_netcdf
 from spec_utilities import trim_summaries
 from spec_check import check_spec_results, csv_to_csv_ireland
+from nc_profiles import NC_PROFILES
+from post_process_batch import settings_from_form
+from background_operation import BackgroundOperation, format_progress
 
 STD_FLD_SIZE = 60
 STD_BTN_SIZE = 110
 STD_CMBO_SIZE = 150
 NREGIONS = 5
+POLL_MSECS = 250    # interval at which the progress of a background operation is polled
+
+WARNING_STR = '*** Warning *** '
 
 EXTRA_METRICS = ['no3', 'npp']
 
@@ -158,6 +161,111 @@ class Form(QWidget):
         w_aggreg.setChecked(True)
         self.w_aggreg = w_aggreg
 
+        w_text_out = QCheckBox('Text files')
+        grid.addWidget(w_text_out, irow, 4)
+        helpText = 'Aggregation writes tab separated text files, one for each metric'
+        w_text_out.setToolTip(helpText)
+        w_text_out.setChecked(True)
+        self.w_text_out = w_text_out
+
+        w_store_out = QCheckBox('Results store')
+        grid.addWidget(w_store_out, irow, 5)
+        helpText = 'Aggregation writes a binary store of float32 values which is read in preference to the text\n' + \
+                   'files when creating NC files'
+        w_store_out.setToolTip(helpText)
+        self.w_store_out = w_store_out
+
+        w_totals_out = QCheckBox('Totals')
+        grid.addWidget(w_totals_out, irow, 6)
+        helpText = 'Aggregation also writes monthly and annual totals of each metric by province and, if a region\n' + \
+                   'lookup raster is set in the configuration file, by region'
+        w_totals_out.setToolTip(helpText)
+        self.w_totals_out = w_totals_out
+
+        # aggregation worker processes
+        # ============================
+        irow += 1
+        icol = 0
+        w_lbl_wrkrs = QLabel('Worker processes:')
+        helpText = 'Number of worker processes used to aggregate grid cells - 1 means aggregate serially'
+        w_lbl_wrkrs.setToolTip(helpText)
+        w_lbl_wrkrs.setAlignment(Qt.AlignRight)
+        grid.addWidget(w_lbl_wrkrs, irow, icol)
+
+        icol += 1
+        w_nworkers = QLineEdit()
+        w_nworkers.setToolTip(helpText)
+        w_nworkers.setFixedWidth(STD_FLD_SIZE)
+        grid.addWidget(w_nworkers, irow, icol)
+        self.w_nworkers = w_nworkers
+
+        icol += 1
+        w_lbl_chunk = QLabel('Chunk size:')
+        helpText = 'Number of grid cells passed to a worker process in a single task'
+        w_lbl_chunk.setToolTip(helpText)
+        w_lbl_chunk.setAlignment(Qt.AlignRight)
+        grid.addWidget(w_lbl_chunk, irow, icol)
+
+        icol += 1
+        w_chunk_size = QLineEdit()
+        w_chunk_size.setToolTip(helpText)
+        w_chunk_size.setFixedWidth(STD_FLD_SIZE)
+        grid.addWidget(w_chunk_size, irow, icol)
+        self.w_chunk_size = w_chunk_size
+
+        icol += 1
+        w_lbl_fails = QLabel('Max failures:')
+        helpText = 'Abandon aggregation when the number of failed simulations exceeds this value'
+        w_lbl_fails.setToolTip(helpText)
+        w_lbl_fails.setAlignment(Qt.AlignRight)
+        grid.addWidget(w_lbl_fails, irow, icol)
+
+        icol += 1
+        w_max_fails = QLineEdit()
+        w_max_fails.setToolTip(helpText)
+        w_max_fails.setFixedWidth(STD_FLD_SIZE)
+        grid.addWidget(w_max_fails, irow, icol)
+        self.w_max_fails = w_max_fails
+
+        icol += 1
+        w_resume = QCheckBox('Resume')
+        helpText = 'Record aggregated grid cells in a checkpoint ledger so that an interrupted aggregation can be\n' + \
+                   'resumed and only new or changed simulations are aggregated on subsequent runs'
+        w_resume.setToolTip(helpText)
+        grid.addWidget(w_resume, irow, icol)
+        self.w_resume = w_resume
+
+        # NetCDF chunking and compression
+        # ===============================
+        irow += 1
+        icol = 0
+        w_lbl_profile = QLabel('NC profile:')
+        helpText = 'Chunking and compression of NC files:\n' + \
+                   '  default - contiguous and uncompressed\n' + \
+                   '  map-access - suited to reading complete maps for each time step\n' + \
+                   '  time-series-access - suited to reading the history of individual cells\n' + \
+                   '  archive - smallest files'
+        w_lbl_profile.setToolTip(helpText)
+        w_lbl_profile.setAlignment(Qt.AlignRight)
+        grid.addWidget(w_lbl_profile, irow, icol)
+
+        icol += 1
+        w_nc_profile = QComboBox()
+        for profile_name in NC_PROFILES:
+            w_nc_profile.addItem(profile_name)
+        w_nc_profile.setToolTip(helpText)
+        w_nc_profile.setFixedWidth(STD_CMBO_SIZE)
+        grid.addWidget(w_nc_profile, irow, icol, 1, 2)
+        self.w_nc_profile = w_nc_profile
+
+        icol += 2
+        w_stats_out = QCheckBox('Statistics')
+        helpText = 'CSV to all NCs also writes an NC file of the mean, trend, change, minimum and maximum of the\n' + \
+                   'annual values of each metric for each cell'
+        w_stats_out.setToolTip(helpText)
+        grid.addWidget(w_stats_out, irow, icol)
+        self.w_stats_out = w_stats_out
+
         # ========== spacer
         irow += 1
         lbl13s = QLabel()
@@ -195,7 +303,16 @@ class Form(QWidget):
         grid.addWidget(w_csv_to_co2e, irow, icol)
         w_csv_to_co2e.clicked.connect(self.csvDataToCO2eNcClicked)
 
-        icol += 2
+        icol += 1
+        w_csv_to_all = QPushButton('CSV to all NCs')
+        helpText = 'Read previously created CSV files once and write COARDS compliant, CO2e and raw NetCDF files\n' + \
+                                                                'in a single pass - quicker than running each in turn'
+        w_csv_to_all.setToolTip(helpText)
+        w_csv_to_all.setFixedWidth(STD_BTN_SIZE)
+        grid.addWidget(w_csv_to_all, irow, icol)
+        w_csv_to_all.clicked.connect(self.csvDataToAllNcsClicked)
+
+        icol += 1
         w_csv_to_nc = QPushButton('CSV to raw NC')
         helpText = 'Read data from previously created CSV files and write to a raw,\n' + \
                                                                 'that is a non-COARDS compliant, NetCDF file'
@@ -204,6 +321,15 @@ class Form(QWidget):
         grid.addWidget(w_csv_to_nc, irow, icol)
         w_csv_to_nc.clicked.connect(self.csvDataToRawNcClicked)
 
+        icol += 1
+        w_coarsen = QPushButton('Coarsen NCs')
+        helpText = 'Write area weighted copies at 0.5 and 1 degree resolution of previously created\n' + \
+                                                                'COARDS compliant and CO2e NetCDF files'
+        w_coarsen.setToolTip(helpText)
+        w_coarsen.setFixedWidth(STD_BTN_SIZE)
+        grid.addWidget(w_coarsen, irow, icol)
+        w_coarsen.clicked.connect(self.coarsenNcsClicked)
+
         # =======
         irow += 1
         icol = 0
@@ -418,10 +544,30 @@ class Form(QWidget):
         grid.addWidget(w_clean_zip, irow, icol)
         w_clean_zip.clicked.connect(self.cleanZip)
 
-        # ========== spacer
+        # ========== progress of background operation
         irow += 1
-        lbl13s = QLabel()
-        grid.addWidget(lbl13s, irow, 0)
+        w_prgrss_bar = QProgressBar()
+        w_prgrss_bar.setRange(0, 100)
+        w_prgrss_bar.setValue(0)
+        grid.addWidget(w_prgrss_bar, irow, 0, 1, 2)
+        self.w_prgrss_bar = w_prgrss_bar
+
+        w_lbl_prgrss = QLabel('')
+        grid.addWidget(w_lbl_prgrss, irow, 2, 1, max_icol - 2)
+        self.w_lbl_prgrss = w_lbl_prgrss
+
+        w_cancel = QPushButton('Cancel', self)
+        helpText = 'Cancel the operation in progress - a second click terminates it at once'
+        w_cancel.setToolTip(helpText)
+        w_cancel.setFixedWidth(STD_BTN_SIZE)
+        w_cancel.setEnabled(False)
+        grid.addWidget(w_cancel, irow, max_icol)
+        w_cancel.clicked.connect(self.cancelClicked)
+        self.w_cancel = w_cancel
+
+        self.bckgrnd_oper = None
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.pollOperation)
 
         # ==========
         irow += 1
@@ -466,61 +612,49 @@ class Form(QWidget):
         """
         C
         """
-        if read_study_definition(self):
-
-            version = self.study_defn['version']
-            if version == 'NetZeroPlus':
-                print('OSGB version')
-                retcode = aggreg_osgb_metrics_to_csv(self)
-            else:
-                retcode = aggreg_metrics_to_csv(self)
-
-            if retcode:
-
-                # update to reflect aggregation result
-                # ====================================
-                descriptor, self.trans_defn = ecosse_results_files(self.w_lbl_rslts.text(),'Results: ')
-                self.w_lbl06.setText(descriptor)
-                check_cut_csv_files(self)
+        self.startOperation('aggregate')
         return
 
     def cutCsvFilesClicked(self):
         """
         C
         """
-        cut_csv_files(self)
+        self.startOperation('cut')
         return
 
     def cutCsvFiles1961Clicked(self):
         """
         C
         """
-        cut_str = '-f1-8,1929-3608'
-        cut_csv_files(self, cut_str)
+        self.startOperation('cut', nyears_kept=CUT_160_NYEARS)
         return
 
     def csvDataToCO2eNcClicked(self):
         """
         C
         """
-        if read_study_definition(self):
-            version = self.study_defn['version']
-            if version == 'NetZeroPlus':
-                print('OSGB version not yet ready')
-            else:
-                csv_to_co2e_netcdf(self)
+        self.startOperation('co2e')
+        return
+
+    def csvDataToAllNcsClicked(self):
+        """
+        C
+        """
+        self.startOperation('all')
         return
 
     def csvDataToRawNcClicked(self):
         """
         C
         """
-        if read_study_definition(self):
-            version = self.study_defn['version']
-            if version == 'NetZeroPlus':
-                print('OSGB version not yet ready')
-            else:
-                csv_to_raw_netcdf(self)
+        self.startOperation('raw')
+        return
+
+    def coarsenNcsClicked(self):
+        """
+        C
+        """
+        self.startOperation('coarsen')
         return
 
     # ============= General operations ==========================
@@ -529,36 +663,86 @@ class Form(QWidget):
         """
 
         """
-        if read_study_definition(self):
-            version = self.study_defn['version']
-            if version == 'NetZeroPlus':
-                print('OSGB version not yet ready')
-            else:
-                csv_to_coards_netcdf(self)
+        self.startOperation('coards')
         return
 
     def writeNppClicked(self):
         """
 
         """
-        if read_study_definition(self):
-            version = self.study_defn['version']
-            if version == 'NetZeroPlus':
-                print('OSGB version not yet ready')
-            else:
-                sims_results_to_nc(self)
+        self.startOperation('npp', out_dir=NPP_OUT_DIR)
         return
 
     def writeSoilCsvClicked(self):
         """
 
         """
-        if read_study_definition(self):
-            version = self.study_defn['version']
-            if version == 'NetZeroPlus':
-                print('OSGB version not yet ready')
-            else:
-                aggregate_soil_data_to_csv(self)
+        self.startOperation('soil')
+        return
+
+    # ============= background operations ==========================
+    #
+    def startOperation(self, operation, studies=None, **kwargs):
+        """
+        run a stage, or stages in turn, of post_process_batch in a worker process so that the GUI remains responsive
+        given the settings of each of several studies their pipelines are run instead, see BackgroundOperation
+        """
+        if self.bckgrnd_oper is not None and self.bckgrnd_oper.is_running():
+            print(WARNING_STR + '{} is still running - wait for it to finish or cancel it'
+                                                                                .format(self.bckgrnd_oper.operation))
+            return
+
+        self.bckgrnd_oper = BackgroundOperation(operation, settings_from_form(self), kwargs, studies)
+        self.bckgrnd_oper.start()
+        self.w_prgrss_bar.setValue(0)
+        self.w_lbl_prgrss.setText('Running ' + self.bckgrnd_oper.operation)
+        self.w_cancel.setEnabled(True)
+        self.timer.start(POLL_MSECS)
+        return
+
+    def pollOperation(self):
+        """
+        show progress of the background operation and, once it has finished, the results directory
+        """
+        bckgrnd_oper = self.bckgrnd_oper
+        for event in bckgrnd_oper.poll():
+            if event[0] == 'stage':
+                self.w_prgrss_bar.setValue(0)
+                self.w_lbl_prgrss.setText('Running stage ' + event[1])
+            elif event[0] == 'progress':
+                dummy, ndone, ntotal, units = event
+                if ntotal > 0:
+                    self.w_prgrss_bar.setValue(min(100, int(100 * ndone / ntotal)))
+                self.w_lbl_prgrss.setText(format_progress(ndone, ntotal, units, bckgrnd_oper.stage_elapsed()))
+
+        if bckgrnd_oper.is_running():
+            return
+
+        self.timer.stop()
+        self.w_cancel.setEnabled(False)
+        outcome = bckgrnd_oper.outcome
+        if outcome[0] == 'cancelled':
+            mess = 'Cancelled {} after {:.1f} seconds'.format(bckgrnd_oper.operation, outcome[-1])
+        elif outcome[1]:
+            self.w_prgrss_bar.setValue(100)
+            mess = 'Completed {} in {:.1f} seconds'.format(bckgrnd_oper.operation, outcome[-1])
+        else:
+            mess = 'Could not complete {} - see console'.format(bckgrnd_oper.operation)
+        self.w_lbl_prgrss.setText(mess)
+
+        # update to reflect result
+        # ========================
+        descriptor, self.trans_defn = ecosse_results_files(self.w_lbl_rslts.text(), 'Results: ')
+        self.w_lbl06.setText(descriptor)
+        check_cut_csv_files(self)
+        return
+
+    def cancelClicked(self):
+        """
+        first click stops the operation at the next opportunity, a second terminates it
+        """
+        if self.bckgrnd_oper is not None:
+            self.bckgrnd_oper.cancel()
         return
 
     # ============= MK operations ==========================
@@ -584,9 +768,7 @@ class Form(QWidget):
         if not read_study_definition(self):
             return
 
-        trim_summaries(self)
-        self.aggregToCsvClicked()
-        self.writeCoardsNcClicked()
+        self.startOperation(['trim', 'aggregate', 'coards'])
         return
 
     # ============= MA operations ==========================
@@ -598,8 +780,7 @@ class Form(QWidget):
         if not read_study_definition(self):
             return
 
-        self.aggregToCsvClicked()
-        csv_to_co2e_netcdf(self)
+        self.startOperation(['aggregate', 'co2e'])
         return
 
     def maProcessAll(self, superg_flag):
@@ -611,9 +792,9 @@ class Form(QWidget):
         tmp_list = study.split('_')
         if superg_flag:
             search_str = '_'.join(tmp_list[:3]) + '_*'  # typical search_str:  'Anglesey_45_15_*'
-            cut_str = '-f1-8,1929-3608'     # cut 160 years
+            nyears_kept = CUT_160_NYEARS     # cut 160 years
         else:
-            cut_str =  '-f1-8,2397-3608'    # cut 200 years
+            nyears_kept = CUT_200_NYEARS     # cut 200 years
             search_str = '*' + tmp_list[-1] + '*'  # typical search_str:  'Wheat00A1B'
 
         study_defn_fns = []
@@ -632,26 +813,26 @@ class Form(QWidget):
         CO2E_ONLY_FLAG = False
         nstudies = len(sim_dirs)
         if nstudies > 0:
+            studies = []
             for sim_dir, study_defn_fn in zip(sim_dirs, study_defn_fns):
-                print('\nProcessing results in: ' + sim_dir)
+                print('\nWill process results in: ' + sim_dir)
                 chng_study_create_co2e(self, sim_dir)
                 if read_study_definition(self, study_defn_fn):
 
-                    if not CO2E_ONLY_FLAG:
-                        aggreg_metrics_to_csv(self, sim_dir)
-
-                    aggreg_metrics_to_csv(self, sim_dir)
-                    rslt_dir = sim_dir.replace('EcosseSims', 'EcosseOutputs')
-                    descriptor, self.trans_defn = ecosse_results_files(rslt_dir, 'Results: ')
-
                     if CO2E_ONLY_FLAG:
                         rslts_dir = self.w_lbl_rslts.text()
                         out_dir = join(rslts_dir, 'cut_outdir')
+                        descriptor, self.trans_defn = ecosse_results_files(out_dir, 'Results: ')
+                        csv_to_co2e_netcdf(self)
                     else:
-                        out_dir = cut_csv_files(self, cut_str)
-
-                    descriptor, self.trans_defn = ecosse_results_files(out_dir, 'Results: ')
-                    csv_to_co2e_netcdf(self)
+                        studies.append(settings_from_form(self))
+
+            # aggregation, cut and co2e are skipped when their inputs are unchanged since last run
+            # cut CSV files in cut_outdir are those zipped by Clean and Zip
+            # ====================================================================================
+            if len(studies) > 0:
+                self.startOperation('co2e pipelines of {} studies'.format(len(studies)), studies,
+                                                    products=['co2e'], nyears_kept=nyears_kept, cut_flag=True)
         else:
             print('No studies found using search string: ' + search_str)
 
@@ -679,10 +860,7 @@ class Form(QWidget):
         else:
             root_dir, reg_dir = split(sims_dir)
             if reg_dir.find('Reg_') == 0 or reg_dir.find('UK_') == 0:
-                self.aggregToCsvClicked()
-                cut_csv_files(self)
-                self.writeCoardsNcClicked()
-                print('Finished processing ' + reg_dir)
+                self.startOperation(['aggregate', 'coards'], nyears_kept=CUT_200_NYEARS)
             else:
                 print('Not a MGMT project')
         return
@@ -709,9 +887,13 @@ class Form(QWidget):
                 if len(mgmt_dirs) == 0:
                     print('No mgmt_dirs to process')
                 else:
+                    studies = []
                     for mgmt_dir in mgmt_dirs:
                         print('Will process results in: ' + mgmt_dir)
-                        aggregate_csv_create_coards(self, mgmt_dir)
+                        studies.append(study_settings(self, mgmt_dir))
+
+                    self.startOperation('coards pipelines of {} studies'.format(len(studies)), studies,
+                                                                    products=['coards'], nyears_kept=CUT_200_NYEARS)
 
         else:
             print('Not a MGMT project')
@@ -779,6 +961,8 @@ class Form(QWidget):
 
         """
         write_config_file(self)
+        if self.bckgrnd_oper is not None and self.bckgrnd_oper.is_running():
+            self.bckgrnd_oper.stop()
         self.close()
 
     # ============= other ==========================
@@ -18,7 +18,7 @@ __version__ = '1.0.1'
 from glob import glob
 from csv import field_size_limit, writer
 from os.path import normpath, isfile, join, split, isdir
-from os import walk, remove
+from os import remove
 from copy import copy
 from time import time
 from locale import format_string
@@ -26,7 +26,9 @@ from locale import format_string
 from aggregate_rslts_to_csv import fetch_fut_end_year
 from spec_utilities import (load_manifest, display_headers, update_progress_post, deconstruct_sim_dir,
                                                                                 retrieve_results, make_id_mod)
-from spec_check import verify_subdir
+from manifest_index import ManifestIndex
+from sims_inventory import fetch_sims_inventory
+from progress_events import cancel_requested
 
 ERROR_STR = '*** Error *** '
 
@@ -65,23 +67,13 @@ def aggreg_osgb_metrics_to_csv(form, sims_dir=None):
     scenario = form.study_defn['climScnr']
     version = form.study_defn['version']
 
-    print('Gathering all simulation directories from ' + sims_dir + '...')
-    for directory, subdirs_raw, files in walk(sims_dir):
-        break
-    del directory
-    del files
+    # simulation directories are streamed from the inventory - typical OSGB subdir = '246500_642500'
+    # ==============================================================================================
+    inventory = fetch_sims_inventory(sims_dir)
+    num_sims = inventory.nsims + inventory.nwthr_dirs
 
-    # filter weather directories to leave only simulation directories
-    # ===============================================================
-    subdirs = []
-    for subdir in subdirs_raw:      # typical OSGB subdir = '246500_642500'
-        if verify_subdir(subdir, version):
-            subdirs.append(subdir)
-    num_sims = len(subdirs)
-    del (subdirs_raw)
-
-    print('Counting all manifest files...')
-    num_manifests = len(glob(normpath(sims_dir + '/manifest_*.txt')))
+    mani_index = ManifestIndex(form.lgr, sims_dir)
+    num_manifests = len(mani_index)
 
     print('\nGathered {} simulation directories and {} manifest files...'.format(num_sims, num_manifests))
 
@@ -97,7 +89,7 @@ def aggreg_osgb_metrics_to_csv(form, sims_dir=None):
 
     # collect results, as a list, for a given cell for all of the dominant soils
     # ==========================================================================
-    for sub_directory in subdirs:
+    for sub_directory in inventory.iter_sim_dirs(version):
         sim_dir = join(sims_dir, sub_directory)
 
         # write accumulated results to output file - reads the manifest file
@@ -126,18 +118,26 @@ def aggreg_osgb_metrics_to_csv(form, sims_dir=None):
 
         # write accumulated results to output file - reads the manifest file
         # ==================================================================
-        area = spec_csv.process_osgb_rslts(scenario, sim_dir, result_for_sim)
+        area = spec_csv.process_osgb_rslts(scenario, sim_dir, result_for_sim, mani_index)
         total_area += area
         num_grid_cells += 1
 
         # =========================
         last_time = update_progress_post(last_time, start_time, num_grid_cells, num_manifests, skipped, nfailed, warning_count)
 
+        if cancel_requested():
+            print('\n*** Cancelled *** after {} grid cells - CSV files hold complete grid cells only'
+                                                                                            .format(num_grid_cells))
+            break
+
      # close CSV files
     # ================
     for key in spec_csv.output_fhs:
         spec_csv.output_fhs[key].close()
 
+    if cancel_requested():
+        return False
+
     form.lgr.info('\nSimulations completed.')
 
     last_time = update_progress_post(last_time, start_time, num_grid_cells, num_manifests, skipped, nfailed, warning_count)
@@ -210,7 +210,7 @@ class SpecCsvOsgb(object):
 
         return True
 
-    def process_osgb_rslts(self, scenario, sim_dir, results):
+    def process_osgb_rslts(self, scenario, sim_dir, results, mani_index=None):
         """
         Process results accumulated for this grid cell
         Write to NC file
@@ -225,7 +225,7 @@ class SpecCsvOsgb(object):
 
         # retrieve grid cell manifest file content
         # ========================================
-        manifest = load_manifest(self.lgr, sim_dir)
+        manifest = load_manifest(self.lgr, sim_dir, mani_index)
         if manifest == None:    # trap error
             return 0.0
 
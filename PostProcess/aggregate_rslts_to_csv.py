@@ -15,19 +15,28 @@ __version__ = '1.0.1'
 # ---------------
 # 1.0.1
 
-from glob import glob
 from csv import field_size_limit, writer
 from os.path import normpath, isfile, join, split, isdir
-from os import walk, remove
+from os import remove
 from copy import copy
+from multiprocessing import Pool
 from time import time
 from locale import format_string
+from collections import deque
+from itertools import islice
 
 from spec_utilities import (load_manifest, display_headers, update_progress_post, deconstruct_sim_dir,
                                     retrieve_soil_results, retrieve_soil_results_ss, retrieve_results, make_id_mod)
-from spec_check import verify_subdir
+from pool_settings import NWORKERS, CHUNK_SIZE, MAX_FAILURES
+from manifest_index import ManifestIndex
+from sims_inventory import fetch_sims_inventory
+from checkpoint_ledger import CheckpointLedger
+from results_store import ResultsStoreWriter, store_dir_name
+from region_totals import RegionTotals, read_region_lookup
+from progress_events import cancel_requested
 
 ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
 
 EXTRA_METRICS = ['no3', 'npp']
 SUMMARY_VARNAMES = {'soc': 'total_soc', 'co2': 'co2_c', 'ch4': 'ch4_c', 'no3': 'no3_n', 'npp': 'npp_adj',
@@ -38,15 +47,50 @@ VAR_FORMAT_STRS = {'soc': '{0:.1f}', 'co2': '{0:.3f}', 'ch4': '{0:.5f}', 'no3':
 MAX_NUM_DOM_SOILS = 9  # HWSD has up to 9 dominant soils
 COMMON_HEADERS = ['province', 'latitude', 'longitude', 'mu_global', 'climate_scenario', 'num_dom_soils', 'land_use',
                                                                                                             'area_km2']
-MAX_FAILURES = 1000
+NCHUNKS_BATCH = 4   # chunks per worker prepared on the main thread and passed to the pool in a single batch
 
-def aggreg_metrics_to_csv(form, sims_dir=None, expand_results=False):
+def aggreg_metrics_to_csv(form, sims_dir=None, expand_results=False, nworkers=None, chunk_size=None,
+                                    max_failures=None, resume=None, text_output=None, store_output=None,
+                                                                    totals_output=None, region_lookup_fn=None):
     """
-    called from GUI
+    called from GUI or headless
+    grid cells, that is all the _s01.._s09 soils of one cell, are farmed out to a pool of nworkers processes; results
+    are written in the order the simulation directories were gathered so output is identical to a serial run
+    when resume is set, grid cells are recorded in a checkpoint ledger and only those which are new or whose
+    SUMMARY.OUT files have changed since the last run are aggregated; CSV files are then merged from the ledger
+    results are written as tab separated text files and/or a binary results store which the NC converters read
+    in preference to the text files
+    when totals are requested, area weighted totals by province and, if a region lookup raster is given, by region
+    are accumulated as grid cells arrive and written as summary tables alongside the results
     """
     if sims_dir is None:
         sims_dir = form.w_lbl_sims.text()
 
+    nworkers, chunk_size, max_failures = _fetch_pool_settings(form, nworkers, chunk_size, max_failures)
+    if resume is None:
+        resume = hasattr(form, 'w_resume') and form.w_resume.isChecked()
+    if text_output is None:
+        text_output = not hasattr(form, 'w_text_out') or form.w_text_out.isChecked()
+    if store_output is None:
+        store_output = hasattr(form, 'w_store_out') and form.w_store_out.isChecked()
+    if totals_output is None:
+        totals_output = hasattr(form, 'w_totals_out') and form.w_totals_out.isChecked()
+    if region_lookup_fn is None:
+        region_lookup_fn = getattr(form, 'region_lookup_fn', '')
+
+    if resume:
+        text_output = True      # checkpoint ledger is merged into text files
+        if store_output:
+            print(WARNING_STR + 'results store is not written when resuming - will write text files only')
+            store_output = False
+        if totals_output:
+            print(WARNING_STR + 'totals are not written when resuming since unchanged grid cells are not reread')
+            totals_output = False
+
+    if not text_output and not store_output:
+        print(ERROR_STR + 'neither text files nor results store have been selected for output')
+        return False
+
     # Create and initialise SpecCsv object
     # ====================================
     spec_csv = SpecCsv(form)
@@ -54,9 +98,23 @@ def aggreg_metrics_to_csv(form, sims_dir=None, expand_results=False):
         print(ERROR_STR + 'No SUMMARY.OUT files in: ' + sims_dir)
         return False
 
-    if not spec_csv.create_results_files():
+    if text_output and not resume and not spec_csv.create_results_files():
         return False
 
+    if store_output:
+        spec_csv.create_results_store()
+
+    region_totals = None
+    if totals_output:
+        region_lookup = None
+        if region_lookup_fn is not None and region_lookup_fn != '':
+            region_lookup = read_region_lookup(region_lookup_fn)
+            if region_lookup is None:
+                return False
+
+        region_totals = RegionTotals(spec_csv.varnames, spec_csv.fut_start_year, spec_csv.fut_end_year,
+                                                                                                    region_lookup)
+
     display_headers(form)
     ngrid_cells = 0  # No. of grid cells have completed successfully
     failed = 0   # sims that failed to complete due to error
@@ -66,40 +124,209 @@ def aggreg_metrics_to_csv(form, sims_dir=None, expand_results=False):
 
     # get the climate scenario from the sims directory
     scenario = form.study_defn['climScnr']
-    version = form.study_defn['version']
 
-    print('Gathering all simulation directories from ' + sims_dir + '...')
-    for directory, subdirs_raw, files in walk(sims_dir):
-        break
-    del directory
-    del files
-
-    # filter weather directories to leave only simulation directories
-    # ===============================================================
-    subdirs = []
-    for subdir in subdirs_raw:
-        if verify_subdir(subdir):
-            subdirs.append(subdir)
-    num_sims = len(subdirs)
-    del(subdirs_raw)
+    # simulation directories, already grouped by grid cell, are streamed from the inventory
+    # ====================================================================================
+    inventory = fetch_sims_inventory(sims_dir)
+    num_sims = inventory.nsims
 
-    print('Counting all manifest files...')
-    nmanifests = len(glob(normpath(sims_dir + '/manifest_lat*_lon*_mu*.txt')))
+    mani_index = ManifestIndex(form.lgr, sims_dir)
+    nmanifests = len(mani_index)
 
     print('\nGathered {} simulation directories and counted {} manifest files...'.format(num_sims,nmanifests))
-
-    # main loop
-    # =========
+    if nworkers > 1:
+        print('Will aggregate using {} worker processes with chunk size {}'.format(nworkers, chunk_size))
+
+    # filter unwanted metrics
+    # =======================
+    unwanted_metrics = []
+    for metric in EXTRA_METRICS:
+        if not form.w_metrics[metric].isChecked():
+            unwanted_metrics.append(metric)
+
+    aggr_cfg = {'lgr': form.lgr, 'sims_dir': sims_dir, 'scenario': scenario, 'land_use': spec_csv.land_use,
+                'var_format_strs': spec_csv.var_format_strs, 'unwanted_metrics': unwanted_metrics,
+                'expand_results': expand_results, 'text_output': text_output,
+                'cell_values': store_output or totals_output}
+
+    # grid cells already in the checkpoint ledger and unchanged since are skipped
+    # ==========================================================================
+    ledger = None
+    cell_keys = []
+    pending_cells = deque()
+    if resume:
+        settings = {'fut_start_year': spec_csv.fut_start_year, 'fut_end_year': spec_csv.fut_end_year,
+                    'scenario': scenario, 'land_use': spec_csv.land_use, 'var_format_strs': spec_csv.var_format_strs,
+                    'expand_results': expand_results}
+        ledger = CheckpointLedger(sims_dir, spec_csv.output_dir, split(sims_dir)[1], settings)
+
+    # main loop - results for each grid cell arrive in the same order as the simulation directories
+    # =============================================================================================
     total_area = 0.0
+    cancelled = False
+    abandoned = False
     last_time = time()
-    sim_num = 0         # No. of sims that have been processed
+    cell_tasks = _make_cell_tasks(inventory.iter_cells(), mani_index, ledger, cell_keys, pending_cells)
+    for nfailed_cell, ndom_soils, area, records, cell_values in _aggreg_cells(cell_tasks, aggr_cfg, nworkers,
+                                                                                                        chunk_size):
+        failed += nfailed_cell
+        if ledger is not None:
+            cell_key, cell_sig = pending_cells.popleft()
+            ledger.add_cell(cell_key, cell_sig, nfailed_cell, area, records)
+        elif ndom_soils > 0:
+            spec_csv.write_records(records)
+            if store_output:
+                spec_csv.store.add_cell(*cell_values)
+            if region_totals is not None:
+                region_totals.add_cell(*cell_values)
+
+        if ndom_soils > 0:
+            total_area += area
+            ngrid_cells += 1
+
+        if failed > max_failures:
+            print('\n*** Abandoned processesing *** Exceeded maximum number of failures {}'.format(max_failures))
+            abandoned = True
+            break
+
+        if cancel_requested():
+            cancelled = True
+            break
+
+        last_time = update_progress_post(last_time, strt_time, ngrid_cells, nmanifests, skipped, failed, warn_count)
+
+    # close CSV file or, when resuming, assemble CSV files from the ledger
+    # ====================================================================
+    last_time = 0
+    update_progress_post(last_time, strt_time, ngrid_cells, nmanifests, skipped, failed, warn_count)
+    if ledger is None:
+        for key in spec_csv.output_fhs:
+            spec_csv.output_fhs[key].close()
+        if store_output:
+            if cancelled or abandoned:
+                spec_csv.store.abandon()
+            else:
+                spec_csv.store.close()
+        if region_totals is not None and not (cancelled or abandoned):
+            region_totals.write_summary(spec_csv.output_dir, split(sims_dir)[1])
+    else:
+        ledger.close()
+
+    if cancelled or abandoned:
+        mess = '\n*** Cancelled ***' if cancelled else '\nAggregation incomplete'
+        mess += ' after {} grid cells - '.format(ngrid_cells)
+        if ledger is None:
+            mess += 'CSV files hold complete grid cells only'
+        else:
+            mess += 'CSV files have not been merged, grid cells in the checkpoint ledger will be skipped when resumed'
+        print(mess)
+        form.lgr.info(mess)
+        return False
+
+    if ledger is not None:
+        mess = '\nSkipped {} unchanged grid cells recorded in checkpoint ledger'.format(ledger.nskipped)
+        print(mess)
+        form.lgr.info(mess)
+        total_area += ledger.skipped_area
+        if ledger.merge(cell_keys, spec_csv.varnames, spec_csv.make_header(), spec_csv.output_dir,
+                                                                                    split(sims_dir)[1]) < 0:
+            return False
+
+    form.lgr.info('\nSimulations completed.')
+    mess = '\nAggregation of metrics from simulation results completed.'
+    area_str = format_string("%12.2f", total_area, grouping=True)
+    mess += '\t# failures: {}\tTotal area covered: {} km2'.format(failed, area_str)
+    print(mess)
+    form.lgr.info(mess)
+
+    return True
+
+def _fetch_pool_settings(form, nworkers, chunk_size, max_failures):
+    """
+    settings passed by a headless caller take precedence over those of the GUI, otherwise use defaults
+    """
+    settings = []
+    for val, widget_name, default in [(nworkers, 'w_nworkers', NWORKERS), (chunk_size, 'w_chunk_size', CHUNK_SIZE),
+                                                                    (max_failures, 'w_max_fails', MAX_FAILURES)]:
+        if val is None:
+            val = default
+            if hasattr(form, widget_name):
+                try:
+                    val = int(getattr(form, widget_name).text())
+                except ValueError:
+                    print(WARNING_STR + 'invalid {} setting - will use {}'.format(widget_name[2:], default))
+
+        settings.append(max(1, val))
+
+    return settings
+
+def _make_cell_tasks(cells, mani_index, ledger=None, cell_keys=None, pending_cells=None):
+    """
+    pair simulation directories of each grid cell with the manifest index entries they require
+    when a ledger is supplied, grid cells which are current are skipped and the key and signature of the others
+    are queued in pending_cells in the order their results will arrive
+    """
+    for cell_sub_dirs in cells:
+        if ledger is not None:
+            cell_key, cell_sig = ledger.cell_signature(cell_sub_dirs, mani_index)
+            cell_keys.append(cell_key)
+            if ledger.is_current(cell_key, cell_sig):
+                continue
+
+            pending_cells.append((cell_key, cell_sig))
+
+        yield cell_sub_dirs, mani_index.subset(cell_sub_dirs)
+
+def _aggreg_cells(cell_tasks, aggr_cfg, nworkers, chunk_size):
+    """
+    yield outcome of each grid cell in the order of cell_tasks, either in this process or using a pool of workers
+    cell_tasks is consumed in batches on this thread, rather than by the pool's task handler thread, so that the
+    checkpoint ledger is only ever used by the main thread; the next batch is passed to the pool before the outcomes
+    of the current one are collected so that workers do not wait at the end of each batch
+    """
+    if nworkers <= 1:
+        _init_aggreg_worker(aggr_cfg)
+        for cell_task in cell_tasks:
+            yield _aggreg_cell(cell_task)
+    else:
+        batch_size = nworkers * chunk_size * NCHUNKS_BATCH
+        with Pool(nworkers, initializer=_init_aggreg_worker, initargs=(aggr_cfg,)) as pool:
+            outcomes = None
+            while True:
+                batch = list(islice(cell_tasks, batch_size))
+                next_outcomes = pool.imap(_aggreg_cell, batch, chunk_size) if len(batch) > 0 else None
+                if outcomes is not None:
+                    for outcome in outcomes:
+                        yield outcome
+
+                if next_outcomes is None:
+                    break
+                outcomes = next_outcomes
+
+def _init_aggreg_worker(aggr_cfg):
+    """
+    settings required by each worker are passed once rather than with every grid cell
+    """
+    global _aggr_cfg
+    _aggr_cfg = aggr_cfg
+
+def _aggreg_cell(cell_task):
+    """
+    retrieve results from SUMMARY.OUT for each dominant soil of a grid cell, look up manifest and apply weightings
+    returns number of failed simulations, number of valid results, area, records for each metric and, if a results
+    store or totals are being written, line prefixes and unformatted values
+    """
+    cell_sub_dirs, mani_index = cell_task
+    lgr = _aggr_cfg['lgr']
+    sims_dir = _aggr_cfg['sims_dir']
 
     # collect results, as a list, for a given cell for all of the dominant soils
     # ==========================================================================
     results = [{} for x in range(MAX_NUM_DOM_SOILS + 1)]
     results[0] = 0  # counts number of valid results
+    nfailed = 0
     sim_dir_prev = ''
-    for sub_directory in subdirs:
+    for sub_directory in cell_sub_dirs:
         sim_dir = join(sims_dir, sub_directory)
         sdom_soil = sim_dir[-2:]
         try:
@@ -108,38 +335,18 @@ def aggreg_metrics_to_csv(form, sims_dir=None, expand_results=False):
             print('\nCould not extract dominant soil number from simulation path ' + sim_dir)
             continue
 
-        # when we hit first dominant soil then write accumulated results
-        # ==============================================================
-        if sim_dir[-4:] == '_s01':
-            if results[0] > 0:
-                # write accumulated results to output file - reads the manifest file
-                # ==================================================================
-                area = spec_csv.process_results(scenario, sim_dir_prev, results, expand_results)
-                total_area += area
-                ngrid_cells += 1
-
-            # initialise results list with ten dictionary elements, the first as a counter then one for each dominant soil
-            # ============================================================================================================
-            results = [{} for x in range(MAX_NUM_DOM_SOILS + 1)]
-            results[0] = 0  # counts number of valid results
-
         # retrieve the data from summary.out
         # ==================================
-        result_for_sim = retrieve_results(form.lgr, sim_dir)
+        result_for_sim = retrieve_results(lgr, sim_dir)
         if result_for_sim is None:
-            failed += 1
-            if failed > MAX_FAILURES:
-                print('\n*** Abandoned processesing *** Exceeded maximum number of failures {}'.format(MAX_FAILURES))
-                break
-            else:
-                continue
+            nfailed += 1
+            continue
 
         # filter unwanted metrics
         # =======================
-        for metric in EXTRA_METRICS:
-            if not form.w_metrics[metric].isChecked():
-                if metric in result_for_sim:
-                    del(result_for_sim[metric])
+        for metric in _aggr_cfg['unwanted_metrics']:
+            if metric in result_for_sim:
+                del(result_for_sim[metric])
 
         # =========================
         if ndom_soil < MAX_NUM_DOM_SOILS:
@@ -150,31 +357,20 @@ def aggreg_metrics_to_csv(form, sims_dir=None, expand_results=False):
 
         sim_dir_prev = sim_dir
 
-        last_time = update_progress_post(last_time, strt_time, ngrid_cells, nmanifests, skipped, failed, warn_count)
-        sim_num += 1
-
-    # make sure last cell is written
-    if results[0] > 0:
-        # process and write accumulated results to output file
-        area = spec_csv.process_results(scenario, sim_dir_prev, results, expand_results)
-        total_area += area
-        ngrid_cells += 1
+    if results[0] == 0:
+        return nfailed, 0, 0.0, {}, None
 
-    # close CSV file
-    # ==============
-    last_time = 0
-    update_progress_post(last_time, strt_time, ngrid_cells, nmanifests, skipped, failed, warn_count)
-    for key in spec_csv.output_fhs:
-        spec_csv.output_fhs[key].close()
+    area, id_mods, values = make_cell_values(lgr, _aggr_cfg['scenario'], _aggr_cfg['land_use'], sim_dir_prev,
+                                                                    results, _aggr_cfg['expand_results'], mani_index)
+    records = {}
+    if _aggr_cfg['text_output']:
+        records = format_cell_records(id_mods, values, _aggr_cfg['var_format_strs'])
 
-    form.lgr.info('\nSimulations completed.')
-    mess = '\nAggregation of metrics from simulation results completed.'
-    area_str = format_string("%12.2f", total_area, grouping=True)
-    mess += '\t# failures: {}\tTotal area covered: {} km2'.format(failed, area_str)
-    print(mess)
-    form.lgr.info(mess)
+    cell_values = None
+    if _aggr_cfg['cell_values']:
+        cell_values = (id_mods, values)
 
-    return True
+    return nfailed, results[0], area, records, cell_values
 
 def map_sims_weather(form):
     """
@@ -195,11 +391,8 @@ def map_sims_weather(form):
 
     # construct a list of all weather directories
     # ===========================================
-    weather_dirs = glob(sims_dir + '\\[0-9]*_*')
-    wthr_dirs = []
-    for d in weather_dirs:
-        dummy, dirname = split(d)
-        wthr_dirs.append(dirname)
+    inventory = fetch_sims_inventory(sims_dir)
+    wthr_dirs = [] if inventory is None else list(inventory.iter_wthr_dirs())
 
     # construct sorted lists of all lats and longs
     #  ===========================================
@@ -256,6 +449,12 @@ def fetch_fut_end_year(form):
     """
     get future end year from study defimition file
     """
+    return fetch_fut_period(form)[:4]
+
+def fetch_fut_period(form):
+    """
+    as fetch_fut_end_year plus the number of values for each year of a SUMMARY.OUT file, 365 if daily otherwise 12
+    """
     version = form.study_defn['version']
     sims_dir = form.w_lbl_sims.text()
     fut_end_year = form.study_defn['futEndYr']
@@ -267,39 +466,37 @@ def fetch_fut_end_year(form):
     else:
         fut_start_year = form.study_defn['futStrtYr']
     '''
-    print('Gathering simulation directories from ' + sims_dir + '...')
-    for directory, subdirs_raw, files in walk(sims_dir):
-        break
-    del files
-
-    # filter weather directories to leave only simulation directories
-    # ===============================================================
+    # simulation directories only, from the inventory e.g. lat/lon subdir = 'lat0002438_lon0023793_mu10090_s01'
+    # ========================================================================================================
     smmry_out_flag = False
-    for subdir in subdirs_raw:
-        if verify_subdir(subdir, version):      # typical lat/lon subdir = 'lat0002438_lon0023793_mu10090_s01'
-            smmry_out_fn = join(sims_dir, subdir, 'SUMMARY.OUT')
-            if isfile(smmry_out_fn):
-                smmry_out_flag = True
-                with open(smmry_out_fn, 'r') as fobj:
-                    nlines = len(fobj.readlines())
-
-                    # deduce check timestep
-                    # =====================
-                    if (nlines -2) % 12 == 0:
-                        fut_start_year = int(fut_end_year - (nlines - 2) / 12 + 1)
-                        timestep = 'monthly'
-                    elif (nlines -2) % 365 == 0:
-                        fut_start_year = int(fut_end_year - (nlines - 2) / 365 + 1)
-                        timestep = 'daily'
-                    else:
-                        fut_start_year = form.study_defn['futStrtYr']
-                        timestep = 'undetermined'
-
-                    print('Simulation timestep is deduced to be: {}\twith start and end years: {} {}'
-                                                                .format(timestep, fut_start_year, fut_end_year))
-                    break
+    nvals_per_year = 12
+    inventory = fetch_sims_inventory(sims_dir)
+    subdirs = [] if inventory is None else inventory.iter_sim_dirs(version)
+    for subdir in subdirs:
+        smmry_out_fn = join(sims_dir, subdir, 'SUMMARY.OUT')
+        if isfile(smmry_out_fn):
+            smmry_out_flag = True
+            with open(smmry_out_fn, 'r') as fobj:
+                nlines = len(fobj.readlines())
+
+                # deduce check timestep
+                # =====================
+                if (nlines -2) % 12 == 0:
+                    fut_start_year = int(fut_end_year - (nlines - 2) / 12 + 1)
+                    timestep = 'monthly'
+                elif (nlines -2) % 365 == 0:
+                    fut_start_year = int(fut_end_year - (nlines - 2) / 365 + 1)
+                    timestep = 'daily'
+                    nvals_per_year = 365
+                else:
+                    fut_start_year = form.study_defn['futStrtYr']
+                    timestep = 'undetermined'
 
-    return fut_start_year, fut_end_year, sims_dir, smmry_out_flag
+                print('Simulation timestep is deduced to be: {}\twith start and end years: {} {}'
+                                                            .format(timestep, fut_start_year, fut_end_year))
+                break
+
+    return fut_start_year, fut_end_year, sims_dir, smmry_out_flag, nvals_per_year
 
 class SpecCsv(object):
     """
@@ -309,7 +506,8 @@ class SpecCsv(object):
 
         self.lgr = form.lgr
 
-        self.fut_start_year, self.fut_end_year, self.sims_dir, self.smmry_out_flag = fetch_fut_end_year(form)
+        self.fut_start_year, self.fut_end_year, self.sims_dir, self.smmry_out_flag, self.nvals_per_year = \
+                                                                                            fetch_fut_period(form)
         self.output_dir = form.w_lbl_rslts.text()
 
         self.land_use = form.study_defn['land_use']
@@ -326,6 +524,9 @@ class SpecCsv(object):
         self.varnames = list(var_format_strs.keys())
         self.summary_varnames = smry_varnames
         self.var_format_strs = var_format_strs
+        self.output_fhs = {}
+        self.writers = {}
+        self.store = None
 
     def create_results_files(self):
         """
@@ -339,10 +540,7 @@ class SpecCsv(object):
 
         self.output_fhs = {}
         self.writers = {}
-        hdr_rec = copy(COMMON_HEADERS)
-        for year in range(self.fut_start_year, self.fut_end_year + 1):
-            for month in range(1, 13):
-                hdr_rec.append('{0}-{1:0>2}'.format(str(year), str(month)))
+        hdr_rec = self.make_header()
 
         for varname in self.varnames:
             sim_dir, study = split(self.sims_dir)
@@ -360,6 +558,26 @@ class SpecCsv(object):
 
         return True
 
+    def make_header(self):
+        """
+        common headers followed by one column for each month of the future period
+        """
+        hdr_rec = copy(COMMON_HEADERS)
+        for year in range(self.fut_start_year, self.fut_end_year + 1):
+            for month in range(1, 13):
+                hdr_rec.append('{0}-{1:0>2}'.format(str(year), str(month)))
+
+        return hdr_rec
+
+    def create_results_store(self):
+        """
+        binary store of float32 values for each metric, written alongside the text files
+        width of the metric matrices is fixed by the future period so that every grid cell has a full row
+        """
+        sim_dir, study = split(self.sims_dir)
+        ntimes = (self.fut_end_year - self.fut_start_year + 1) * self.nvals_per_year
+        self.store = ResultsStoreWriter(store_dir_name(self.output_dir, study), self.varnames, COMMON_HEADERS, ntimes)
+
     def create_soil_results_file(self, run_mode):
 
         # Create empty soil results files
@@ -383,14 +601,14 @@ class SpecCsv(object):
         self.writers[varname] = writer(self.output_fhs[varname], delimiter='\t')
         self.writers[varname].writerow(hdr_rec)
 
-    def process_soil_result(self, scenario, sim_dir, result, iyear, plant_input, run_mode):
+    def process_soil_result(self, scenario, sim_dir, result, iyear, plant_input, run_mode, mani_index=None):
         """
         write first layer of soil TODO: what about second layer?
         """
         id_ = deconstruct_sim_dir(sim_dir, scenario, self.land_use)
         lat_id, lon_id, mu_global, scenario, soil_id, lut = id_
         # retrieve manifest
-        manifest = load_manifest(self.lgr, sim_dir)
+        manifest = load_manifest(self.lgr, sim_dir, mani_index)
         if manifest is None:    # trap error
             return 0.0
 
@@ -417,89 +635,120 @@ class SpecCsv(object):
 
     def process_results(self, scenario, sim_dir, results, expand_results):
         """
-        Process results accumulated for this grid cell
-        Write to NC file
-        Optionally delete simulation folder
+        Process results accumulated for this grid cell and write to CSV files
         NB this function will only be called if there is useful data for this grid cell
         """
-        id_ = deconstruct_sim_dir(sim_dir, scenario, self.land_use)
-        lat_id, lon_id, mu_global, scenario, soil_id, lut = id_
+        area_grid_cells, records = make_cell_records(self.lgr, scenario, self.land_use, self.var_format_strs, sim_dir,
+                                                                                            results, expand_results)
+        self.write_records(records)
 
-        # retrieve grid cell manifest file content
-        # ========================================
-        manifest = load_manifest(self.lgr, sim_dir)
-        if manifest == None:    # trap error
-            return 0.0
+        return area_grid_cells
 
-        # retrieve percentages and convert to ordered factors
-        province = manifest['location']['province']
-        id_ = [province] + id_
-        percentages = manifest[mu_global.lstrip('0')]
-        area_grid_cells = manifest['location']['area']
+    def write_records(self, records):
+        """
+        write records for a grid cell, as returned by make_cell_records, to CSV files
+        """
+        for varname in records:
+            if varname in self.writers:
+                self.writers[varname].writerows(records[varname])
 
-        # reconstruct set of cells for this simulation
-        granular_longs = manifest['granular_longs']
-        nlen = len(granular_longs)
-        area_grid_cell = str(round(area_grid_cells/(1 +nlen),6))
-        granular_longs[str(nlen+1)] = int(lon_id)
-
-        factors = {}
-        multiplier = 1.0
-        # valuable_data_flag = False
-        for el in percentages.items():
-            factors[el[0]] = el[1]/100.0
-            # check corresponding entry in results list
-            indx = int(el[0])
-            if results[indx] == None:
-                multiplier += el[1]/100.0
-
-        ndom_soils = results[0]
-        npercs = len(percentages)
-        if npercs != ndom_soils:
-            self.lgr.info('Number of percentages {} from the manifest file does not equal number of dominant soils {}'.
-                  format(npercs,ndom_soils))
-
-        # apply factors and sum - NB order of dominant soils is important
-        # ===============================================================
-        final_result = {}
-        ndsp1 = ndom_soils+1
-        for result, el in zip(results[1:ndsp1], sorted(factors.items())):
-            if result == None:
-                continue
+def make_cell_records(lgr, scenario, land_use, var_format_strs, sim_dir, results, expand_results, mani_index=None):
+    """
+    Process results accumulated for this grid cell and return area and records, for each metric, to be written
+    NB this function will only be called if there is useful data for this grid cell
+    """
+    area_grid_cells, id_mods, values = make_cell_values(lgr, scenario, land_use, sim_dir, results, expand_results,
+                                                                                                        mani_index)
+    return area_grid_cells, format_cell_records(id_mods, values, var_format_strs)
 
-            factor =  el[1]
-            for varname in result.keys():
-                if final_result.get(varname) == None:
-                    final_result[varname] = [el*factor for el in result[varname]]
-                else:
-                    first = final_result[varname]
-                    second = [el*factor for el in result[varname]]
-                    final_result[varname] = [x + y for x, y in zip(first, second)]
-
-        # write final result to CSV file
-        # =================================
-        latitude = manifest['location']['latitude']
-        longitude = manifest['location']['longitude']
+def make_cell_values(lgr, scenario, land_use, sim_dir, results, expand_results, mani_index=None):
+    """
+    apply weightings to results accumulated for this grid cell and return area, line prefixes and, for each metric,
+    an array of values
+    """
+    id_ = deconstruct_sim_dir(sim_dir, scenario, land_use)
+    lat_id, lon_id, mu_global, scenario, soil_id, lut = id_
+
+    # retrieve grid cell manifest file content
+    # ========================================
+    manifest = load_manifest(lgr, sim_dir, mani_index)
+    if manifest == None:    # trap error
+        return 0.0, [], {}
+
+    # retrieve percentages and convert to ordered factors
+    province = manifest['location']['province']
+    id_ = [province] + id_
+    percentages = manifest[mu_global.lstrip('0')]
+    area_grid_cells = manifest['location']['area']
+
+    # reconstruct set of cells for this simulation
+    granular_longs = dict(manifest['granular_longs'])
+    nlen = len(granular_longs)
+    area_grid_cell = str(round(area_grid_cells/(1 +nlen),6))
+    granular_longs[str(nlen+1)] = int(lon_id)
+
+    factors = {}
+    multiplier = 1.0
+    # valuable_data_flag = False
+    for el in percentages.items():
+        factors[el[0]] = el[1]/100.0
+        # check corresponding entry in results list
+        indx = int(el[0])
+        if results[indx] == None:
+            multiplier += el[1]/100.0
+
+    ndom_soils = results[0]
+    npercs = len(percentages)
+    if npercs != ndom_soils:
+        lgr.info('Number of percentages {} from the manifest file does not equal number of dominant soils {}'.
+              format(npercs,ndom_soils))
+
+    # apply factors and sum - NB order of dominant soils is important
+    # ===============================================================
+    final_result = {}
+    ndsp1 = ndom_soils+1
+    for result, el in zip(results[1:ndsp1], sorted(factors.items())):
+        if result == None:
+            continue
+
+        factor =  el[1]
+        for varname in result.keys():
+            if final_result.get(varname) is None:
+                final_result[varname] = result[varname]*factor
+            else:
+                nvals = min(len(final_result[varname]), len(result[varname]))   # soils may differ in length
+                final_result[varname] = final_result[varname][:nvals] + result[varname][:nvals]*factor
+
+    # adjust for missing soils
+    # ========================
+    if multiplier > 1.0:
         for varname in final_result.keys():
-            nvals = len(final_result[varname])
+            final_result[varname] = final_result[varname]*multiplier
+
+    # line prefixes for records
+    # =========================
+    id_mods = []
+    latitude = manifest['location']['latitude']
+    longitude = manifest['location']['longitude']
+    if expand_results:
+        for gran_lon in granular_longs.values():
+            id_mods.append(make_id_mod(id_, latitude, longitude, area_grid_cell, gran_lon))
+    else:
+        id_mods.append(make_id_mod(id_, latitude, longitude, area_grid_cells, int(lon_id)))
 
-            # adjust for missing soils
-            if multiplier > 1.0:
-                final_result[varname] = [el*multiplier for el in final_result[varname]]
+    return area_grid_cells, id_mods, final_result
 
-            res = list(final_result[varname])
-            format_str = self.var_format_strs[varname]
-            res = [format_str.format(val) for val in res]
-            if varname in self.writers:
-                if expand_results:
-                    for gran_lon in granular_longs.values():
-                        id_mod_ = make_id_mod(id_, latitude, longitude, area_grid_cell, gran_lon)
-                        self.writers[varname].writerow(id_mod_ + res)
-                else:
-                    id_mod_ = make_id_mod(id_, latitude, longitude, area_grid_cells, int(lon_id))
-                    self.writers[varname].writerow(id_mod_ + res)
+def format_cell_records(id_mods, values, var_format_strs):
+    """
+    build records for CSV files - one for each line prefix
+    """
+    records = {}
+    for varname in values.keys():
+        format_str = var_format_strs[varname]
+        res = [format_str.format(val) for val in list(values[varname])]
+        records[varname] = [id_mod_ + res for id_mod_ in id_mods]
 
-        return area_grid_cells
+    return records
 
 def aggregate_soil_data_to_csv(form):
     """
@@ -531,23 +780,13 @@ def aggregate_soil_data_to_csv(form):
     warn_count = 0   # No. of warnings
     strt_time = time()
 
-    print('Gathering all simulation directories from ' + sims_dir + '...')
-    for directory, subdirs_raw, files in walk(sims_dir):
-        break
-    del directory
-    del files
+    # simulation directories are streamed from the inventory
+    # ======================================================
+    inventory = fetch_sims_inventory(sims_dir)
+    num_sims = inventory.nsims
 
-    # filter weather directories to leave only simulation directories
-    # ===============================================================
-    subdirs = []
-    for subdir in subdirs_raw:
-        if verify_subdir(subdir):
-            subdirs.append(subdir)
-    num_sims = len(subdirs)
-    del(subdirs_raw)
-
-    print('Counting all manifest files...')
-    nmanifests = len(glob(normpath(sims_dir + '/manifest_lat*_lon*_mu*.txt')))
+    mani_index = ManifestIndex(form.lgr, sims_dir)
+    nmanifests = len(mani_index)
     print('\nGathered {} simulation directories and counted {} manifest files...'.format(num_sims,nmanifests))
 
     # main loop
@@ -560,7 +799,7 @@ def aggregate_soil_data_to_csv(form):
 
     # collect results - ignore all but the dominant soils
     # ===================================================
-    for sub_directory in subdirs:
+    for sub_directory in inventory.iter_sim_dirs():
         sim_dir = join(sims_dir, sub_directory)
 
         if sim_dir[-4:] != '_s01':
@@ -573,7 +812,8 @@ def aggregate_soil_data_to_csv(form):
         else:
             result_for_soil = retrieve_soil_results_ss(sim_dir)
 
-        area = spec_csv.process_soil_result(scenario, sim_dir, result_for_soil, iyear, plant_input, run_mode)
+        area = spec_csv.process_soil_result(scenario, sim_dir, result_for_soil, iyear, plant_input, run_mode,
+                                                                                                        mani_index)
 
         total_area += area
         ngrid_cells += 1
@@ -584,6 +824,10 @@ def aggregate_soil_data_to_csv(form):
             print('\nCompleted maximum number of simulations {} - will terminate processing'.format(sim_num))
             break
 
+        if cancel_requested():
+            print('\n*** Cancelled *** after {} grid cells'.format(ngrid_cells))
+            break
+
     # close CSV file
     # ==============
     last_time = update_progress_post(last_time, strt_time, ngrid_cells, nmanifests, skipped, failed, warn_count)
@@ -0,0 +1,273 @@
+#-------------------------------------------------------------------------------
+# Name:        background_operation.py
+# Purpose:     run a post processing operation in a worker process so that the GUI remains responsive
+# Author:      agent
+# Created:     18/10/2026
+# Description: the operation is a stage, or a sequence of stages, of post_process_batch run using a batch Form made
+#              from the settings of the GUI, or the pipelines of several studies run in turn by stage_pipeline;
+#              the start of each stage, progress, completion and cancellation are passed back on a queue which the
+#              GUI polls
+#              on cancellation aggregation stops after the current grid cell and closes its files, whereas NC
+#              conversions stop at once - NC and temporary files of the output directories written since the
+#              stage then running started are incomplete and are removed, outputs of stages which had already
+#              completed are kept; a second cancel terminates the worker process
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'background_operation.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from multiprocessing import Process, Queue, Event
+from os import scandir, remove
+from os.path import isdir
+from queue import Empty
+from time import time
+
+from progress_events import install_progress_sink, cancel_requested, OperationCancelled
+
+NC_SUFFIXES = ('.nc', '.tmp')
+FINAL_EVENTS = ('finished', 'cancelled')
+JOIN_SECS = 5.0
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+def _install_sinks(queue, cancel_event, out_dirs):
+    """
+    progress is put on the queue as it is reported and the start of each stage together with the state of the NC
+    files at that moment, before the stage has written anything
+    """
+    install_progress_sink(lambda ndone, ntotal, units: queue.put(('progress', ndone, ntotal, units)), cancel_event,
+                            lambda stage_name: queue.put(('stage', stage_name, _nc_file_states(out_dirs))))
+
+def _run_operation(stage_names, settings, kwargs, out_dirs, queue, cancel_event):
+    """
+    entry point of the worker process - stages are run in turn, each starting once the previous has completed,
+    and the outcome is put on the queue as finished or cancelled
+    """
+    from post_process_batch import Form, run_stages
+
+    _install_sinks(queue, cancel_event, out_dirs)
+    strt_time = time()
+    try:
+        retcode = run_stages(Form(settings), stage_names, **kwargs)
+    except OperationCancelled:
+        queue.put(('cancelled', time() - strt_time))
+        return
+
+    _put_outcome(queue, retcode, strt_time)
+
+def _run_pipelines(studies, kwargs, out_dirs, queue, cancel_event):
+    """
+    entry point of the worker process - the pipeline of each study, made by study_pipeline with the keyword
+    arguments, is run in turn; stages are run one at a time in this process so that each may be cancelled
+    """
+    from stage_pipeline import study_pipeline, run_pipeline
+
+    _install_sinks(queue, cancel_event, out_dirs)
+    strt_time = time()
+    retcode = True
+    try:
+        for settings in studies:
+            print('\nProcessing results in: ' + settings['sims_dir'])
+            outcomes = run_pipeline(study_pipeline(settings, **kwargs), settings, nconcurrent=1)
+            if outcomes is None or 'failed' in outcomes.values() or 'blocked' in outcomes.values():
+                retcode = False
+            if cancel_requested():
+                break
+    except OperationCancelled:
+        queue.put(('cancelled', time() - strt_time))
+        return
+
+    _put_outcome(queue, retcode, strt_time)
+
+def _put_outcome(queue, retcode, strt_time):
+    """
+    an operation may stop early of its own accord on cancellation, e.g. aggregation, and is then cancelled
+    """
+    if cancel_requested():
+        queue.put(('cancelled', time() - strt_time))
+    else:
+        queue.put(('finished', bool(retcode), time() - strt_time))
+
+def _nc_file_states(out_dirs):
+    """
+    modification times of the NC and temporary files of the output directories
+    """
+    states = {}
+    for out_dir in out_dirs:
+        if not isdir(out_dir):
+            continue
+        for entry in scandir(out_dir):
+            if entry.name.endswith(NC_SUFFIXES) and entry.is_file():
+                states[entry.path] = entry.stat().st_mtime_ns
+
+    return states
+
+def format_progress(ndone, ntotal, units, elapsed):
+    """
+    number done, throughput and estimated time remaining e.g. 12,000 of 50,000 lines  400 lines/s  ETA 0:01:35
+    """
+    mess = '{:,} of {:,} {}'.format(ndone, ntotal, units)
+    if elapsed > 0.0 and ndone > 0:
+        rate = ndone / elapsed
+        mess += '  {:,.0f} {}/s'.format(rate, units)
+        if ntotal > ndone:
+            secs = int((ntotal - ndone) / rate)
+            mess += '  ETA {}:{:0>2}:{:0>2}'.format(secs // 3600, (secs // 60) % 60, secs % 60)
+
+    return mess
+
+class BackgroundOperation(object):
+    """
+    single operation running in a worker process
+    """
+    def __init__(self, operation, settings, kwargs=None, studies=None):
+        """
+        operation is the name of a stage of post_process_batch or a list of names of stages to be run in turn
+        keyword arguments are passed to every stage
+        studies, if given, is a list of the settings of each study whose pipeline is to be run, in which case the
+        keyword arguments are passed to study_pipeline and operation is a description
+        """
+        self.studies = studies
+        self.settings = settings
+        self.kwargs = {} if kwargs is None else kwargs
+        if studies is None:
+            self.stage_names = [operation] if isinstance(operation, str) else list(operation)
+            self.operation = ' then '.join(self.stage_names)
+            self.out_dirs = [settings['results_dir']]
+            if self.kwargs.get('out_dir') is not None:
+                self.out_dirs.append(self.kwargs['out_dir'])      # NPP may be written elsewhere
+        else:
+            self.stage_names = None
+            self.operation = operation
+            self.out_dirs = [study['results_dir'] for study in studies]
+        self.queue = Queue()
+        self.cancel_event = Event()
+        self.process = None
+        self.strt_time = None
+        self.stage_name = None
+        self.stage_strt_time = None
+        self.nc_states = {}
+        self.outcome = None
+
+    def start(self):
+        """
+        note the state of the NC files so that incomplete files can be removed should the operation be cancelled
+        before its first stage starts
+        """
+        self.nc_states = _nc_file_states(self.out_dirs)
+        self.strt_time = time()
+        self.stage_strt_time = self.strt_time
+        if self.studies is None:
+            target, args = _run_operation, (self.stage_names, self.settings, self.kwargs, self.out_dirs)
+        else:
+            target, args = _run_pipelines, (self.studies, self.kwargs, self.out_dirs)
+        self.process = Process(target=target, args=args + (self.queue, self.cancel_event))
+        self.process.start()
+
+    def is_running(self):
+        return self.process is not None and self.outcome is None
+
+    def elapsed(self):
+        return time() - self.strt_time
+
+    def stage_elapsed(self):
+        """
+        time since the current stage started, from which its throughput is estimated
+        """
+        return time() - self.stage_strt_time
+
+    def cancel(self):
+        """
+        first request asks the worker to stop, a second terminates it
+        """
+        if not self.is_running():
+            return
+
+        if not self.cancel_event.is_set():
+            print('\nCancelling {} - will stop at the next opportunity'.format(self.operation))
+            self.cancel_event.set()
+        else:
+            print('\n' + WARNING_STR + 'terminating {}'.format(self.operation))
+            self.process.terminate()
+
+    def stop(self):
+        """
+        terminate the worker at once, e.g. when the GUI is closed, and remove incomplete outputs
+        """
+        if not self.is_running():
+            return
+
+        self.cancel_event.set()
+        self._drain_events()
+        self.process.terminate()
+        self._complete(('cancelled', self.elapsed()))
+
+    def _drain_events(self, timeout=None):
+        """
+        return events put on the queue so far, noting the start of each stage, up to and including the final event
+        with a timeout each event is waited for, as when the worker has exited
+        """
+        events = []
+        while True:
+            try:
+                event = self.queue.get(timeout=timeout) if timeout is not None else self.queue.get_nowait()
+            except Empty:
+                break
+
+            events.append(event)
+            if event[0] == 'stage':
+                self.stage_name, self.nc_states = event[1:]
+                self.stage_strt_time = time()
+            elif event[0] in FINAL_EVENTS:
+                break
+
+        return events
+
+    def poll(self):
+        """
+        return events from the worker, without waiting - progress events are (progress, ndone, ntotal, units), the
+        start of each stage is (stage, stage_name, nc_states) and the final event is (finished, retcode, elapsed)
+        or (cancelled, elapsed)
+        """
+        events = self._drain_events()
+        if len(events) > 0 and events[-1][0] in FINAL_EVENTS:
+            self._complete(events[-1])
+            return events
+
+        if self.is_running() and not self.process.is_alive():
+            events += self._drain_events(timeout=1.0)     # outcome may have been put just before exit
+            if len(events) == 0 or events[-1][0] not in FINAL_EVENTS:
+                if self.cancel_event.is_set():
+                    events.append(('cancelled', self.elapsed()))
+                else:
+                    print(ERROR_STR + '{} exited with code {}'.format(self.operation, self.process.exitcode))
+                    events.append(('finished', False, self.elapsed()))
+            self._complete(events[-1])
+
+        return events
+
+    def _complete(self, event):
+        """
+        wait for the worker to exit then, if cancelled, remove incomplete NC files
+        """
+        self.outcome = event
+        self.process.join(JOIN_SECS)
+        if event[0] == 'cancelled':
+            self.remove_incomplete_outputs()
+
+    def remove_incomplete_outputs(self):
+        """
+        NC and temporary files created or rewritten since the stage which was running started are incomplete
+        """
+        if self.stage_name is not None:
+            print('Removing incomplete outputs of stage ' + self.stage_name)
+        for fname, mtime_ns in _nc_file_states(self.out_dirs).items():
+            if self.nc_states.get(fname) == mtime_ns:
+                continue
+            try:
+                remove(fname)
+                print('Removed incomplete file: ' + fname)
+            except OSError as err:
+                print(WARNING_STR + 'could not remove incomplete file {} - {}'.format(fname, err))
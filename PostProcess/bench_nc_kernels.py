@@ -0,0 +1,153 @@
+#-------------------------------------------------------------------------------
+# Name:        bench_nc_kernels.py
+# Purpose:     benchmark the NumPy rescale and CO2e kernels against the original month by month functions
+# Author:      agent
+# Created:     18/10/2026
+# Description: synthetic cells are converted by both versions, outputs are checked for equivalence at float32
+#              tolerance, since values are written as 4 byte floats, and timings are reported
+#              usage: python bench_nc_kernels.py --ncells 2000 --nyears 91 [--daily]
+#-------------------------------------------------------------------------------
+#
+__author__ = 'agent'
+__prog__ = 'bench_nc_kernels.py'
+__version__ = '0.0'
+
+from argparse import ArgumentParser
+from calendar import monthrange
+from statistics import mean
+from sys import exit
+from time import time
+
+from numpy import allclose, array, float32, float64
+from numpy.random import default_rng
+
+from csv_to_coards_nc import rescale_metric_block, HECTARES_PER_M2
+from csv_to_co2e_nc import convert_to_co2e_block, CO2EQUIV_CH4, CO2EQUIV_N2O, CO2_MOL_MASS_FACTOR, \
+                                                                            CH4_MOL_MASS_FACTOR, N2O_MOL_MASS_FACTOR
+PROGRAM_ID = 'bench_nc_kernels'
+ERROR_STR = '*** Error *** '
+METRICS = ['ch4', 'co2', 'n2o', 'soc', 'npp']
+RTOL = 1.0e-6       # float32 has about 7 significant digits
+ATOL = 1.0e-9
+
+def _rescale_metric_values_loop(num_months, metric_vals, metric, daily_flag):
+    """
+    original month by month version of rescale_metric_values
+    """
+    monthly_vals = []
+    imnth = 1
+    if daily_flag:
+        indx1 = 0
+        for indx_mnth in range(num_months):
+            frst_day, num_days = monthrange(2011, imnth)
+            indx2 = indx1 + num_days
+            if metric == 'soc':
+                monthly_vals.append(HECTARES_PER_M2 * mean(metric_vals[indx1:indx2]))
+            else:
+                monthly_vals.append(HECTARES_PER_M2 * 365 * mean(metric_vals[indx1:indx2]))   # flux
+            indx1 += num_days
+            imnth += 1
+            if imnth > 12:
+                imnth = 1
+    else:
+        for indx_mnth in range(num_months):
+            frst_day, num_days = monthrange(2011, imnth)
+            if metric == 'soc':
+                monthly_vals.append(HECTARES_PER_M2 * metric_vals[indx_mnth])
+            elif metric == 'npp':
+                monthly_vals.append(HECTARES_PER_M2 * metric_vals[indx_mnth] / 2)      # NB divide by 2
+            else:
+                monthly_vals.append(HECTARES_PER_M2 * 365 * metric_vals[indx_mnth] / num_days)
+            imnth += 1
+            if imnth > 12:
+                imnth = 1
+
+    return monthly_vals
+
+def _convert_to_co2e_loop(num_months, metric_vals):
+    """
+    original element by element version of convert_to_co2e
+    """
+    monthly_vals = []
+    for imnth in range(num_months):
+        if imnth > 0:
+            soc1 = metric_vals['soc'][imnth] + metric_vals['ch4'][imnth]
+            soc2 = metric_vals['soc'][imnth - 1] + metric_vals['ch4'][imnth - 1]
+            change_in_soc = soc1 - soc2
+            co2e = (CO2EQUIV_CH4 * metric_vals['ch4'][imnth] * CH4_MOL_MASS_FACTOR) \
+                   + (CO2EQUIV_N2O * metric_vals['n2o'][imnth] * N2O_MOL_MASS_FACTOR)\
+                   - (change_in_soc * CO2_MOL_MASS_FACTOR)
+        else:
+            co2e = 0.0
+        monthly_vals.append(co2e)
+
+    return monthly_vals
+
+def _report(label, time_loop, time_block, equiv_flag):
+    """
+    C
+    """
+    speedup = time_loop / time_block if time_block > 0 else float('inf')
+    print('{:<12} loop: {:8.3f}s   block: {:8.3f}s   speedup: {:8.1f}   equivalent: {}'
+                                                            .format(label, time_loop, time_block, speedup, equiv_flag))
+
+def _equivalent(vals_loop, vals_block):
+    """
+    compare at the precision with which values are written to NC files
+    """
+    return allclose(array(vals_loop, dtype=float32), vals_block.astype(float32), rtol=RTOL, atol=ATOL)
+
+def main():
+    """
+    Entry point
+    """
+    parser = ArgumentParser(prog=PROGRAM_ID, description='Benchmark NumPy rescale and CO2e kernels')
+    parser.add_argument('--ncells', type=int, default=2000, help='number of synthetic cells')
+    parser.add_argument('--nyears', type=int, default=91, help='number of years per cell')
+    parser.add_argument('--daily', action='store_true', help='daily rather than monthly input values')
+    args = parser.parse_args()
+
+    num_months = 12 * args.nyears
+    nvals = 365 * args.nyears if args.daily else num_months
+    rng = default_rng(1)
+    blocks = {metric: rng.uniform(0.0, 50.0, (args.ncells, nvals)).astype(float64) for metric in METRICS}
+    blocks['soc'] += 50000.0
+    print('{} cells of {} {} values'.format(args.ncells, nvals, 'daily' if args.daily else 'monthly'))
+
+    all_equiv = True
+    for metric in METRICS:
+        strt_time = time()
+        vals_loop = [_rescale_metric_values_loop(num_months, list(vals), metric, args.daily)
+                                                                                        for vals in blocks[metric]]
+        time_loop = time() - strt_time
+
+        strt_time = time()
+        vals_block = rescale_metric_block(num_months, blocks[metric], metric, args.daily)
+        time_block = time() - strt_time
+
+        equiv_flag = _equivalent(vals_loop, vals_block)
+        all_equiv = all_equiv and equiv_flag
+        _report('rescale ' + metric, time_loop, time_block, equiv_flag)
+
+    if not args.daily:
+        strt_time = time()
+        vals_loop = [_convert_to_co2e_loop(num_months, {metric: list(blocks[metric][icell])
+                                                for metric in ('soc', 'ch4', 'n2o')}) for icell in range(args.ncells)]
+        time_loop = time() - strt_time
+
+        strt_time = time()
+        vals_block = convert_to_co2e_block(num_months, blocks['soc'], blocks['ch4'], blocks['n2o'])
+        time_block = time() - strt_time
+
+        equiv_flag = _equivalent(vals_loop, vals_block)
+        all_equiv = all_equiv and equiv_flag
+        _report('co2e', time_loop, time_block, equiv_flag)
+
+    if not all_equiv:
+        print(ERROR_STR + 'kernel outputs differ from original functions')
+        exit(1)
+
+    exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,8 @@
 # Purpose:     perform SuperG operations
 # Author:      Mike Martin
 # Created:     4 Oct 2022
-# Description:
+# Description: differences between runs and between RCPs of net CO2e NC files are calculated in process by
+#              nc_arithmetic, formerly by the external cdo utility, with independent differences run concurrently
 #-------------------------------------------------------------------------------
 #
 __author__ = 's03mm5'
@@ -11,12 +12,15 @@ __prog__ = 'cdo_superg_ops.py'
 __version__ = '0.0'
 
 from argparse import ArgumentParser
-from os import getcwd, chdir, system, mkdir, remove, name as os_name
+from os import getcwd, chdir, mkdir, remove, name as os_name
 from os.path import abspath, expanduser, expandvars, isfile, isdir, join, normpath, split
 from sys import exit, stdout
 from time import sleep, time
 from glob import glob
 
+from nc_arithmetic import run_nc_operations
+from nc_profiles import NC_PROFILES, DEFAULT_PROFILE
+
 sleepTime = 5
 PROGRAM_ID = 'cdo_superg_ops'
 ERROR_STR = '*** Error *** '
@@ -31,29 +35,26 @@ RCPS = ['45', '85']
 RUNS_FLAG = True
 RUNS = ['', 'grz_mnr', 'nsyn_grz', 'nsyn_mnr']
 
-UNIX_UTILS_DIR = {'posix':'/usr/bin', 'nt':'E:\\Freeware\\UnxUtils\\usr\\local\\wbin'}
-
 CLEAN_FLAG = True
 
 class Form(object):
     """
-    CDO operations in batch mode
+    SuperG operations in batch mode
     """
-    def __init__(self):
+    def __init__(self, superg_dir=None, nworkers=None, profile_name=DEFAULT_PROFILE):
         """
-
+        nworkers of None means one worker process for each CPU
         """
-        if os_name == 'posix':
-            cdo_exe = join(UNIX_UTILS_DIR[os_name], 'cdo')
-            if not isfile(cdo_exe):
-                print(ERROR_STR + cdo_exe + ' does not exist, cannot continue')
-                sleep(sleepTime)
-                exit(1)
-
-            superg_dir = '/mnt/e/SuperG_MA/co2e_results_2022_10_03'
-        else:
-            cdo_exe = 'cdo_exe'
-            superg_dir = 'E:\\SuperG_MA\\co2e_results_2022_10_03'
+        if superg_dir is None:
+            if os_name == 'posix':
+                superg_dir = '/mnt/e/SuperG_MA/co2e_results_2022_10_03'
+            else:
+                superg_dir = 'E:\\SuperG_MA\\co2e_results_2022_10_03'
+
+        if not isdir(superg_dir):
+            print(ERROR_STR + superg_dir + ' does not exist, cannot continue')
+            sleep(sleepTime)
+            exit(1)
 
         results_dir = join(superg_dir, 'results')
         if not isdir(results_dir):
@@ -61,8 +62,8 @@ class Form(object):
 
         self.superg_dir = superg_dir
         self.results_dir = results_dir
-        self.touch_exe = join(UNIX_UTILS_DIR[os_name], 'touch.exe')
-        self.cdo_exe = cdo_exe
+        self.nworkers = nworkers
+        self.profile_name = profile_name
 
     def prepare_ops(self):
         """
@@ -79,12 +80,13 @@ class Form(object):
 
         self.rslts_rel_dir = rslts_rel_dir
 
-    def subtract_runs(self):
+    def run_tasks(self):
         """
-         
+        difference between each RCP and each of its runs
         """
         rslts_rel_dir = self.rslts_rel_dir
 
+        nc_tasks = []
         for rcp in RCPS:
             prefix = '_'.join([EU28, rcp, '10'])
             rcp_nc = '_'.join([prefix, CO2E])
@@ -94,20 +96,13 @@ class Form(object):
 
                 print('\nrcp_nc: {}\trun_nc: {}'.format(isfile(rcp_nc), isfile(run_nc)))
 
-                cmd_str = self.cdo_exe + ' sub ' + rcp_nc + ' ' + run_nc + ' ' + out_nc
-                if os_name == 'posix':
-                    system(cmd_str)
-                else:
-                    print('cmd_str runs: ' + cmd_str)
-                    cmd_str = self.touch_exe  + ' ' + out_nc
-                    system(cmd_str)
+                nc_tasks.append((rcp_nc, run_nc, out_nc, 'sub', None, self.profile_name))
 
-        print('\n************')
-        return True
+        return nc_tasks
 
-    def subtract_rcps(self):
+    def rcp_tasks(self):
         """
-
+        difference between the RCPs for each run
         """
         rslts_rel_dir = self.rslts_rel_dir
 
@@ -115,6 +110,7 @@ class Form(object):
         prefix_85 = '_'.join([EU28, RCPS[1], '10'])
         prefix_out = '_'.join([EU28, RCPS[0], RCPS[1], '10'])
 
+        nc_tasks = []
         for run in RUNS:
 
             if run == '':
@@ -130,39 +126,56 @@ class Form(object):
 
             print('\nnc_45: {}\tnc_85: {}'.format(isfile(nc_45), isfile(nc_85)))
 
-            cmd_str = self.cdo_exe + ' sub ' + nc_45 + ' ' + nc_85 + ' ' + out_nc
-            if os_name == 'posix':
-                system(cmd_str)
-            else:
-                print('cmd_str rcps: ' + cmd_str)
-                cmd_str = self.touch_exe + ' ' + out_nc
-                system(cmd_str)
+            nc_tasks.append((nc_45, nc_85, out_nc, 'sub', None, self.profile_name))
+
+        return nc_tasks
+
+    def subtract_runs(self):
+        """
+        return True if every difference was written
+        """
+        nc_tasks = self.run_tasks()
+        return run_nc_operations(nc_tasks, self.nworkers) == len(nc_tasks)
 
-        return True
+    def subtract_rcps(self):
+        """
+        return True if every difference was written
+        """
+        nc_tasks = self.rcp_tasks()
+        return run_nc_operations(nc_tasks, self.nworkers) == len(nc_tasks)
 
 def main():
     """
     Entry point
+    differences between runs and between RCPs are independent so are run together
     """
     argparser = ArgumentParser( prog = __prog__, description = 'perform SuperG CDO operations')
 
     argparser.add_argument('--version', action = 'version', version = '{} {}'.format(__prog__, __version__),
                                                                         help = 'Display the version number.')
+    argparser.add_argument('--superg_dir', default = None, help = 'directory of net CO2e NC files')
+    argparser.add_argument('--nworkers', type = int, default = None,
+                                                help = 'number of worker processes, default is one for each CPU')
+    argparser.add_argument('--profile', default = DEFAULT_PROFILE, choices = list(NC_PROFILES),
+                                                                help = 'chunking and compression of output files')
     args = argparser.parse_args()
 
-    prfrm_ops = Form()
+    prfrm_ops = Form(args.superg_dir, args.nworkers, args.profile)
     curr_dir = getcwd()
 
     prfrm_ops.prepare_ops()
 
+    nc_tasks = []
     if RUNS_FLAG:
-        prfrm_ops.subtract_runs()
+        nc_tasks += prfrm_ops.run_tasks()
 
     if RCPS_FLAG:
-        prfrm_ops.subtract_rcps()
+        nc_tasks += prfrm_ops.rcp_tasks()
+
+    nsuccess = run_nc_operations(nc_tasks, prfrm_ops.nworkers)
 
     chdir(curr_dir)
-    exit(0)
+    exit(0 if nsuccess == len(nc_tasks) else 1)
 
 if __name__ == '__main__':
     main()
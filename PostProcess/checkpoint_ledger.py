@@ -0,0 +1,304 @@
+#-------------------------------------------------------------------------------
+# Name:        checkpoint_ledger.py
+# Purpose:     record each aggregated grid cell so that aggregation can be resumed or run incrementally
+# Author:      agent
+# Created:     18/10/2026
+# Description: records for each grid cell are appended to segment files, one per metric per run, and the ledger
+#              notes where they are together with the size and modification time of each SUMMARY.OUT file
+#              the usual <study>_<metric>.txt files are then assembled by merging the segments, which are at the same
+#              time compacted into a single segment file for each metric so that they do not accumulate with resumes
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'checkpoint_ledger.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import listdir, makedirs, remove, replace, stat
+from os.path import join, isdir, isfile
+from csv import writer
+from io import StringIO
+from json import loads as json_loads, dumps as json_dumps
+from locale import getpreferredencoding
+
+from manifest_index import make_cell_id
+
+LEDGER_FN = 'ledger.txt'
+SEGMENT_SUFFIX = '.seg'
+FLUSH_NCELLS = 200      # write ledger entries to disk after this number of cells
+ENCODING = getpreferredencoding(False)      # same as CSV files written by SpecCsv
+
+WARNING_STR = '*** Warning *** '
+
+def format_records(records):
+    """
+    return records formatted exactly as they are written by SpecCsv i.e. tab separated with \r\n line endings
+    """
+    sbuf = StringIO(newline='')
+    writer(sbuf, delimiter='\t').writerows(records)
+
+    return sbuf.getvalue().encode(ENCODING)
+
+class CheckpointLedger(object):
+    """
+    ledger of grid cells aggregated so far, stored alongside the CSV results
+    """
+    def __init__(self, sims_dir, output_dir, study, settings):
+        """
+        settings are those which affect the content of the records e.g. metrics and years - if they differ from those
+        of the existing ledger then the ledger is discarded
+        """
+        self.sims_dir = sims_dir
+        self.settings = settings
+        self.ckpt_dir = join(output_dir, study + '_checkpoint')
+        self.ledger_fn = join(self.ckpt_dir, LEDGER_FN)
+        self.entries = {}
+        self.nskipped = 0
+        self.skipped_area = 0.0
+        self.pending = []
+
+        if not isdir(self.ckpt_dir):
+            makedirs(self.ckpt_dir)
+
+        self._read_ledger(settings)
+
+        # each run appends to its own segment files
+        # =========================================
+        run_ids = [0]
+        for fname in listdir(self.ckpt_dir):
+            if fname.endswith(SEGMENT_SUFFIX):
+                run_ids.append(int(fname[:-len(SEGMENT_SUFFIX)].split('_')[-1]))
+        self.run_id = max(run_ids) + 1
+        self.seg_fobjs = {}
+
+        new_ledger = not isfile(self.ledger_fn)
+        if not new_ledger:
+            self._truncate_incomplete_line()
+        self.ledger_fobj = open(self.ledger_fn, 'a')
+        if new_ledger:
+            self.ledger_fobj.write(json_dumps({'settings': settings}) + '\n')
+            self.ledger_fobj.flush()
+
+        print('Checkpoint ledger {} holds {} grid cells'.format(self.ledger_fn, len(self.entries)))
+
+    def _read_ledger(self, settings):
+        """
+        last entry for a grid cell takes precedence; an incomplete last line, e.g. following a crash, is ignored
+        """
+        if not isfile(self.ledger_fn):
+            return
+
+        with open(self.ledger_fn, 'r') as fobj:
+            lines = fobj.readlines()
+
+        try:
+            ledger_settings = json_loads(lines[0])['settings']
+        except (IndexError, ValueError, KeyError):
+            ledger_settings = None
+
+        if ledger_settings != settings:
+            print(WARNING_STR + 'aggregation settings have changed - will discard checkpoint ledger ' + self.ledger_fn)
+            self._discard()
+            return
+
+        for line in lines[1:]:
+            try:
+                entry = json_loads(line)
+            except ValueError:
+                break
+            self.entries[entry['cell']] = entry
+
+    def _truncate_incomplete_line(self):
+        """
+        remove an incomplete last line, e.g. following a crash, so that entries appended by this run start on a
+        new line and are not lost to the incomplete one
+        """
+        with open(self.ledger_fn, 'rb+') as fobj:
+            contents = fobj.read()
+            nkeep = contents.rfind(b'\n') + 1
+            if nkeep < len(contents):
+                print(WARNING_STR + 'removing incomplete last entry of checkpoint ledger ' + self.ledger_fn)
+                fobj.truncate(nkeep)
+
+    def _segment_fname(self, varname, run_id):
+        return join(self.ckpt_dir, '{}_{}{}'.format(varname, run_id, SEGMENT_SUFFIX))
+
+    def _discard(self):
+        """
+        remove ledger and segment files
+        """
+        for fname in listdir(self.ckpt_dir):
+            if fname == LEDGER_FN or fname.endswith(SEGMENT_SUFFIX):
+                remove(join(self.ckpt_dir, fname))
+
+    def cell_signature(self, cell_sub_dirs, mani_index):
+        """
+        key and signature of a grid cell - size and modification time of each SUMMARY.OUT and of the manifest
+        """
+        cell_sig = []
+        for sub_dir in cell_sub_dirs:
+            try:
+                fstat = stat(join(self.sims_dir, sub_dir, 'SUMMARY.OUT'))
+                cell_sig.append([sub_dir, fstat.st_size, fstat.st_mtime_ns])
+            except OSError:
+                cell_sig.append([sub_dir, -1, -1])
+
+        cell_id = make_cell_id(cell_sub_dirs[-1])
+        if cell_id in mani_index.cells:
+            cell_sig.append(mani_index.cells[cell_id][:2])
+
+        return cell_sub_dirs[0], cell_sig
+
+    def is_current(self, cell_key, cell_sig):
+        """
+        grid cell is current if it has been aggregated and none of its SUMMARY.OUT files have since changed
+        """
+        if cell_key in self.entries and self.entries[cell_key]['sig'] == cell_sig:
+            self.nskipped += 1
+            self.skipped_area += self.entries[cell_key]['area']
+            return True
+
+        return False
+
+    def add_cell(self, cell_key, cell_sig, nfailed, area, records):
+        """
+        append records for each metric to this run's segment files and note their locations
+        """
+        locations = {}
+        for varname in records:
+            if varname not in self.seg_fobjs:
+                self.seg_fobjs[varname] = open(self._segment_fname(varname, self.run_id), 'ab')
+
+            rec_bytes = format_records(records[varname])
+            locations[varname] = [self.run_id, self.seg_fobjs[varname].tell(), len(rec_bytes)]
+            self.seg_fobjs[varname].write(rec_bytes)
+
+        entry = {'cell': cell_key, 'sig': cell_sig, 'nfailed': nfailed, 'area': area, 'recs': locations}
+        self.entries[cell_key] = entry
+        self.pending.append(entry)
+        if len(self.pending) >= FLUSH_NCELLS:
+            self.flush()
+
+    def flush(self):
+        """
+        segments are flushed before the ledger so the ledger never refers to records which are not on disk
+        """
+        for varname in self.seg_fobjs:
+            self.seg_fobjs[varname].flush()
+
+        for entry in self.pending:
+            self.ledger_fobj.write(json_dumps(entry, separators=(',', ':')) + '\n')
+        self.ledger_fobj.flush()
+        self.pending = []
+
+    def close(self):
+        """
+        flush outstanding entries then close segment and ledger files
+        """
+        self.flush()
+        for varname in self.seg_fobjs:
+            self.seg_fobjs[varname].close()
+        self.ledger_fobj.close()
+
+    def merge(self, cell_keys, varnames, hdr_rec, output_dir, study):
+        """
+        write the usual per metric <study>_<metric>.txt files with grid cells in the order given by cell_keys
+        records are also copied to a new segment file for each metric which, once the ledger has been rewritten to
+        refer to them, replace the segment files of all earlier runs
+        """
+        hdr_bytes = format_records([hdr_rec])
+        out_fobjs = {}
+        for varname in varnames:
+            fname = join(output_dir, study + '_{0}.txt'.format(varname))
+            try:
+                out_fobjs[varname] = open(fname, 'wb')
+            except (PermissionError, OSError, IOError) as err:
+                print('Unable to open output file. {}'.format(err))
+                for key in out_fobjs:
+                    out_fobjs[key].close()
+                return -1
+
+            out_fobjs[varname].write(hdr_bytes)
+
+        # compacted segments are written by a run of their own
+        # ====================================================
+        cmpct_id = self.run_id + 1
+        cmpct_fobjs = {}
+        try:
+            for varname in out_fobjs:
+                cmpct_fobjs[varname] = open(self._segment_fname(varname, cmpct_id), 'wb')
+        except OSError as err:
+            print(WARNING_STR + 'could not compact checkpoint segments - {}'.format(err))
+            for key in cmpct_fobjs:
+                cmpct_fobjs[key].close()
+            cmpct_fobjs = None
+
+        seg_fobjs = {}
+        cmpct_entries = {}
+        ncells = 0
+        for cell_key in cell_keys:
+            if cell_key not in self.entries:
+                continue
+
+            locations = self.entries[cell_key]['recs']
+            cmpct_locations = {}
+            for varname in locations:
+                if varname not in out_fobjs:
+                    continue
+
+                run_id, offset, nbytes = locations[varname]
+                seg_key = (varname, run_id)
+                if seg_key not in seg_fobjs:
+                    seg_fobjs[seg_key] = open(self._segment_fname(varname, run_id), 'rb')
+
+                seg_fobjs[seg_key].seek(offset)
+                rec_bytes = seg_fobjs[seg_key].read(nbytes)
+                out_fobjs[varname].write(rec_bytes)
+                if cmpct_fobjs is not None:
+                    cmpct_locations[varname] = [cmpct_id, cmpct_fobjs[varname].tell(), nbytes]
+                    cmpct_fobjs[varname].write(rec_bytes)
+
+            cmpct_entries[cell_key] = dict(self.entries[cell_key], recs=cmpct_locations)
+            ncells += 1
+
+        for key in seg_fobjs:
+            seg_fobjs[key].close()
+        for key in out_fobjs:
+            out_fobjs[key].close()
+
+        print('Merged {} grid cells from checkpoint ledger into {} files'.format(ncells, len(out_fobjs)))
+
+        if cmpct_fobjs is not None:
+            for key in cmpct_fobjs:
+                cmpct_fobjs[key].close()
+            self._compact(cmpct_entries, cmpct_id)
+
+        return ncells
+
+    def _compact(self, cmpct_entries, cmpct_id):
+        """
+        rewrite the ledger to refer only to the compacted segments then remove all other segment files
+        should the ledger not be replaced, the compacted segments are unused and are removed by the next compaction
+        """
+        tmp_fn = self.ledger_fn + '.tmp'
+        try:
+            with open(tmp_fn, 'w') as fobj:
+                fobj.write(json_dumps({'settings': self.settings}) + '\n')
+                for cell_key in cmpct_entries:
+                    fobj.write(json_dumps(cmpct_entries[cell_key], separators=(',', ':')) + '\n')
+            replace(tmp_fn, self.ledger_fn)
+        except OSError as err:
+            print(WARNING_STR + 'could not rewrite checkpoint ledger {} - {}'.format(self.ledger_fn, err))
+            return
+
+        self.entries = cmpct_entries
+        nremoved = 0
+        cmpct_suffix = '_{}{}'.format(cmpct_id, SEGMENT_SUFFIX)
+        for fname in listdir(self.ckpt_dir):
+            if fname.endswith(SEGMENT_SUFFIX) and not fname.endswith(cmpct_suffix):
+                try:
+                    remove(join(self.ckpt_dir, fname))
+                    nremoved += 1
+                except OSError as err:
+                    print(WARNING_STR + 'could not remove checkpoint segment {} - {}'.format(fname, err))
+
+        print('Compacted checkpoint segments, removing {} segment files'.format(nremoved))
@@ -0,0 +1,298 @@
+#-------------------------------------------------------------------------------
+# Name:        climate_cache.py
+# Purpose:     persistent binary cube of the monthly weather of every weather directory of a simulations directory
+# Author:      agent
+# Created:     18/10/2026
+# Description: the cache is a directory <study>_climate alongside the study definition file holding:
+#                   climate.json  - header: for each weather directory its name, fingerprint of its met files,
+#                                   offset of its first month in the cube and number of months of each met file
+#                   climate.f32   - float32 matrix of months x 3 i.e. precip, pet and temp, read as a memory map
+#              fingerprint is the name, size and modification time of each met file; an entry is reread from the
+#              met files when its fingerprint changes i.e. when met files are added, removed, replaced or edited in
+#              place, otherwise it is copied from the existing cube
+#              the header records the modification time of the cube it describes so a header left from an earlier
+#              cube is ignored
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'climate_cache.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import makedirs, replace, stat
+from os.path import join, split, isdir, isfile
+from json import load as json_load, dump as json_dump
+from multiprocessing import Pool
+from glob import glob
+from time import time
+
+from numpy import fromstring, memmap, empty, concatenate, float32, float64
+
+from sims_inventory import fetch_sims_inventory
+
+CACHE_VERSION = 3
+CACHE_SUFFIX = '_climate'
+HEADER_FN = 'climate.json'
+CUBE_FN = 'climate.f32'
+CLIMATE_VARS = ['precip', 'pet', 'temp']
+CHUNK_SIZE = 64            # number of weather directories passed to a worker process in a single task
+
+WARNING_STR = '*** Warning *** '
+
+def climate_cache_dir(sims_dir):
+    """
+    cache lives alongside the study definition file
+    """
+    root_dir, study = split(sims_dir)
+
+    return join(root_dir, study + CACHE_SUFFIX)
+
+def list_wthr_dirs(sims_dir):
+    """
+    weather directories are named after their granular coordinates e.g. 4770_20490 and are taken from the inventory
+    """
+    inventory = fetch_sims_inventory(sims_dir)
+    if inventory is None:
+        return []
+
+    return sorted(join(sims_dir, wthr_dir) for wthr_dir in inventory.iter_wthr_dirs())
+
+def list_met_files(wthr_dir):
+    """
+    met files of a weather directory in year order
+    """
+    return sorted(glob(join(wthr_dir, 'met*s.txt')))
+
+def met_files_fingerprint(met_fnames):
+    """
+    name, size and modification time of each met file - lists rather than tuples so that a fingerprint read
+    from the header compares equal
+    """
+    fingerprint = []
+    for met_fname in met_fnames:
+        try:
+            met_stat = stat(met_fname)
+        except OSError:
+            continue
+        fingerprint.append([split(met_fname)[1], met_stat.st_size, met_stat.st_mtime_ns])
+
+    return fingerprint
+
+def read_met_files(wthr_dir, met_fnames=None):
+    """
+    return matrix of monthly precip, pet and temp of all met files of a weather directory, in year order,
+    together with number of months in each file or None if a file cannot be read
+    met files are tab separated: month, precip, pet, temp
+    """
+    if met_fnames is None:
+        met_fnames = list_met_files(wthr_dir)
+
+    met_vals = []
+    nmnths_yrs = []
+    for met_fname in met_fnames:
+        try:
+            with open(met_fname, 'r') as fobj:
+                vals = fromstring(fobj.read(), dtype=float64, sep=' ')
+        except (OSError, ValueError):
+            return None
+
+        if len(vals) % 4 != 0:
+            return None
+
+        if len(vals) == 0:
+            continue
+
+        met_vals.append(vals.reshape(-1, 4)[:, 1:])
+        nmnths_yrs.append(met_vals[-1].shape[0])
+
+    if len(nmnths_yrs) == 0:
+        return None
+
+    return concatenate(met_vals), nmnths_yrs
+
+def _read_wthr_dir(met_task):
+    """
+    read met files, listed when the fingerprint was taken, in a worker process
+    return float32 matrix and months of each year, or None
+    """
+    wthr_dir, met_fnames = met_task
+    met_data = read_met_files(wthr_dir, met_fnames)
+    if met_data is None:
+        return None
+
+    met_vals, nmnths_yrs = met_data
+
+    return met_vals.astype(float32), nmnths_yrs
+
+def _read_wthr_dirs(met_tasks, nworkers):
+    """
+    yield met data of each weather directory, in order, either in this process or using a pool of workers
+    """
+    if nworkers <= 1 or len(met_tasks) <= 1:
+        for met_task in met_tasks:
+            yield _read_wthr_dir(met_task)
+    else:
+        with Pool(nworkers) as pool:
+            for met_data in pool.imap(_read_wthr_dir, met_tasks, CHUNK_SIZE):
+                yield met_data
+
+class ClimateCube(object):
+    """
+    monthly weather of each weather directory held in a single matrix, normally memory mapped from the cache
+    """
+    def __init__(self, entries, cube):
+        """
+        entries: dictionary keyed by name of weather directory of fingerprint, offset and months of each year
+        cube:    matrix of months x 3 i.e. precip, pet and temp
+        """
+        self.entries = entries
+        self.cube = cube
+
+    def __len__(self):
+        return len(self.entries)
+
+    def wthr_dir_names(self):
+        """
+        names of weather directories with weather in the cube
+        """
+        return list(self.entries.keys())
+
+    def climate(self, wthr_dir_name):
+        """
+        return monthly precip, pet and temp as float64 arrays and number of months of each year
+        """
+        fingerprint, offset, nmnths_yrs = self.entries[wthr_dir_name]
+        vals = self.cube[offset:offset + sum(nmnths_yrs)].astype(float64)
+
+        return vals[:, 0], vals[:, 1], vals[:, 2], nmnths_yrs
+
+def _read_cache(cache_dir):
+    """
+    return entries and memory mapped cube of a complete cache, otherwise None
+    """
+    hdr_fn = join(cache_dir, HEADER_FN)
+    cube_fn = join(cache_dir, CUBE_FN)
+    if not isfile(hdr_fn) or not isfile(cube_fn):
+        return None
+
+    try:
+        with open(hdr_fn, 'r') as fobj:
+            header = json_load(fobj)
+    except (OSError, ValueError):
+        return None
+
+    cube_stat = stat(cube_fn)
+    if header.get('version') != CACHE_VERSION or header.get('nmonths', -1) * 3 * 4 != cube_stat.st_size \
+                                                        or header.get('cube_mtime_ns') != cube_stat.st_mtime_ns:
+        return None
+
+    entries = {name: tuple(entry) for name, entry in header['entries'].items()}
+    if header['nmonths'] == 0:
+        return entries, empty((0, 3), dtype=float32)
+
+    return entries, memmap(cube_fn, dtype=float32, mode='r', shape=(header['nmonths'], 3))
+
+def fetch_climate_cube(sims_dir, wthr_dirs=None, nworkers=1):
+    """
+    return ClimateCube for the weather directories of the simulations directory, updating the cache first if any
+    weather directory is new or has changed since the cache was written
+    if the cache cannot be written, for example in a read only directory, the cube is held in memory
+    weather directories whose met files cannot be read are omitted
+    """
+    if wthr_dirs is None:
+        wthr_dirs = list_wthr_dirs(sims_dir)
+
+    cache_dir = climate_cache_dir(sims_dir)
+    cached = _read_cache(cache_dir)
+    old_entries, old_cube = ({}, None) if cached is None else cached
+
+    # identify weather directories which must be read
+    # ===============================================
+    fingerprints = {}
+    stale_tasks = []
+    for wthr_dir in wthr_dirs:
+        name = split(wthr_dir)[1]
+        met_fnames = list_met_files(wthr_dir)
+        fingerprints[name] = met_files_fingerprint(met_fnames)
+        if name not in old_entries or old_entries[name][0] != fingerprints[name]:
+            stale_tasks.append((wthr_dir, met_fnames))
+
+    if len(stale_tasks) == 0 and len(old_entries) == len(wthr_dirs):
+        print('Using climate cache {} of {} weather directories'.format(cache_dir, len(old_entries)))
+        return ClimateCube(old_entries, old_cube)
+
+    strt_time = time()
+    print('Reading met files of {} of {} weather directories to update climate cache {}'
+                                                                .format(len(stale_tasks), len(wthr_dirs), cache_dir))
+    new_data = {}
+    nfailed = 0
+    for (wthr_dir, met_fnames), met_data in zip(stale_tasks, _read_wthr_dirs(stale_tasks, nworkers)):
+        if met_data is None:
+            nfailed += 1
+        else:
+            new_data[split(wthr_dir)[1]] = met_data
+
+    if nfailed > 0:
+        print(WARNING_STR + 'could not read met files of {} weather directories'.format(nfailed))
+
+    # assemble new cube from unchanged entries of the existing cube and those just read
+    # ==================================================================================
+    entries = {}
+    blocks = []
+    offset = 0
+    for wthr_dir in wthr_dirs:
+        name = split(wthr_dir)[1]
+        if name in new_data:
+            met_vals, nmnths_yrs = new_data[name]
+        elif name in old_entries and old_entries[name][0] == fingerprints[name]:
+            old_offset, nmnths_yrs = old_entries[name][1:]
+            met_vals = old_cube[old_offset:old_offset + sum(nmnths_yrs)]
+        else:
+            continue
+
+        entries[name] = (fingerprints[name], offset, list(nmnths_yrs))
+        blocks.append(met_vals)
+        offset += met_vals.shape[0]
+
+    cube = concatenate(blocks).astype(float32) if len(blocks) > 0 else empty((0, 3), dtype=float32)
+
+    # release all references to the memory map so that the cube file can be replaced, required on Windows
+    # ====================================================================================================
+    met_vals = None
+    del blocks, cached, old_cube
+
+    if _write_cache(cache_dir, entries, cube):
+        cached = _read_cache(cache_dir)
+        if cached is not None:
+            entries, cube = cached
+
+    print('Climate cube of {} weather directories and {} months assembled in {:.1f} seconds'
+                                                        .format(len(entries), cube.shape[0], time() - strt_time))
+
+    return ClimateCube(entries, cube)
+
+def _write_cache(cache_dir, entries, cube):
+    """
+    cube is written first and header last; the header is only valid for a cube with its recorded modification time
+    so that no header need be removed - return True if the cache was written
+    """
+    hdr_fn = join(cache_dir, HEADER_FN)
+    cube_fn = join(cache_dir, CUBE_FN)
+    try:
+        if not isdir(cache_dir):
+            makedirs(cache_dir)
+
+        with open(cube_fn + '.tmp', 'wb') as fobj:
+            fobj.write(cube.tobytes())
+        replace(cube_fn + '.tmp', cube_fn)
+        cube_mtime_ns = stat(cube_fn).st_mtime_ns
+
+        with open(hdr_fn + '.tmp', 'w') as fobj:
+            json_dump({'version': CACHE_VERSION, 'nmonths': cube.shape[0], 'cube_mtime_ns': cube_mtime_ns,
+                        'vars': CLIMATE_VARS, 'entries': entries}, fobj, separators=(',', ':'))
+        replace(hdr_fn + '.tmp', hdr_fn)
+
+    except OSError as err:
+        print(WARNING_STR + 'could not write climate cache {} - {}'.format(cache_dir, err))
+        return False
+
+    return True
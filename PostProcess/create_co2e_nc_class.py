@@ -17,9 +17,10 @@ from os import remove
 import time
 from netCDF4 import Dataset
 from numpy import arange, float64
-from PyQt5.QtWidgets import QApplication
 
+from input_output_funcs import process_gui_events
 from nc_low_level_fns import generate_mnthly_atimes
+from nc_profiles import fetch_nc_profile, create_profiled_variable
 
 MISSING_VALUE = -999.0
 MAX_FIELDS_MONTHLY = 3600     # if there are more than this number of fields then assume CSV files are from a daily timestep
@@ -37,10 +38,13 @@ def create_co2e_nc_dset(form, metric_obj):
     fout_name = metric_obj.fout_name
 
     nfields = form.trans_defn['nfields']
+    profile_name = fetch_nc_profile(form)
     delete_flag = form.w_del_nc.isChecked()
 
     resolution = form.study_defn['resolution']
     fut_end_year = form.study_defn['futEndYr']
+    if 'period' in form.trans_defn:
+        fut_end_year = form.trans_defn['period'][1]     # conversion restricted to a period of years
     clim_dset = form.study_defn['climScnr']
 
     # expand bounding box to make sure all results are included
@@ -138,7 +142,8 @@ def create_co2e_nc_dset(form, metric_obj):
 
     # create the area variable
     # ========================
-    areas = nc_dset.createVariable('area', 'f4', ('latitude', 'longitude'), fill_value=MISSING_VALUE)
+    areas = create_profiled_variable(nc_dset, profile_name, 'area', 'f4', ('latitude', 'longitude'),
+                                                                                               fill_value=MISSING_VALUE)
     areas.description = 'grid cell area'
     areas.long_name = 'area'
     areas.units = 'km**2'
@@ -147,7 +152,8 @@ def create_co2e_nc_dset(form, metric_obj):
     # create the time dependent metrics and assign default data
     # =========================================================
     var_name = metric_obj.var_name
-    var_varia = nc_dset.createVariable(var_name, 'f4', ('time', 'latitude','longitude'), fill_value=MISSING_VALUE)
+    var_varia = create_profiled_variable(nc_dset, profile_name, var_name, 'f4', ('time', 'latitude','longitude'),
+                                                                                               fill_value=MISSING_VALUE)
     var_varia.long_name = metric_obj.long_name
     var_varia.units = metric_obj.units
 
@@ -158,7 +164,7 @@ def create_co2e_nc_dset(form, metric_obj):
 
     mess = 'Created: ' + fout_name
     print(mess)
-    QApplication.processEvents()
+    process_gui_events()
 
     return fout_name, var_name, nmonths
 
@@ -20,6 +20,7 @@ from netCDF4 import Dataset
 from numpy import arange, float64
 
 from nc_low_level_fns import generate_mnthly_atimes
+from nc_profiles import fetch_nc_profile, create_profiled_variable
 
 MISSING_VALUE = -999.0
 MAX_FIELDS_MONTHLY = 3600     # if there are more than this number of fields then assume CSV files are from a daily timestep
@@ -28,14 +29,14 @@ FLUXES = list(['ch4', 'co2', 'no3', 'n2o'])
 def find_metric_in_flist_names(file_list, metric):
     '''
     identify if metric appears in a file from list e.g. soc in G:\GlblEcssOutpts\EcosseOutputs\ANoirt\ANoirt_soc.nc
+    NB when results are held in a binary results store the files are named but need not exist
     '''
     metric_found = False
 
     for fname in file_list:
-        if isfile(fname):
-            if fname.split('_')[-1] == metric + '.txt':
-                metric_found = True
-                break
+        if fname.split('_')[-1] == metric + '.txt':
+            metric_found = True
+            break
 
     if metric_found:
         return fname
@@ -56,9 +57,12 @@ def create_coards_nc_dset(form, metric_obj):
 
     nfields      = form.trans_defn['nfields']
     delete_flag  = form.w_del_nc.isChecked()
+    profile_name = fetch_nc_profile(form)
 
     resolution     = form.study_defn['resolution']
     fut_end_year   = form.study_defn['futEndYr']
+    if 'period' in form.trans_defn:
+        fut_end_year = form.trans_defn['period'][1]     # conversion restricted to a period of years
     clim_dset = form.study_defn['climScnr']
 
     # expand bounding box to make sure all results are included
@@ -156,14 +160,16 @@ def create_coards_nc_dset(form, metric_obj):
 
     # create the area variable
     # ========================
-    areas = nc_dset.createVariable('area','f4',('latitude','longitude'), fill_value = MISSING_VALUE)
+    areas = create_profiled_variable(nc_dset, profile_name, 'area','f4',('latitude','longitude'),
+                                                                                             fill_value = MISSING_VALUE)
     areas.units = 'km**2'
     areas.MISSING_VALUE = MISSING_VALUE
 
     # create the time dependent metrics and assign default data
     # =========================================================
     var_name = metric_obj.var_name
-    var_varia = nc_dset.createVariable(var_name,'f4',('time', 'latitude','longitude'), fill_value = MISSING_VALUE)
+    var_varia = create_profiled_variable(nc_dset, profile_name, var_name,'f4',('time', 'latitude','longitude'),
+                                                                                             fill_value = MISSING_VALUE)
     var_varia.long_name = metric_obj.long_name
     var_varia.units = metric_obj.units
 
@@ -0,0 +1,142 @@
+#-------------------------------------------------------------------------------
+# Name:        csv_cutter.py
+# Purpose:     cut a period of years from CSV result files without recourse to an external cut utility
+# Author:      agent
+# Created:     18/10/2026
+# Description: each file is streamed through a separate worker process using large buffers; the 8 column line
+#              prefix is retained together with the values for the requested years and the header is rebuilt
+#              for those years; output is written to a temporary file which is renamed only when complete
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'csv_cutter.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import replace, remove, cpu_count
+from os.path import isfile, join, split
+from multiprocessing import Pool
+from time import time
+
+from results_blocks import detect_delimiter, DATA_REC_PREFIX_LEN
+from results_index import fetch_results_index
+
+IO_BUFFER_SIZE = 16 * 1024 * 1024
+MAX_FLDS_MNTHLY = 3600     # if number of fields exceeeds this then assume timestep is daily
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+def results_file_years(results_index, fut_end_year):
+    """
+    return first year, last year and number of values per year of a results file
+    years are taken from the header when columns are labelled YYYY-MM, as written by the aggregation, otherwise
+    the file is assumed to end in the future end year of the study
+    """
+    nfields = results_index['nfields']
+    nvals_per_year = 365 if nfields > MAX_FLDS_MNTHLY else 12
+    nyears = nfields // nvals_per_year
+
+    labels = results_index['header'].split(detect_delimiter(results_index['header']))[DATA_REC_PREFIX_LEN:]
+    try:
+        first_year = int(labels[0].split('-')[0])
+        last_year = int(labels[-1].split('-')[0])
+        if len(labels) != nfields or last_year - first_year + 1 != nyears:
+            raise ValueError
+    except (IndexError, ValueError):
+        last_year = fut_end_year
+        first_year = fut_end_year - nyears + 1
+
+    return first_year, last_year, nvals_per_year
+
+def make_cut_header(common_hdrs, strt_year, end_year, nvals_per_year):
+    """
+    line prefix headers followed by one column for each month, or day, of the retained years
+    """
+    hdr_rec = list(common_hdrs)
+    for year in range(strt_year, end_year + 1):
+        for indx in range(1, nvals_per_year + 1):
+            hdr_rec.append('{0}-{1:0>{2}}'.format(year, indx, 2 if nvals_per_year == 12 else 3))
+
+    return hdr_rec
+
+def _cut_file(cut_task):
+    """
+    stream one results file - return output file name, number of lines written and error message or None
+    """
+    fname, fn_out, indx_strt, indx_end, hdr_rec = cut_task
+    fn_tmp = fn_out + '.tmp'
+    nlines = 0
+    try:
+        with open(fname, 'r', buffering=IO_BUFFER_SIZE) as fin, \
+                                                        open(fn_tmp, 'w', buffering=IO_BUFFER_SIZE) as fout:
+            delim = detect_delimiter(fin.readline())
+            out_delim = '\t' if delim is None else delim
+            fout.write(out_delim.join(hdr_rec) + '\n')
+            nlines += 1
+
+            for rec in fin:
+                fields = rec.rstrip('\r\n').split(delim)
+                fout.write(out_delim.join(fields[:DATA_REC_PREFIX_LEN] + fields[indx_strt:indx_end]) + '\n')
+                nlines += 1
+
+        replace(fn_tmp, fn_out)
+
+    except (OSError, UnicodeDecodeError) as err:
+        if isfile(fn_tmp):
+            remove(fn_tmp)
+        return fn_out, nlines, str(err)
+
+    return fn_out, nlines, None
+
+def cut_results_files(file_list, out_dir, strt_year, end_year, fut_end_year, nworkers=None):
+    """
+    cut all files concurrently - returns only when every file is complete
+    return number of files successfully cut or -1 if the period lies outside that of the files
+    """
+    strt_time = time()
+    cut_tasks = []
+    for fname in file_list:
+        results_index = fetch_results_index(fname)
+        first_year, last_year, nvals_per_year = results_file_years(results_index, fut_end_year)
+        if strt_year < first_year or end_year > last_year or strt_year > end_year:
+            print(ERROR_STR + 'period {} to {} lies outside the years {} to {} of {}'
+                                                            .format(strt_year, end_year, first_year, last_year, fname))
+            return -1
+
+        # column indices of retained values
+        # =================================
+        indx_strt = DATA_REC_PREFIX_LEN + (strt_year - first_year) * nvals_per_year
+        indx_end = DATA_REC_PREFIX_LEN + (end_year - first_year + 1) * nvals_per_year
+
+        common_hdrs = results_index['header'].split(detect_delimiter(results_index['header']))[:DATA_REC_PREFIX_LEN]
+        hdr_rec = make_cut_header(common_hdrs, strt_year, end_year, nvals_per_year)
+        fn_out = join(out_dir, split(fname)[1])
+        print('Creating new file: {} for years {} to {}'.format(fn_out, strt_year, end_year))
+        cut_tasks.append((fname, fn_out, indx_strt, indx_end, hdr_rec))
+
+    if len(cut_tasks) == 0:
+        return 0
+
+    if nworkers is None:
+        nworkers = cpu_count() or 1
+    nworkers = max(1, min(nworkers, len(cut_tasks)))
+
+    if nworkers == 1:
+        outcomes = [_cut_file(cut_task) for cut_task in cut_tasks]
+    else:
+        with Pool(nworkers) as pool:
+            outcomes = pool.map(_cut_file, cut_tasks)
+
+    nsuccess = 0
+    for (fname, fn_out, indx_strt, indx_end, hdr_rec), (fn_out, nlines, err) in zip(cut_tasks, outcomes):
+        if err is not None:
+            print(ERROR_STR + 'could not cut {} - {}'.format(fname, err))
+        elif nlines != fetch_results_index(fname)['nlines']:
+            print(WARNING_STR + 'wrote {} lines to {} but {} has {}'
+                                            .format(nlines, fn_out, fname, fetch_results_index(fname)['nlines']))
+        else:
+            nsuccess += 1
+
+    print('Cut {} of {} files in {:.1f} seconds'.format(nsuccess, len(cut_tasks), time() - strt_time))
+
+    return nsuccess
@@ -0,0 +1,322 @@
+#-------------------------------------------------------------------------------
+# Name:        csv_to_all_ncs.py
+# Purpose:     write COARDS per metric, net CO2e, raw and statistics NC files in a single pass through the CSV files
+# Author:      agent
+# Created:     18/10/2026
+# Description: the CSV files, or results store, are read once and each cell is written to every requested NC file
+#              via its own write buffer; the per product writers are those used by the individual converters
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'csv_to_all_ncs.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os.path import split, splitext
+from locale import format_string
+from time import time
+from netCDF4 import Dataset
+
+from input_output_funcs import generate_results_lines, conversion_period
+from create_coards_nc_class import create_coards_nc_dset, Coard_nc_defn, find_metric_in_flist_names
+from create_co2e_nc_class import create_co2e_nc_dset, Co2eNcDefn
+from netcdf_funcs import create_raw_nc_dset
+from nc_low_level_fns import get_nc_coords, update_progress_bar
+from nc_write_buffer import NcWriteBuffer
+from nc_profiles import fetch_nc_profile, apply_chunk_cache, report_nc_file
+from csv_to_coards_nc import rescale_metric_values, NC_METRICS, MAX_FIELDS_MONTHLY
+from csv_to_co2e_nc import convert_to_co2e, METRICS as CO2E_METRICS
+from csv_to_raw_nc import write_raw_cell, METRICS as RAW_METRICS, SOIL_METRICS
+from nc_statistics import open_stats_output, METRICS as STATS_METRICS
+
+PRODUCTS = ['coards', 'co2e', 'raw']
+OPTIONAL_PRODUCTS = ['stats']     # written when requested or selected in the GUI
+MAX_LINES = 10000000000  # stop processing after this number of lines
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+class NcOutput(object):
+    """
+    one NC file being written during the single pass
+    """
+    def __init__(self, product, nc_fname, nc_dset, bbox_nc, profile_name, var_name=None, metric=None,
+                                                                                                    rqrd_metrics=None):
+        """
+        rqrd_metrics: metrics which must have a full set of values before a cell is written
+        """
+        self.product = product
+        self.nc_fname = nc_fname
+        self.nc_dset = nc_dset
+        self.bbox_nc = bbox_nc
+        self.var_name = var_name
+        self.metric = metric
+        self.rqrd_metrics = rqrd_metrics
+        self.max_lat_indx = nc_dset.variables['latitude'].shape[0] - 1
+        self.max_lon_indx = nc_dset.variables['longitude'].shape[0] - 1
+        if var_name is None:
+            self.nc_buffer = NcWriteBuffer(nc_dset)
+        else:
+            self.nc_buffer = NcWriteBuffer(nc_dset, ['area', var_name])
+        apply_chunk_cache(nc_dset, profile_name)
+        self.num_out_lines = 0
+        self.num_bad_lines = 0
+
+    def is_complete(self, atom_tran, ntrans_fields):
+        """
+        all required metrics are present with the expected number of values
+        """
+        if self.rqrd_metrics is None:
+            return True
+
+        for metric in self.rqrd_metrics:
+            if metric not in atom_tran or len(atom_tran[metric]) != ntrans_fields:
+                return False
+
+        return True
+
+    def close(self):
+        """
+        flush buffered values and close NC file - return False if buffered values could not be written
+        """
+        try:
+            self.nc_buffer.close()
+            retcode = True
+        except (IndexError, ValueError, RuntimeError) as err:
+            print('\n' + ERROR_STR + '{}\nwriting buffered values to {}'.format(err, self.nc_fname))
+            retcode = False
+
+        self.nc_dset.close()
+
+        return retcode
+
+def _open_nc_output(product, nc_fname, bbox_nc, profile_name, var_name=None, metric=None, rqrd_metrics=None):
+    """
+    open a newly created NC file for appending
+    """
+    try:
+        nc_dset = Dataset(nc_fname, 'a')
+    except (TypeError, OSError) as err:
+        print(ERROR_STR + 'Unable to open output file {}. {}'.format(nc_fname, err))
+        return None
+
+    return NcOutput(product, nc_fname, nc_dset, bbox_nc, profile_name, var_name, metric, rqrd_metrics)
+
+def _create_nc_outputs(form, products, profile_name, out_dir=None):
+    """
+    create each NC file using the same functions as the individual converters
+    each creation function resets form.bbox_nc so a copy is taken for each file
+    """
+    if out_dir is None:
+        out_dir = form.w_lbl_rslts.text()
+    delete_flag = form.w_del_nc.isChecked()
+    study = form.study_defn['study']
+    land_use = form.study_defn['land_use']
+    file_list = form.trans_defn['file_list']
+
+    nc_outputs = []
+    rqrd_flist = []
+    num_months = form.trans_defn['nfields']
+
+    if 'coards' in products:
+        for metric in NC_METRICS:
+            fname = find_metric_in_flist_names(file_list, metric)
+            if fname is None:
+                continue
+
+            metric_obj = Coard_nc_defn(metric, fname, land_use, out_dir, study, delete_flag)
+            if metric_obj.fout_name is None:
+                continue
+
+            nc_fname, var_name, num_months = create_coards_nc_dset(form, metric_obj)
+            if isinstance(nc_fname, int):
+                continue
+
+            nc_output = _open_nc_output('coards', nc_fname, list(form.bbox_nc), profile_name, var_name, metric,
+                                                                                                    [metric])
+            if nc_output is not None:
+                nc_outputs.append(nc_output)
+                rqrd_flist.append(fname)
+
+    if 'co2e' in products:
+        co2e_flist = [find_metric_in_flist_names(file_list, metric) for metric in CO2E_METRICS]
+        if None in co2e_flist:
+            print(WARNING_STR + 'net GHG fluxes NC file requires ' + ', '.join(CO2E_METRICS) + ' CSV files')
+        else:
+            metric_obj = Co2eNcDefn('co2e', co2e_flist, land_use, out_dir, split(out_dir)[1], delete_flag)
+            if metric_obj.fout_name is not None:
+                nc_fname, var_name, num_months = create_co2e_nc_dset(form, metric_obj)
+                nc_output = _open_nc_output('co2e', nc_fname, list(form.bbox_nc), profile_name, var_name,
+                                                                                    'co2e', list(CO2E_METRICS))
+                if nc_output is not None:
+                    nc_outputs.append(nc_output)
+                    rqrd_flist += co2e_flist
+
+    if 'raw' in products:
+        nc_fname = create_raw_nc_dset(form, RAW_METRICS, SOIL_METRICS, out_dir)
+        if not isinstance(nc_fname, int):
+            nc_output = _open_nc_output('raw', nc_fname, list(form.bbox_nc), profile_name)
+            if nc_output is not None:
+                nc_outputs.append(nc_output)
+                rqrd_flist += file_list
+
+    if 'stats' in products:
+        stats_flist = [fname for fname in file_list if splitext(fname)[0].split('_')[-1] in STATS_METRICS]
+        nvals_per_year = 365 if form.trans_defn['nfields'] > MAX_FIELDS_MONTHLY else 12
+        nc_output = open_stats_output(form, [splitext(fname)[0].split('_')[-1] for fname in stats_flist],
+                                                                                            nvals_per_year, out_dir)
+        if nc_output is not None:
+            nc_outputs.append(nc_output)
+            rqrd_flist += stats_flist
+
+    # each CSV file is opened once regardless of the number of products which use it
+    # ==============================================================================
+    trans_files = [fname for fname in file_list if fname in rqrd_flist]
+
+    return nc_outputs, trans_files, num_months
+
+def _write_cell(form, nc_output, line_prefix, atom_tran, num_months, daily_flag, first_line):
+    """
+    write one cell to one NC file - return 1 if written, 0 if outside the grid and -1 on failure
+    """
+    province, slat, slon, smu_global, wthr_set, num_soil, dummy, sarea = line_prefix
+    area = float(sarea)
+    lat_indx, lon_indx = get_nc_coords(form, float(slat), float(slon), nc_output.max_lat_indx,
+                                                                        nc_output.max_lon_indx, nc_output.bbox_nc)
+    if lat_indx == -1:
+        return 0
+
+    if nc_output.product == 'stats':
+        ntrans_fields = form.trans_defn['nfields']
+        vals = {metric: [atom_tran[metric]] for metric in nc_output.metrics
+                                        if metric in atom_tran and len(atom_tran[metric]) == ntrans_fields}
+        return nc_output.add_cells([lat_indx], [lon_indx], [area], vals)
+
+    nc_buffer = nc_output.nc_buffer
+    if nc_output.product == 'raw':
+        if write_raw_cell(form.lgr, nc_buffer, nc_output.nc_dset.variables, lat_indx, lon_indx, area,
+                                                                    int(smu_global), atom_tran, first_line) == -1:
+            return -1
+        return 1
+
+    try:
+        nc_buffer.set('area', lat_indx, lon_indx, area)
+        if nc_output.product == 'coards':
+            metric = nc_output.metric
+            nc_buffer.set(nc_output.var_name, lat_indx, lon_indx,
+                                            rescale_metric_values(num_months, atom_tran[metric], metric, daily_flag))
+        else:
+            nc_buffer.set(nc_output.var_name, lat_indx, lon_indx, convert_to_co2e(num_months, atom_tran, daily_flag))
+
+    except (IndexError, ValueError, RuntimeError) as err:
+        mess = '\n' + ERROR_STR + '{}\nwriting {} values for metric {}'.format(err, num_months, nc_output.metric)
+        mess += ' at lat/lon indices: {} {}'.format(lat_indx, lon_indx)
+        print(mess)
+        return -1
+
+    return 1
+
+def csv_to_all_netcdfs(form, products=None, strt_year=None, end_year=None, out_dir=None):
+    """
+    read the CSV result files once and write COARDS, net CO2e, raw and statistics NC files as requested
+    by default the statistics NC file is only written if selected in the GUI
+    when a start and/or end year is given only that period is converted
+    net CO2e and raw NC files are written to out_dir, if given, rather than the results directory
+    return True if every NC file was written
+    """
+    retcode = False
+    with conversion_period(form, strt_year, end_year) as period_flag:
+        if period_flag:
+            retcode = _csv_to_all_netcdfs(form, products, out_dir)
+
+    return retcode
+
+def _csv_to_all_netcdfs(form, products, out_dir):
+    """
+    a cell is rejected for a given NC file if any metric required by that file lacks the expected number of values
+    return True if every NC file was written
+    """
+    strt_time = time()
+    if products is None:
+        products = list(PRODUCTS)
+        if hasattr(form, 'w_stats_out') and form.w_stats_out.isChecked():
+            products.append('stats')
+
+    mess = '*** Yearly data will be generated from '
+    ntrans_fields = form.trans_defn['nfields']
+    if ntrans_fields > MAX_FIELDS_MONTHLY:
+        daily_flag = True
+        mess += 'daily'
+    else:
+        daily_flag = False
+        mess += 'monthly'
+
+    print(mess + ' input ***')
+
+    profile_name = fetch_nc_profile(form)
+    nc_outputs, trans_files, num_months = _create_nc_outputs(form, products, profile_name, out_dir)
+    if len(nc_outputs) == 0:
+        print('No NC files to generate')
+        return False
+
+    # single pass through the CSV files or results store
+    # ==================================================
+    trans_lines = generate_results_lines(form.trans_defn, trans_files)
+    ntrans_lines = form.trans_defn['nlines']
+    nlines = 0
+    num_out_lines = 0
+    num_bad_lines = 0
+    failed_flag = False
+    last_time = time()
+    for num_trans_time_vals, nsoil_metrics, line_prefix, atom_tran in trans_lines:
+        if nlines > MAX_LINES:
+            break
+        nlines += 1
+
+        nwritten = 0
+        for nc_output in nc_outputs:
+
+            # check data integrity for this NC file
+            # =====================================
+            if not nc_output.is_complete(atom_tran, ntrans_fields) or \
+                            (nc_output.product == 'raw' and num_trans_time_vals != ntrans_fields):
+                if nc_output.num_bad_lines == 0:
+                    nline_str = format_string("%d", int(nlines), grouping=True)
+                    print('\nBad data at line {} for {}\texpected {} trans fields - will skip'
+                                                .format(nline_str, split(nc_output.nc_fname)[1], ntrans_fields))
+                nc_output.num_bad_lines += 1
+                continue
+
+            retcode = _write_cell(form, nc_output, line_prefix, atom_tran, num_months, daily_flag, nlines == 1)
+            if retcode == -1:
+                failed_flag = True
+                break
+
+            nc_output.num_out_lines += retcode
+            nwritten += retcode
+
+        if failed_flag:
+            break
+
+        if nwritten > 0:
+            num_out_lines += 1
+        else:
+            num_bad_lines += 1
+
+        last_time = update_progress_bar(last_time, ntrans_lines, num_out_lines, num_bad_lines)  # inform user of progress
+
+    # close file objects
+    # ==================
+    trans_lines.close()
+    nsuccess = 0
+    for nc_output in nc_outputs:
+        if nc_output.close() and not failed_flag:
+            nsuccess += 1
+
+    print('\nFinished - having read {} lines once to write {} NC files'.format(nlines, nsuccess))
+    for nc_output in nc_outputs:
+        print('\t{}\tcells written: {}\trejected: {}'.format(split(nc_output.nc_fname)[1],
+                                                                nc_output.num_out_lines, nc_output.num_bad_lines))
+        report_nc_file(nc_output.nc_fname, profile_name, strt_time)
+    print()
+
+    return nsuccess == len(nc_outputs)
@@ -15,12 +15,14 @@ from os.path import split
 from locale import format_string
 from time import time
 from netCDF4 import Dataset
-from PyQt5.QtWidgets import QApplication
+from numpy import asarray, zeros, diff, float64
 
-from input_output_funcs import open_file_sets, read_one_line
+from input_output_funcs import read_results_blocks, conversion_period, process_gui_events
 from create_coards_nc_class import find_metric_in_flist_names
 from create_co2e_nc_class import create_co2e_nc_dset, Co2eNcDefn
-from nc_low_level_fns import get_nc_coords, update_progress_bar
+from nc_low_level_fns import get_nc_coords_block, update_progress_bar
+from nc_write_buffer import NcWriteBuffer
+from nc_profiles import fetch_nc_profile, apply_chunk_cache, report_nc_file
 
 sleepTime = 5
 
@@ -38,36 +40,41 @@ N2O_MOL_MASS_FACTOR = 44.013 / (14.007 * 2.0)  # CO2-C --> CO2
 CO2_MOL_MASS_CONVERSION = 1     # MJM TODO:
 
 ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
 
-def _convert_to_co2e(num_months, metric_vals, daily_flag):
+def convert_to_co2e_block(num_months, soc_vals, ch4_vals, n2o_vals):
     """
-    metric_vals: list of daily or monthly values
+    arrays of monthly values with time as the last axis i.e. cells x months
+    When calculating the change in SOC add the methane-C back in so we don't account for it twice
+    first month is zero since change in SOC, and hence net GHG, cannot be calculated
+    """
+    soc_ch4 = asarray(soc_vals, dtype=float64)[..., :num_months] + asarray(ch4_vals, dtype=float64)[..., :num_months]
+    ch4_vals = asarray(ch4_vals, dtype=float64)[..., 1:num_months]
+    n2o_vals = asarray(n2o_vals, dtype=float64)[..., 1:num_months]
+
+    co2e_vals = zeros(soc_ch4.shape, dtype=float64)
+
+    # Apply Global Warming Potential factors and convert from C to molecular mass
+    # ===========================================================================
+    co2e_vals[..., 1:] = (CO2EQUIV_CH4 * CH4_MOL_MASS_FACTOR) * ch4_vals \
+                                    + (CO2EQUIV_N2O * N2O_MOL_MASS_FACTOR) * n2o_vals \
+                                    - CO2_MOL_MASS_FACTOR * diff(soc_ch4, axis=-1)
+    return co2e_vals
+
+def convert_to_co2e(num_months, metric_vals, daily_flag):
+    """
+    metric_vals: dictionary of daily or monthly values for a single cell
     assume:
         monthly values for now
     """
-    monthly_vals = []
-    for imnth in range(num_months):
-        if imnth > 0:
-            # When calculating the change in SOC add the methane-C back in so
-            # we don't account for it twice
-            #                   (metric_vals['co2'][imnth] * CO2_MOL_MASS_FACTOR)
-            soc1 = metric_vals['soc'][imnth] + metric_vals['ch4'][imnth]
-            soc2 = metric_vals['soc'][imnth - 1] + metric_vals['ch4'][imnth - 1]
-            change_in_soc = soc1 - soc2
-            # Apply Global Warming Potential factors and convert from C to molecular mass
-            co2e = (CO2EQUIV_CH4 * metric_vals['ch4'][imnth] * CH4_MOL_MASS_FACTOR) \
-                   + (CO2EQUIV_N2O * metric_vals['n2o'][imnth] * N2O_MOL_MASS_FACTOR)\
-                   - (change_in_soc * CO2_MOL_MASS_FACTOR)
-        else:
-            co2e = 0.0  # Can't calculate net GHG because can't calculate change in SOC
-        monthly_vals.append(co2e)
-
-    return monthly_vals
+    return convert_to_co2e_block(num_months, metric_vals['soc'], metric_vals['ch4'], metric_vals['n2o'])
 
 def _generate_nc(form, metric_obj, daily_flag):
     """
     C
     """
+    strt_time = time()
+    profile_name = fetch_nc_profile(form)
     nc_fname, var_name, num_months = create_co2e_nc_dset(form, metric_obj)
     if isinstance(nc_fname, int):
         return
@@ -83,83 +90,82 @@ def _generate_nc(form, metric_obj, daily_flag):
 
     max_lat_indx = nc_dset.variables['latitude'].shape[0]  - 1
     max_lon_indx = nc_dset.variables['longitude'].shape[0] - 1
+    nc_buffer = NcWriteBuffer(nc_dset, ['area', var_name])
+    apply_chunk_cache(nc_dset, profile_name)
 
-    # open crop file - TODO: only works for one file
-    # ==============
+    # open crop files or results store - TODO: only works for one file
+    # =================================
     metric = metric_obj.metric
-    trans_fobjs, header_rec = open_file_sets(metric_obj.rqrd_flist)
+    trans_blocks = read_results_blocks(form.trans_defn, metric_obj.rqrd_flist, dtype=float64)
 
-    # read and process each line
-    # ==========================
+    # read and process each block, net GHG fluxes of every cell of the block are derived together
+    # ============================================================================================
     ntrans_lines = form.trans_defn['nlines']
-    ntrans_fields = form.trans_defn['nfields']
     nlines = 0
     num_out_lines = 0
     num_bad_lines = 0
+    num_outside = 0
     last_time = time()
-    while nlines <= MAX_LINES:
-
-        # read in land use transition results
-        # ===================================
-        num_trans_time_vals, nsoil_metrics, line_prefix, atom_tran = read_one_line(trans_fobjs)
-        if atom_tran is None:
+    for block in trans_blocks:
+        if nlines > MAX_LINES:
             break
-        nlines += 1
-
-        # check data integrity
-        # ====================
-        if num_trans_time_vals != ntrans_fields:
-            if num_bad_lines == 0:
-                nline_str = format_string("%d", int(nlines), grouping=True)
-                print('\nBad data at line {}\tfound {} trans fields, expected {} - will skip'
-                                    .format(nline_str, num_trans_time_vals, form.trans_defn['nfields']))
-            num_bad_lines += 1
-        else:
-            # write final result to NetCDF file
-            # =================================
-            total_area = 0.0
-            province, slat, slon, smu_global, wthr_set, num_soil, dummy, sarea = line_prefix
-            area = float(sarea)
-            total_area += area
-            mu_global = int(smu_global)
-            latitude = float(slat)
-            longitude = float(slon)
-
-            lat_indx, lon_indx = get_nc_coords(form, latitude, longitude, max_lat_indx, max_lon_indx)
-            if lat_indx == -1:
-                continue
-
-            if metric == 'soil':
-                pass
-            else:
-                try:
-                    nc_dset.variables['area'][lat_indx, lon_indx] = area
-
-                    nc_dset.variables[var_name][:num_months, lat_indx, lon_indx] = _convert_to_co2e(num_months,
-                                                                                            atom_tran, daily_flag)
-                except (IndexError, ValueError, RuntimeError) as err:
-                    mess = '\n' + ERROR_STR + '{}\nwriting {} values for metric {}'.format(err, num_months, metric)
-                    mess += ' at lat/lon indices: {} {}'.format(lat_indx, lon_indx)
-                    # form.lgr.critical(err)
-                    print(mess)
-                    return -1
-
-            num_out_lines += 1
+        if block.nbad > 0 and num_bad_lines == 0:
+            print('\nBad data in rows {} to {} - will skip'.format(nlines + 1, nlines + block.nrows))
+        nlines += block.nrows
+        num_bad_lines += block.nbad
+
+        lats, lons, areas = block.good_cells()
+        if len(lats) > 0:
+            lat_indxs, lon_indxs = get_nc_coords_block(form.bbox_nc, form.study_defn['resolution'], lats, lons,
+                                                                                        max_lat_indx, max_lon_indx)
+            co2e_vals = convert_to_co2e_block(num_months, block.vals['soc'], block.vals['ch4'], block.vals['n2o'])
+            try:
+                nc_buffer.set_cells('area', lat_indxs, lon_indxs, areas)
+                nwritten = nc_buffer.set_cells(var_name, lat_indxs, lon_indxs, co2e_vals)
+            except (IndexError, ValueError, RuntimeError) as err:
+                print('\n' + ERROR_STR + '{}\nwriting {} values for metric {}'.format(err, num_months, metric))
+                trans_blocks.close()
+                return -1
+
+            num_out_lines += nwritten
+            num_outside += len(lats) - nwritten
 
         last_time = update_progress_bar(last_time, ntrans_lines, num_out_lines, num_bad_lines)  # inform user of progress
 
+    if num_outside > 0:
+        print('\n' + WARNING_STR + '{} cells lie outside the NC grid'.format(num_outside))
+
     # close file objects
     # ==================
-    for key in trans_fobjs:
-        trans_fobjs[key].close()
+    trans_blocks.close()
+    try:
+        nc_buffer.close()
+    except (IndexError, ValueError, RuntimeError) as err:
+        print('\n' + ERROR_STR + '{}\nwriting buffered values to {}'.format(err, nc_fname))
+        nc_dset.close()
+        return -1
 
     nc_dset.close()
-    print('\nFinished - having written {} lines to NC file: {}\n'.format(nlines, nc_fname))
-    QApplication.processEvents()
+    print('\nFinished - having written {} lines to NC file: {}'.format(nlines, nc_fname))
+    report_nc_file(nc_fname, profile_name, strt_time)
+    print()
+    process_gui_events()
 
     return nlines
 
-def csv_to_co2e_netcdf(form):
+def csv_to_co2e_netcdf(form, strt_year=None, end_year=None):
+    """
+    when a start and/or end year is given only that period is converted
+    return True if the NC file was generated
+    """
+    retcode = False
+    with conversion_period(form, strt_year, end_year) as period_flag:
+        if period_flag:
+            retcode = _csv_to_co2e_netcdf(form)
+
+    return retcode
+
+def _csv_to_co2e_netcdf(form):
     """
     C
     """
@@ -211,7 +217,7 @@ def csv_to_co2e_netcdf(form):
     # =================
     if success_flag:
         nlines = _generate_nc(form, metric_obj, daily_flag)
-        if nlines == 0:
+        if nlines is None or nlines <= 0:
             success_flag = False
 
     if success_flag:
@@ -219,4 +225,4 @@ def csv_to_co2e_netcdf(form):
     else:
         print('No annual net GHG fluxes NC file generated')
 
-    return
+    return success_flag
@@ -13,68 +13,82 @@ __version__ = '0.0.1'
 __author__ = 's03mm5'
 
 import os
-from locale import format_string
+from os.path import getsize, split
+from locale import format_string, getpreferredencoding
+from multiprocessing import Pool
 from time import time
 from netCDF4 import Dataset
-from statistics import mean
 from calendar import monthrange
+from numpy import array, asarray, resize, concatenate, cumsum, minimum, add, float64, int64
 from sys import stdout
 
-from input_output_funcs import open_file_sets, read_one_line
+from input_output_funcs import read_results_blocks, conversion_period
 from create_coards_nc_class import create_coards_nc_dset, Coard_nc_defn, find_metric_in_flist_names
-from nc_low_level_fns import get_nc_coords
+from nc_low_level_fns import get_nc_coords_block, update_progress_bar
+from results_blocks import read_text_blocks
+from results_index import fetch_results_index
+from nc_write_buffer import NcWriteBuffer
+from nc_profiles import fetch_nc_profile, apply_chunk_cache, report_nc_file
+from progress_events import report_progress, check_cancelled
 
 sleepTime = 5
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
 
 MAX_FIELDS_MONTHLY = 3600
 HECTARES_PER_M2 = 0.0001     # a hectare is 10,000 metres
 NC_METRICS = list(['ch4', 'co2', 'no3', 'n2o', 'soc', 'npp'])
 MAX_LINES = 10000000000  # stop processing after this number of lines
+RANGE_BLOCK_NROWS = 64   # rows parsed at a time by a worker - keeps memory modest for daily files
 
-def rescale_metric_values(num_months, metric_vals, metric, daily_flag):
-    '''
-    metric_vals: list of daily or monthly values
+def days_per_month_vector(num_months):
+    """
+    number of days in each of num_months months starting in January - ECOSSE years are 365 days
+    """
+    days_in_year = [monthrange(2011, imnth)[1] for imnth in range(1, 13)]
+    return resize(array(days_in_year, dtype=float64), num_months)
+
+def rescale_metric_block(num_months, metric_vals, metric, daily_flag):
+    """
+    metric_vals: array of daily or monthly values with time as the last axis i.e. cells x days or cells x months
     assume:
         first value is 1st Jan and each year is 365 days (ECOSSE norm)
         convert from hectares to square metre and from per second to per year
-    '''
-    monthly_vals = []
-    imnth = 1
+    return array of monthly values with the same leading dimensions
+    """
+    metric_vals = asarray(metric_vals, dtype=float64)
+    ndays = days_per_month_vector(num_months)
     if daily_flag:
-        indx1 = 0
-        for indx_mnth in range(num_months):
-            frst_day, num_days = monthrange(2011, imnth)
-            indx2 = indx1 + num_days
-            if metric == 'soc':
-                monthly_vals.append(HECTARES_PER_M2 * mean(metric_vals[indx1:indx2]))
-            else:
-                # get mean of daily values then scale up to a yearly value for that month
-                # =======================================================================
-                monthly_vals.append(HECTARES_PER_M2 * 365 * mean(metric_vals[indx1:indx2]))   # flux
-            indx1 += num_days
-            imnth += 1
-            if imnth > 12:
-                imnth = 1
+        # mean of daily values for each month using the offset of the first day of each month
+        # ====================================================================================
+        indices = concatenate(([0], cumsum(ndays[:-1]))).astype(int64)
+        ndays_used = minimum(ndays, metric_vals.shape[-1] - indices)
+        monthly_vals = add.reduceat(metric_vals, indices, axis=-1) / ndays_used
+        if metric == 'soc':
+            return HECTARES_PER_M2 * monthly_vals
+        else:
+            return HECTARES_PER_M2 * 365 * monthly_vals     # get mean of daily values then scale up to a yearly value
     else:
-        imnth = 1
-        for indx_mnth in range(num_months):
-            frst_day, num_days = monthrange(2011, imnth)
-            if metric == 'soc':
-                monthly_vals.append(HECTARES_PER_M2 * metric_vals[indx_mnth])
-            elif metric == 'npp':
-                monthly_vals.append(HECTARES_PER_M2 * metric_vals[indx_mnth] / 2)      # NB divide by 2
-            else:
-                monthly_vals.append(HECTARES_PER_M2 * 365 * metric_vals[indx_mnth] / num_days)
-            imnth += 1
-            if imnth > 12:
-                imnth = 1
+        monthly_vals = metric_vals[..., :num_months]
+        if metric == 'soc':
+            return HECTARES_PER_M2 * monthly_vals
+        elif metric == 'npp':
+            return HECTARES_PER_M2 * monthly_vals / 2      # NB divide by 2
+        else:
+            return HECTARES_PER_M2 * 365 * monthly_vals / ndays
 
-    return monthly_vals
+def rescale_metric_values(num_months, metric_vals, metric, daily_flag):
+    '''
+    metric_vals: list of daily or monthly values for a single cell
+    '''
+    return rescale_metric_block(num_months, metric_vals, metric, daily_flag)
 
-def _generate_nc(form, metric_obj, daily_flag):
+def _generate_nc(form, metric_obj, daily_flag, nworkers=1):
     """
-
+    when nworkers exceeds one, byte ranges of the CSV file are converted by a pool of worker processes
     """
+    strt_time = time()
+    profile_name = fetch_nc_profile(form)
     nc_fname, var_name, num_months = create_coards_nc_dset(form, metric_obj)
     if isinstance(nc_fname, int):
         return
@@ -90,93 +104,238 @@ def _generate_nc(form, metric_obj, daily_flag):
 
     max_lat_indx = nc_dset.variables['latitude'].shape[0]  - 1
     max_lon_indx = nc_dset.variables['longitude'].shape[0] - 1
+    nc_buffer = NcWriteBuffer(nc_dset, ['area', var_name])
+    apply_chunk_cache(nc_dset, profile_name)
+
+    # results store is read serially
+    # ==============================
+    if nworkers > 1 and form.trans_defn.get('store_dir') is None:
+        nlines = _convert_ranges(form, metric_obj, nc_buffer, var_name, num_months, daily_flag, nworkers,
+                                                                                        max_lat_indx, max_lon_indx)
+    else:
+        nlines = _convert_blocks(form, metric_obj, nc_buffer, var_name, num_months, daily_flag,
+                                                                                        max_lat_indx, max_lon_indx)
+    if nlines == -1:
+        nc_dset.close()
+        return -1
+
+    # close file objects
+    # ==================
+    try:
+        nc_buffer.close()
+    except (IndexError, ValueError, RuntimeError) as err:
+        print('\n' + ERROR_STR + '{}\nwriting buffered values to {}'.format(err, nc_fname))
+        nc_dset.close()
+        return -1
+
+    nc_dset.close()
+
+    print('\nFinished - having written {} lines to NC file: {}'.format(nlines, nc_fname))
+    report_nc_file(nc_fname, profile_name, strt_time)
+    print()
+
+    return nlines
 
-    # open crop file - TODO: only works for one file
-    # ==============
+def _convert_blocks(form, metric_obj, nc_buffer, var_name, num_months, daily_flag, max_lat_indx, max_lon_indx):
+    """
+    read and convert blocks of rows in this process, each block being rescaled as a whole
+    return number of lines read or -1 on failure
+    """
+    # open crop file or results store - TODO: only works for one file
+    # ================================
     metric = metric_obj.metric
-    trans_fobjs, header_rec = open_file_sets(list([metric_obj.fname]), metric)
+    trans_blocks = read_results_blocks(form.trans_defn, [metric_obj.fname], metric, dtype=float64)
 
-    # read and process each line
-    # ==========================
+    # read and process each block
+    # ===========================
     ntrans_lines  = form.trans_defn['nlines']
-    ntrans_fields = form.trans_defn['nfields']
     nlines = 0
     num_out_lines = 0
     num_bad_lines = 0
+    num_outside = 0
     last_time = time()
-    while (nlines <= MAX_LINES):
-
-        # read in land use transition results
-        # ===================================
-        num_trans_time_vals, nsoil_metrics, line_prefix, atom_tran = read_one_line(trans_fobjs)
-        if atom_tran == None:
+    for block in trans_blocks:
+        if nlines > MAX_LINES:
             break
-        nlines += 1
-
-        # check data integrity
-        # ====================
-        if num_trans_time_vals != ntrans_fields:
-            if num_bad_lines == 0:
-                nline_str = format_string("%d", int(nlines), grouping=True)
-                print('\nBad data at line {}\tfound {} trans fields, expected {} - will skip'
-                                    .format(nline_str, num_trans_time_vals, form.trans_defn['nfields']))
-            num_bad_lines += 1
-        else:
-            # write final result to NetCDF file
-            # =================================
-            total_area = 0.0
-            province, slat, slon, smu_global, wthr_set, num_soil, dummy, sarea = line_prefix
-            area = float(sarea)
-            total_area += area
-            mu_global = int(smu_global)
-            latitude  = float(slat)
-            longitude = float(slon)
-            lat_indx, lon_indx = get_nc_coords(form, latitude, longitude, max_lat_indx, max_lon_indx)
-            if lat_indx == -1:
-                continue
+        if block.nbad > 0 and num_bad_lines == 0:
+            print('\nBad data in rows {} to {} - will skip'.format(nlines + 1, nlines + block.nrows))
+        nlines += block.nrows
+        num_bad_lines += block.nbad
+
+        lats, lons, areas = block.good_cells()
+        if len(lats) > 0:
+            lat_indxs, lon_indxs = get_nc_coords_block(form.bbox_nc, form.study_defn['resolution'], lats, lons,
+                                                                                        max_lat_indx, max_lon_indx)
+            monthly_vals = rescale_metric_block(num_months, block.vals[metric], metric, daily_flag)
+            nwritten = _write_cells(nc_buffer, var_name, metric, num_months, lat_indxs, lon_indxs, areas, monthly_vals)
+            if nwritten == -1:
+                trans_blocks.close()
+                return -1
+
+            num_out_lines += nwritten
+            num_outside += len(lats) - nwritten
+
+        last_time = update_progress_bar(last_time, ntrans_lines, num_out_lines, num_bad_lines)
+
+    trans_blocks.close()
+    if num_outside > 0:
+        print('\n' + WARNING_STR + '{} cells lie outside the NC grid'.format(num_outside))
 
-            if metric == 'soil':
-                pass
-            else:
-                try:
-                    nc_dset.variables['area'][lat_indx, lon_indx] = area
-
-                    nc_dset.variables[var_name][:num_months, lat_indx, lon_indx] = \
-                            rescale_metric_values(num_months, atom_tran[metric], metric, daily_flag)
-
-                except (IndexError, ValueError, RuntimeError) as err:
-                    mess = '\nError {}\nCould not write {} values for metric {} at lat/lon indexes: {} {}'\
-                                                            .format(err, num_months, metric, lat_indx, lon_indx)
-                    # form.lgr.critical(err)
-                    print(mess)
-                    return -1
-
-            num_out_lines += 1
-
-        # inform user with progress message
-        # =================================
-        new_time = time()
-        if new_time - last_time > sleepTime:
-            last_time = new_time
-            num_out_str = format_string('%10d', int(num_out_lines), grouping=True)
-            nremain = format_string("%10d", ntrans_lines - num_out_lines, grouping=True)
-            stdout.write('\rLines output: {}\trejected: {:10d}\tremaining: {}'
-                                                                    .format(num_out_str, num_bad_lines, nremain))
+    return nlines
 
-    # close file objects
-    # ==================
-    for key in trans_fobjs:
-        trans_fobjs[key].close()
+def _write_cells(nc_buffer, var_name, metric, num_months, lat_indxs, lon_indxs, areas, monthly_vals):
+    """
+    buffer area and values of those cells which lie within the NC grid - return number written or -1 on failure
+    """
+    try:
+        nc_buffer.set_cells('area', lat_indxs, lon_indxs, areas)
+        nwritten = nc_buffer.set_cells(var_name, lat_indxs, lon_indxs, monthly_vals)
+    except (IndexError, ValueError, RuntimeError) as err:
+        print('\n' + ERROR_STR + '{}\nwriting {} values for metric {}'.format(err, num_months, metric))
+        return -1
 
-    nc_dset.close()
+    return nwritten
 
-    print('\nFinished - having written {} lines to NC file: {}\n'.format(nlines, nc_fname))
+def _make_range_tasks(fname):
+    """
+    split CSV file into byte ranges each starting at the beginning of a line using row offsets from the index
+    """
+    row_offsets = fetch_results_index(fname)['row_offsets']
+    fsize = getsize(fname)
+    range_tasks = []
+    for indx, offset in enumerate(row_offsets):
+        end_offset = row_offsets[indx + 1] if indx + 1 < len(row_offsets) else fsize
+        range_tasks.append((fname, offset, end_offset))
+
+    return range_tasks
+
+def _convert_ranges(form, metric_obj, nc_buffer, var_name, num_months, daily_flag, nworkers,
+                                                                                        max_lat_indx, max_lon_indx):
+    """
+    workers parse and rescale byte ranges of the CSV file; this process is the single writer
+    ranges are returned in file order so that, as for a serial run, a repeated cell takes the last values
+    """
+    metric = metric_obj.metric
+    range_tasks = _make_range_tasks(metric_obj.fname)
+    conv_cfg = {'metric': metric, 'nfields': form.trans_defn.get('nfields_file', form.trans_defn['nfields']),
+                'col_window': form.trans_defn.get('col_window'), 'num_months': num_months,
+                'daily_flag': daily_flag, 'bbox_nc': form.bbox_nc, 'resol': form.study_defn['resolution'],
+                'max_lat_indx': max_lat_indx, 'max_lon_indx': max_lon_indx}
+    nworkers = min(nworkers, max(1, len(range_tasks)))
+    print('Will convert {} ranges of {} using {} worker processes'
+                                                        .format(len(range_tasks), split(metric_obj.fname)[1], nworkers))
+    ntrans_lines = form.trans_defn['nlines']
+    nlines = 0
+    num_out_lines = 0
+    num_bad_lines = 0
+    num_outside = 0
+    last_time = time()
+    with Pool(nworkers, initializer=_init_range_worker, initargs=(conv_cfg,)) as pool:
+        for nrows, nbad, lat_indxs, lon_indxs, areas, monthly_vals in pool.imap(_convert_range, range_tasks):
+            if nbad > 0 and num_bad_lines == 0:
+                print('\nBad data in rows {} to {} - will skip'.format(nlines + 1, nlines + nrows))
+            nlines += nrows
+            num_bad_lines += nbad
+            nwritten = _write_cells(nc_buffer, var_name, metric, num_months, lat_indxs, lon_indxs, areas, monthly_vals)
+            if nwritten == -1:
+                pool.terminate()
+                return -1
+
+            num_out_lines += nwritten
+            num_outside += len(lat_indxs) - nwritten
+
+            last_time = update_progress_bar(last_time, ntrans_lines, num_out_lines, num_bad_lines)
+
+    if num_outside > 0:
+        print('\n' + WARNING_STR + '{} cells lie outside the NC grid'.format(num_outside))
 
     return nlines
 
-def csv_to_coards_netcdf(form):
+def _init_range_worker(conv_cfg):
+    """
+    settings required by each worker are passed once rather than with every range
+    """
+    global _conv_cfg
+    _conv_cfg = conv_cfg
+
+def _range_records(fobj, end_offset):
+    """
+    decoded lines from the current position up to the end of the range
+    """
+    encoding = getpreferredencoding(False)
+    while fobj.tell() < end_offset:
+        rec = fobj.readline()
+        if rec == b'':
+            break
+        yield rec.decode(encoding)
+
+def _convert_range(range_task):
+    """
+    parse and rescale one byte range in a worker process
+    return number of rows, number rejected, NC indices, areas and monthly values of the good rows
     """
+    fname, strt_offset, end_offset = range_task
+    cfg = _conv_cfg
+    metric = cfg['metric']
+    nrows = 0
+    nbad = 0
+    lat_indxs = []
+    lon_indxs = []
+    areas = []
+    monthly_vals = []
+    with open(fname, 'rb') as fobj:
+        fobj.seek(strt_offset)
+        trans_fobjs = {metric: _range_records(fobj, end_offset)}
+        for block in read_text_blocks(trans_fobjs, cfg['nfields'], RANGE_BLOCK_NROWS, float64, cfg['col_window']):
+            nrows += block.nrows
+            nbad += block.nbad
+            lats, lons, block_areas = block.good_cells()
+            if len(lats) == 0:
+                continue
 
+            lat_block, lon_block = get_nc_coords_block(cfg['bbox_nc'], cfg['resol'], lats, lons,
+                                                                        cfg['max_lat_indx'], cfg['max_lon_indx'])
+            lat_indxs.append(lat_block)
+            lon_indxs.append(lon_block)
+            areas += block_areas
+            monthly_vals.append(rescale_metric_block(cfg['num_months'], block.vals[metric], metric,
+                                                                                                cfg['daily_flag']))
+    if len(monthly_vals) == 0:
+        return nrows, nbad, [], [], [], []
+
+    return nrows, nbad, concatenate(lat_indxs), concatenate(lon_indxs), areas, concatenate(monthly_vals)
+
+def _fetch_nworkers(form, nworkers):
+    """
+    number of workers passed by a headless caller takes precedence over that of the GUI, otherwise one
+    """
+    if nworkers is None:
+        nworkers = 1
+        if hasattr(form, 'w_nworkers'):
+            try:
+                nworkers = int(form.w_nworkers.text())
+            except ValueError:
+                print(WARNING_STR + 'invalid nworkers setting - will use 1')
+
+    return max(1, nworkers)
+
+def csv_to_coards_netcdf(form, nworkers=None, strt_year=None, end_year=None, metrics=None):
+    """
+    with more than one worker each CSV file is split into byte ranges which are converted in parallel
+    when a start and/or end year is given only that period is converted
+    metrics restricts conversion to a subset of NC_METRICS e.g. so that each can be converted independently
+    return True if at least one NC file was generated and none failed
+    """
+    retcode = False
+    with conversion_period(form, strt_year, end_year) as period_flag:
+        if period_flag:
+            retcode = _csv_to_coards_netcdf(form, nworkers, metrics)
+
+    return retcode
+
+def _csv_to_coards_netcdf(form, nworkers, metrics=None):
+    """
+    C
     """
     mess = '*** Yearly data will be generated from '
 
@@ -195,6 +354,7 @@ def csv_to_coards_netcdf(form):
     # gather required vars from UI
     # ============================
     aggreg_daily = form.w_aggreg.isChecked()
+    nworkers = _fetch_nworkers(form, nworkers)
     out_dir = form.w_lbl_rslts.text()
     delete_flag = form.w_del_nc.isChecked()
     study = form.study_defn['study']
@@ -202,7 +362,11 @@ def csv_to_coards_netcdf(form):
     file_list = form.trans_defn['file_list']
 
     nsuccess = 0
+    nfailed = 0
     for metric in NC_METRICS:
+        if metrics is not None and metric not in metrics:
+            continue
+
         fname = find_metric_in_flist_names(file_list, metric)
         if fname is None:
             continue
@@ -211,13 +375,15 @@ def csv_to_coards_netcdf(form):
         if metric_obj.fout_name is None:
             continue
 
-        nlines = _generate_nc(form, metric_obj, daily_flag)
-        if nlines > 0:
+        nlines = _generate_nc(form, metric_obj, daily_flag, nworkers)
+        if nlines is not None and nlines > 0:
             nsuccess += 1
+        else:
+            nfailed += 1
 
     if nsuccess == 0:
         print('No NC files generated')
     else:
         print('Generated {} COARDS compliant NC files'.format(nsuccess))
 
-    return
\ No newline at end of file
+    return nsuccess > 0 and nfailed == 0
\ No newline at end of file
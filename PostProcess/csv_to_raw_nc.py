@@ -16,9 +16,12 @@ from time import time
 from netCDF4 import Dataset
 from sys import stdout
 
-from input_output_funcs import open_file_sets, read_one_line
+from input_output_funcs import generate_results_lines, conversion_period
 from nc_low_level_fns import get_nc_coords
 from netcdf_funcs import create_raw_nc_dset
+from nc_write_buffer import NcWriteBuffer
+from nc_profiles import fetch_nc_profile, apply_chunk_cache, report_nc_file
+from progress_events import report_progress, check_cancelled
 
 sleepTime = 5.0
 bad_fobj_key = 'bad_lines'
@@ -34,7 +37,7 @@ LINE_LENGTH = 79
 WARNING_STR = '*** Warning *** '
 ERROR_STR = '*** Error *** '
 
-def _add_soc_diff(lgr, nc_dset, metric, lat_indx, lon_indx, nvals, atom_rec):
+def _add_soc_diff(lgr, nc_buffer, metric, lat_indx, lon_indx, nvals, atom_rec):
     """
     C
     """
@@ -44,7 +47,7 @@ def _add_soc_diff(lgr, nc_dset, metric, lat_indx, lon_indx, nvals, atom_rec):
     varname = metric + '_diff'
 
     try:
-        nc_dset.variables[varname][lat_indx, lon_indx] = atom_rec[-1] - atom_rec[0]
+        nc_buffer.set(varname, lat_indx, lon_indx, atom_rec[-1] - atom_rec[0])
 
     except (IndexError, ValueError, RuntimeError) as err:
         _write_err_mess(lgr, err, nvals, varname, lat_indx, lon_indx)
@@ -52,7 +55,7 @@ def _add_soc_diff(lgr, nc_dset, metric, lat_indx, lon_indx, nvals, atom_rec):
 
     return
 
-def _add_annual_variable(lgr, nc_dset, metric, lat_indx, lon_indx, nyears, nvals, atom_rec):
+def _add_annual_variable(lgr, nc_buffer, metric, lat_indx, lon_indx, nyears, nvals, atom_rec):
     """
     C
     """
@@ -76,39 +79,105 @@ def _add_annual_variable(lgr, nc_dset, metric, lat_indx, lon_indx, nyears, nvals
         out_rec.append(this_val)
 
     try:
-        nc_dset.variables[varname][lat_indx, lon_indx, :] = out_rec
+        nc_buffer.set(varname, lat_indx, lon_indx, out_rec)
     except (IndexError, ValueError, RuntimeError) as err:
         _write_err_mess(lgr, err, nvals, varname, lat_indx, lon_indx)
         return -1
 
     return
 
-def csv_to_raw_netcdf(form):
+def write_raw_cell(lgr, nc_buffer, nc_varnames, lat_indx, lon_indx, area, mu_global, atom_tran, first_line):
     """
-    NC file is deleted if it already exists
+    write all values for one cell to the raw NC file via the write buffer - return -1 on failure
+    shared by csv_to_raw_netcdf and the single pass conversion in csv_to_all_ncs
     """
+    nc_buffer.set('area', lat_indx, lon_indx, area)
+    nc_buffer.set('mu_global', lat_indx, lon_indx, mu_global)
+
+    for varname in atom_tran.keys():
+        if atom_tran[varname] is None or varname not in nc_varnames:
+            continue
+
+        nvals = len(atom_tran[varname])
+        nyears = nvals // 12
+        if nvals % 12 != 0 and first_line:
+            print(WARNING_STR + 'Number of months {} should be divisable by 12'.format(nvals))
+
+        if varname == 'soil':
+            for indx, metric in enumerate(SOIL_METRICS):
+                nc_buffer.set(metric, lat_indx, lon_indx, atom_tran[varname][indx])
+        else:
+            if varname == 'npp':
+                atom_rec = [val/2 for val in atom_tran[varname]]    # divide by 2 for flux co2 from dry matter
+            else:
+                atom_rec = atom_tran[varname]
+            try:
+                nc_buffer.set(varname, lat_indx, lon_indx, atom_rec)
+            except (IndexError, ValueError, RuntimeError) as err:
+                _write_err_mess(lgr, err, nvals, varname, lat_indx, lon_indx)
+                return -1
+
+            # add annual values and soc difference
+            # ====================================
+            _add_annual_variable(lgr, nc_buffer, varname, lat_indx, lon_indx, nyears, nvals, atom_rec)
+            if varname == 'soc':
+                _add_soc_diff(lgr, nc_buffer, varname, lat_indx, lon_indx, nvals, atom_rec)
+
+            '''
+            # Borneo addition: take difference between December of first year and last value
+            # ===============
+            if len(atom_tran[varname]) > 492:           # must have at least 40 years
+                val_decem_yr1  = atom_tran[varname][11]
+                val_decem_yr40 = atom_tran[varname][480 + 11]
+                val_decem_yr90 = atom_tran[varname][-1]
+                nc_dset.variables[varname][lat_indx, lon_indx, -2] = val_decem_yr40 - val_decem_yr1
+                nc_dset.variables[varname][lat_indx, lon_indx, -1] = val_decem_yr90 - val_decem_yr1
+            '''
+    return
+
+def csv_to_raw_netcdf(form, strt_year=None, end_year=None):
+    """
+    when a start and/or end year is given only that period is converted
+    return True if the NC file was generated
+    """
+    nlines = None
+    with conversion_period(form, strt_year, end_year) as period_flag:
+        if period_flag:
+            nlines = _csv_to_raw_netcdf(form)
+
+    return nlines is not None and nlines > 0
+
+def _csv_to_raw_netcdf(form):
+    """
+    NC file is deleted if it already exists - return number of lines read or -1 on failure
+    """
+    strt_time = time()
+    profile_name = fetch_nc_profile(form)
     nc_fname = create_raw_nc_dset(form, METRICS, SOIL_METRICS)
     if isinstance(nc_fname, int):
-        return
+        return -1
     try:
         nc_dset = Dataset(nc_fname, 'a')
     except TypeError as err:
         print(ERROR_STR + 'Unable to open output file. {}'.format(err))
-        return
+        return -1
 
     trans_files = form.trans_defn['file_list']     # Files comprising the LU transition result
     if len(trans_files) == 0:
         print('No transition files to process')
-        return
+        nc_dset.close()
+        return -1
 
     # max_lines = int(form.w_nlines.text())
     max_lines = 9999999                                        # stop processing after this number of lines
     max_lat_indx = nc_dset.variables['latitude'].shape[0] - 1
     max_lon_indx = nc_dset.variables['longitude'].shape[0] - 1
+    nc_buffer = NcWriteBuffer(nc_dset)
+    apply_chunk_cache(nc_dset, profile_name)
 
-    # open all files
-    # ==============
-    trans_fobjs, soil_header = open_file_sets(trans_files)
+    # open all files or results store
+    # ===============================
+    trans_lines = generate_results_lines(form.trans_defn, trans_files)
 
     # read and process each line
     # ==========================
@@ -116,12 +185,8 @@ def csv_to_raw_netcdf(form):
     num_out_lines = 0
     num_bad_lines = 0
     last_time = time()
-    while nline <= max_lines:
-
-        # read in land use transition results
-        # ===================================
-        num_trans_time_vals, nsoil_metrics, line_prefix, atom_tran = read_one_line(trans_fobjs)
-        if atom_tran is None:
+    for num_trans_time_vals, nsoil_metrics, line_prefix, atom_tran in trans_lines:
+        if nline > max_lines:
             break
         nline += 1
 
@@ -151,53 +216,18 @@ def csv_to_raw_netcdf(form):
             if lat_indx == -1:
                 continue
 
-            nc_dset.variables['area'][lat_indx, lon_indx] = area
-            nc_dset.variables['mu_global'][lat_indx, lon_indx] = mu_global
-
-            for varname in atom_tran.keys():
-                if atom_tran[varname] is None or varname not in nc_dset.variables:
-                    continue
-
-                nvals = len(atom_tran[varname])
-                nyears = nvals // 12
-                if nvals % 12 != 0 and nline == 1:
-                    print(WARNING_STR + 'Number of months {} should be divisable by 12'.format(nvals))
-
-                if varname == 'soil':
-                    for indx, metric in enumerate(SOIL_METRICS):
-                        nc_dset.variables[metric][lat_indx, lon_indx] = atom_tran[varname][indx]
-                else:
-                    if varname == 'npp':
-                        atom_rec = [val/2 for val in atom_tran[varname]]    # divide by 2 for flux co2 from dry matter
-                    else:
-                        atom_rec = atom_tran[varname]
-                    try:
-                        nc_dset.variables[varname][lat_indx, lon_indx, :nvals] = atom_rec
-                    except (IndexError, ValueError, RuntimeError) as err:
-                        _write_err_mess(form.lgr, err, nvals, varname, lat_indx, lon_indx)
-                        return -1
-
-                    # add annual values and soc difference
-                    # ====================================
-                    _add_annual_variable(form.lgr, nc_dset, varname, lat_indx, lon_indx, nyears, nvals, atom_rec)
-                    if varname == 'soc':
-                        _add_soc_diff(form.lgr, nc_dset, varname, lat_indx, lon_indx, nvals, atom_rec)
-
-                    '''
-                    # Borneo addition: take difference between December of first year and last value
-                    # ===============
-                    if len(atom_tran[varname]) > 492:           # must have at least 40 years
-                        val_decem_yr1  = atom_tran[varname][11]
-                        val_decem_yr40 = atom_tran[varname][480 + 11]
-                        val_decem_yr90 = atom_tran[varname][-1]
-                        nc_dset.variables[varname][lat_indx, lon_indx, -2] = val_decem_yr40 - val_decem_yr1
-                        nc_dset.variables[varname][lat_indx, lon_indx, -1] = val_decem_yr90 - val_decem_yr1
-                    '''
+            if write_raw_cell(form.lgr, nc_buffer, nc_dset.variables, lat_indx, lon_indx, area, mu_global, atom_tran,
+                                                                                                 nline == 1) == -1:
+                trans_lines.close()
+                return -1
 
         num_out_lines += 1
 
         # inform user with progress message
         # =================================
+        report_progress(num_out_lines + num_bad_lines, form.trans_defn['nlines'], 'lines')
+        check_cancelled()
+
         new_time = time()
         if new_time - last_time > sleepTime:
             last_time = new_time
@@ -208,14 +238,20 @@ def csv_to_raw_netcdf(form):
 
     # close file objects
     # ==================
-    for key in trans_fobjs:
-        trans_fobjs[key].close()
+    trans_lines.close()
+    try:
+        nc_buffer.close()
+    except (IndexError, ValueError, RuntimeError) as err:
+        print('\n' + ERROR_STR + '{}\nwriting buffered values to {}'.format(err, nc_fname))
+        nc_dset.close()
+        return -1
 
     nc_dset.close()
 
     print('\nDone - having processed ' + format_string("%d", int(nline), grouping=True) + ' lines')
+    report_nc_file(nc_fname, profile_name, strt_time)
 
-    return
+    return nline
 
 def _update_progress(last_time, metric, cell_id):
     """
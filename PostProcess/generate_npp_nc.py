@@ -16,18 +16,20 @@ from os.path import split
 from locale import format_string
 from time import time
 from netCDF4 import Dataset
-from statistics import mean
-from pandas import read_csv
 from sys import stdout
-from glob import glob
-from math import exp
+from numpy import array, exp, minimum, cumsum, add, repeat, where, float32
+from climate_cache import fetch_climate_cube, list_wthr_dirs
 from netcdf_npp_fns import create_npp_ncs
 from nc_low_level_fns import get_nc_coords
+from nc_write_buffer import NcWriteBuffer
+from nc_profiles import fetch_nc_profile, apply_chunk_cache, report_nc_file
+from progress_events import report_progress, check_cancelled
 
 sleepTime = 5.0
 bad_fobj_key = 'bad_lines'
 NGRANULARITY = 120         # HWSD resolution - 120 * 30 arc seconds = 1 degree
 maxFieldsMonthly = 3600
+NPP_OUT_DIR = 'E:\\temp'
 
 nc_metrics      = list(['npp'])
 
@@ -36,6 +38,8 @@ out_delim = ','
 line_length = 79
 hectares_to_m2 = 0.0001
 
+WARNING_STR = '*** Warning *** '
+
 crop_names = {'maize': 'Grain Maize', 'swheat': 'Spring Wheat'}
 crop_names = {'npp': 'npp'}
 rescale_factor = {'Arable': 0.44, 'Grassland':0.44, 'Forestry':0.8, 'Semi-natural':0.44, 'Miscanthus':1.6, 'SRC':0.88}
@@ -43,7 +47,13 @@ fractions      = {'Arable': 0.53, 'Grassland':0.71, 'Forestry':0.8, 'Semi-natura
 land_use_mappings = {'ara':'Arable', 'gra':'Grassland', 'for':'Forestry', 'nat':'Semi-natural', 'mis':'Miscanthus',
                                                                                                         'src':'SRC'}
 
-def _miami_dyce(land_use, temp, precip):
+# land use coefficients as lookup arrays indexed by position in LAND_USES
+# =======================================================================
+LAND_USES = list(rescale_factor.keys())
+RESCALE_FACTORS = array([rescale_factor[land_use] for land_use in LAND_USES])
+FRACTIONS = array([fractions[land_use] for land_use in LAND_USES])
+
+def miami_dyce(lu_indx, temp, precip):
     '''
     modification of the miami model by altering coefficients
         NB no need to reparameterise exponent terms since model is effectively linear in climate range of the UK
@@ -57,27 +67,69 @@ def _miami_dyce(land_use, temp, precip):
     for plant inputs to soil:  multiply npp values by different fractions according to land cover
         Miscanthus: 0.3  (widely reported as losing around 1/3 of peak mass before harvest; small amount returns to rhizome)
         SRC:        0.15 (assumed as forest)
+
+    lu_indx, temp and precip are scalars or arrays - lu_indx is the position of the land use in LAND_USES
+    soil input of vegetation is FRACTIONS[lu_indx] times npp
     '''
     nppt = 3000/(1 + exp(1.315 - 0.119*temp))
     nppp = 3000*(1 - exp(-0.000664*precip))
-    npp = 0.5*10*rescale_factor[land_use]*min(nppt, nppp)  # times 10 for unit conversion (g/m^2 to Kg/ha) and .5 for C
-
-    soil_input = fractions[land_use]*npp     # soil input of vegetation
+    npp = 0.5*10*RESCALE_FACTORS[lu_indx]*minimum(nppt, nppp)  # times 10 for unit conversion (g/m^2 to Kg/ha) and .5 for C
 
     return npp
 
-def sims_results_to_nc(form):
+def met_npp(lu_indx, precip, temp, nmnths_yrs):
+    """
+    monthly npp for successive years of monthly precipitation and temperature where nmnths_yrs is the number of
+    months of each year, that is of each met file
+    monthly values are normalised then scaled by annual npp; as with the former loop over met files, the annual
+    precipitation and mean temperature accumulate over successive years
+    """
+    nmnths_yrs = array(nmnths_yrs)
+    ends = cumsum(nmnths_yrs)
+    mnthly = miami_dyce(lu_indx, temp, 12*precip)      # scale precip to annual value
+    yr_sums = add.reduceat(mnthly, ends - nmnths_yrs)
+
+    precip_ann = cumsum(precip)[ends - 1]
+    mean_temp = cumsum(temp)[ends - 1] / ends
+    annual = miami_dyce(lu_indx, mean_temp, precip_ann)
+
+    scales = where(yr_sums > 0.0, 12*annual / where(yr_sums > 0.0, yr_sums, 1.0), 0.0)
+
+    return mnthly * repeat(scales, nmnths_yrs)
+
+def _fetch_nworkers(form, nworkers):
+    """
+    number of workers passed by a headless caller takes precedence over that of the GUI, otherwise one
+    """
+    if nworkers is None:
+        nworkers = 1
+        if hasattr(form, 'w_nworkers'):
+            try:
+                nworkers = int(form.w_nworkers.text())
+            except ValueError:
+                print(WARNING_STR + 'invalid nworkers setting - will use 1')
+
+    return max(1, nworkers)
+
+def sims_results_to_nc(form, out_dir=None, nworkers=None):
     """
     #    call this function before running spec against simulation files
     #    output_variables = list(['soc', 'co2', 'ch4', 'no3', 'n2o'])
     #    for var_name in output_variables[0:1]:
+    weather is taken from the climate cube of the simulations directory which is only rebuilt, by a pool of worker
+    processes, for weather directories which are new or have changed; npp is assembled in a write buffer which is
+    written to the NC file in bulk
+    return True if the NC files were generated
     """
     mess = '*** Yearly data will be generated from Miami-Dyce'
-    cal_method_new = True
 
     print(mess + ' input ***')
-    out_dir = 'E:\\temp'
+    if out_dir is None:
+        out_dir = NPP_OUT_DIR
     last_time = time()
+    strt_time = last_time
+    profile_name = fetch_nc_profile(form)
+    nworkers = _fetch_nworkers(form, nworkers)
 
     # gather required vars from UI
     # ============================
@@ -88,7 +140,7 @@ def sims_results_to_nc(form):
         mess = 'Land use abbreviation ' + lu + ' not found in land use mappings keys: '
         mess += str(land_use_mappings.keys())
         print(mess  +  ' will use ara (Arable) instead')
-        land_use = form.study_defn['ara']
+        land_use = land_use_mappings['ara']
 
     sims_dir = form.w_lbl_sims.text()
     dummy, tail_name = split(sims_dir)
@@ -97,7 +149,7 @@ def sims_results_to_nc(form):
     nc_fnames, var_names, num_months = create_npp_ncs(form, nc_metrics, crop_names, land_use, out_dir, study,
                                                       npp_units = 'kg C ha-1 yr-1')
     if isinstance(nc_fnames, int):
-        return
+        return False
 
     # open the newly created NC files
     # ===============================
@@ -105,55 +157,39 @@ def sims_results_to_nc(form):
     for nc_metric in nc_metrics:
         try:
             nc_dsets[nc_metric] = Dataset(nc_fnames[nc_metric],'a', format='NETCDF4')
+            apply_chunk_cache(nc_dsets[nc_metric], profile_name)
         except TypeError as err:
             mess = 'Unable to open output file. {0}'.format(err)
             print(mess)
-            return
+            return False
 
     max_lat_indx = nc_dsets[nc_metric].variables['latitude'].shape[0]  - 1
     max_lon_indx = nc_dsets[nc_metric].variables['longitude'].shape[0] - 1
 
-    # main loop - cycle through weather and simulations
-    # =================================================
-    # sims_dirs = glob(sims_dir + '/' + study + '*')
-    wthr_dirs = glob(sims_dir + '\\[0-9]*')
-    num_locations = len(wthr_dirs)
-    nlocs_out = 0
     var_name = 'npp'
     metric   = 'npp'
-    for wthr_dir in wthr_dirs:
-        dummy, sdir = split(wthr_dir)
-        gran_lat, gran_lon = sdir.split('_')
-        met_files = glob(wthr_dir + '\\met*s.txt')
-        npp_list = []
-
-        # render each met file as a data frame
-        # ====================================
-        precip_ann = 0
-        temp_list = []
-        for met_fname in met_files:
-            npp_1yr_list = []       # npp for year based on temperature and precip for each month
-            data_frame = read_csv(met_fname, sep='\t', names = ['mnth','precip','pet','temp'])
-            for rec in data_frame.values:
-                precip_ann += rec[1]
-                precip      = 12*rec[1]      # scale precip to annual value
-                temperature = rec[3]
-                temp_list.append(temperature)
-                npp = _miami_dyce(land_use, temperature, precip)
-                npp_1yr_list.append(npp)
-
-            # normalise
-            # =========
-            sum_npp = sum(npp_1yr_list)
-            npp_norm = [val/sum_npp for val in npp_1yr_list]
-            mean_temp= mean(temp_list)
-            npp = _miami_dyce(land_use, mean_temp, precip_ann)
-            npp_list += [12*val*npp for val in npp_norm]
+    nc_buffer = NcWriteBuffer(nc_dsets[metric], ['area', var_name])
+
+    # weather directories are named after their granular coordinates
+    # ===============================================================
+    wthr_dirs = list_wthr_dirs(sims_dir)
+    num_locations = len(wthr_dirs)
+    climate_cube = fetch_climate_cube(sims_dir, wthr_dirs, nworkers)
+    nfailed = num_locations - len(climate_cube)
+
+    # main loop - npp for each weather directory of the climate cube
+    # ==============================================================
+    lu_indx = LAND_USES.index(land_use)
+    nlocs_out = 0
+    nrejects = 0
+    for wthr_dir_name in climate_cube.wthr_dir_names():
+        gran_lat, gran_lon = wthr_dir_name.split('_')
+        precip, pet, temp, nmnths_yrs = climate_cube.climate(wthr_dir_name)
+        npp = met_npp(lu_indx, precip, temp, nmnths_yrs).astype(float32)
 
         # read area from manifest file
         # ============================
         area = 0.0
-        nrejects = 0
         latitude  = 90 - float(gran_lat)/NGRANULARITY
         longitude = float(gran_lon)/NGRANULARITY - 180
 
@@ -163,34 +199,38 @@ def sims_results_to_nc(form):
             continue
 
         try:
-            nc_dsets[metric].variables['area'][lat_indx, lon_indx] = area
-
-            nc_dsets[metric].variables[var_name][:num_months, lat_indx, lon_indx] = npp_list
+            nc_buffer.set('area', lat_indx, lon_indx, area)
+            nc_buffer.set(var_name, lat_indx, lon_indx, npp[:num_months])
             nlocs_out += 1
-            '''
-                             _rescale_metric_values(num_months, npp_list, metric, daily_flag)
-            '''
 
         except (IndexError, ValueError, RuntimeError) as err:
             mess = '\nError {}\nCould not write {} values for metric {} at lat/lon indexes: {} {}'\
                                                     .format(err, num_months, metric, lat_indx, lon_indx)
-            # form.lgr.critical(err)
             print(mess)
-            return -1
-
+            nc_dsets[metric].close()
+            return False
 
         # inform user with progress message
         # =================================
+        report_progress(nlocs_out + nrejects, num_locations - nfailed, 'locations')
+        check_cancelled()
+
         new_time = time()
         if new_time - last_time > sleepTime:
             last_time = new_time
             num_out_str = format_string('%10d', int(nlocs_out), grouping=True)
-            nremain = format_string("%10d", num_locations - nlocs_out, grouping=True)
+            nremain = format_string("%10d", num_locations - nlocs_out - nrejects - nfailed, grouping=True)
             stdout.write('\rLines output: {}\trejected: {:10d}\tremaining: {}'
                                                                     .format(num_out_str, nrejects, nremain))
+    nc_buffer.close()
     for metric in nc_metrics:
         nc_dsets[metric].close()
 
+    if nfailed > 0:
+        print('\n' + WARNING_STR + 'could not read met files of {} weather directories'.format(nfailed))
+
     print('\nFinished - having written {} lines to {} NC files'.format(nlocs_out, len(nc_fnames)))
+    for metric in nc_metrics:
+        report_nc_file(nc_fnames[metric], profile_name, strt_time)
 
-    return
+    return True
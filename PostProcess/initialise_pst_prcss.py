@@ -20,6 +20,9 @@ from json import dump as json_dump, load as json_load
 from time import sleep
 from set_up_logging import set_up_logging
 from input_output_funcs import ecosse_results_files, check_cut_csv_files
+from results_index import fetch_results_index
+from nc_profiles import NC_PROFILES, DEFAULT_PROFILE
+from pool_settings import POOL_SETTINGS
 
 sleepTime = 5
 ERROR_STR = '*** Error *** '
@@ -154,6 +157,38 @@ def read_config_file(form):
     descriptor, form.trans_defn = ecosse_results_files(results_dir, 'Contents: ')
     form.w_lbl06.setText(descriptor)
     form.w_nyears.setText(str(nyears_trim))
+    form.w_nworkers.setText(str(config[grp].get('nworkers', POOL_SETTINGS['nworkers'])))
+    form.w_chunk_size.setText(str(config[grp].get('chunk_size', POOL_SETTINGS['chunk_size'])))
+    form.w_max_fails.setText(str(config[grp].get('max_failures', POOL_SETTINGS['max_failures'])))
+    if config[grp].get('resume', False):
+        form.w_resume.setCheckState(2)
+    else:
+        form.w_resume.setCheckState(0)
+
+    nc_profile = config[grp].get('nc_profile', DEFAULT_PROFILE)
+    if nc_profile in NC_PROFILES:
+        form.w_nc_profile.setCurrentText(nc_profile)
+
+    if config[grp].get('text_output', True):
+        form.w_text_out.setCheckState(2)
+    else:
+        form.w_text_out.setCheckState(0)
+
+    if config[grp].get('store_output', False):
+        form.w_store_out.setCheckState(2)
+    else:
+        form.w_store_out.setCheckState(0)
+
+    if config[grp].get('totals_output', False):
+        form.w_totals_out.setCheckState(2)
+    else:
+        form.w_totals_out.setCheckState(0)
+    form.region_lookup_fn = config[grp].get('region_lookup', '')
+
+    if config[grp].get('stats_output', False):
+        form.w_stats_out.setCheckState(2)
+    else:
+        form.w_stats_out.setCheckState(0)
 
     # set check boxes
     # ===============
@@ -194,6 +229,16 @@ def _write_default_config_file(config_file):
             'aggreg_daily': True,
             'make_rslts_dir': True,
             'nyears_trim': 0,
+            'nworkers': POOL_SETTINGS['nworkers'],
+            'chunk_size': POOL_SETTINGS['chunk_size'],
+            'max_failures': POOL_SETTINGS['max_failures'],
+            'resume': False,
+            'text_output': True,
+            'store_output': False,
+            'totals_output': False,
+            'region_lookup': '',
+            'stats_output': False,
+            'nc_profile': DEFAULT_PROFILE,
             'overwrite': True,
             'results_dir': '',
             'sims_dir': ''
@@ -218,6 +263,16 @@ def write_config_file(form, message_flag = True):
             'aggreg_daily': form.w_aggreg.isChecked(),
             'make_rslts_dir': form.w_create_outdir.isChecked(),
             'nyears_trim': int(form.w_nyears.text()),
+            'nworkers': _fetch_int(form.w_nworkers, POOL_SETTINGS['nworkers']),
+            'chunk_size': _fetch_int(form.w_chunk_size, POOL_SETTINGS['chunk_size']),
+            'max_failures': _fetch_int(form.w_max_fails, POOL_SETTINGS['max_failures']),
+            'resume': form.w_resume.isChecked(),
+            'text_output': form.w_text_out.isChecked(),
+            'store_output': form.w_store_out.isChecked(),
+            'totals_output': form.w_totals_out.isChecked(),
+            'region_lookup': form.region_lookup_fn,
+            'stats_output': form.w_stats_out.isChecked(),
+            'nc_profile': form.w_nc_profile.currentText(),
             'overwrite':   form.w_del_nc.isChecked(),
             'results_dir': form.w_lbl_rslts.text(),
             'sims_dir': form.w_lbl_sims.text()
@@ -233,6 +288,17 @@ def write_config_file(form, message_flag = True):
 
     return
 
+def _fetch_int(w_field, default):
+    """
+    return integer value of a text field or default if text is not valid
+    """
+    try:
+        val = int(w_field.text())
+    except ValueError:
+        val = default
+
+    return val
+
 def report_csv_contents(form, fname):
     """
     write settings to form
@@ -240,8 +306,7 @@ def report_csv_contents(form, fname):
     if not isfile(fname):
         return
 
-    with open(fname, 'r') as fobj:
-        nlines = len(fobj.readlines())
+    nlines = fetch_results_index(fname)['nlines']
 
     form.w_lbl08.setText('Number of lines: {}'.format(nlines))
     return
@@ -12,15 +12,22 @@ __version__ = '0.0.1'
 __author__ = 's03mm5'
 
 from glob import glob
+from contextlib import contextmanager
 import json
 from os import stat, mkdir, makedirs, remove, chdir, getcwd
 from os.path import join, isdir, isfile, split, splitext
 from zipfile import ZIP_STORED, ZipFile, ZIP_DEFLATED
-
-from PyQt5.QtWidgets import QApplication
+from sys import modules
 
 from locale import setlocale, LC_ALL, format_string
-from subprocess import Popen, STDOUT
+
+from numpy import float32, float64
+
+from results_store import check_results_store, read_store_blocks, virtual_fname, ResultsStore
+from results_blocks import read_text_blocks, BLOCK_NROWS
+from results_index import fetch_results_index
+from csv_cutter import cut_results_files, results_file_years
+from sims_inventory import fetch_sims_inventory
 
 sleepTime = 2
 ERROR_STR = '*** Error *** '
@@ -31,7 +38,8 @@ ERROR_STR = '*** Error *** '
 ALL_METRICS = ['soc', 'co2', 'ch4', 'no3', 'npp', 'n2o']
 nfiles = len(ALL_METRICS)
 
-CUT_EXE_PATH = 'E:\\Freeware\\UnxUtils\\usr\\local\\wbin\\cut.exe'
+CUT_200_NYEARS = 101      # years retained from a 300 year run by "Cut 200 years"
+CUT_160_NYEARS = 140      # years retained from a 300 year run by "Cut 160 years"
 DATA_REC_PREFIX_LEN = 8
 MAX_FLDS_MNTHLY = 3600     # TODO: if number of fields exceeeds this then assume timestep is daily
 SMRY_ROW_LEN = 29
@@ -91,28 +99,51 @@ def clean_and_zip(form, dir_list, stage_dir, mgmt_flag):
     print('Zipping completed')
     return
 
+def process_gui_events():
+    """
+    allow the event loop, if there is one, to update unprocessed events - PyQt5 is not imported here so that
+    batch runs do not require it
+    """
+    qt_widgets = modules.get('PyQt5.QtWidgets')
+    if qt_widgets is not None and qt_widgets.QApplication.instance() is not None:
+        qt_widgets.QApplication.processEvents()
+
+    return
+
 def chng_study_create_co2e(form, eu28_dir):
     """
     change study and create co2e NC file
     """
     form.w_lbl_sims.setText(eu28_dir)
-    QApplication.processEvents()    # allow event loop to update unprocessed events
+    process_gui_events()
     change_create_rslts_dir(form)
-    QApplication.processEvents()
+    process_gui_events()
 
     return
 
-def aggregate_csv_create_coards(form, mgmt_dir):
+def study_settings(form, sims_dir):
     """
-    aggregate to CSV files, then optionally clip resultant CSVs and write Coards compliant NetCDF files
+    change study, creating its results directory if requested, and return the settings from which its pipeline is run
     """
-    form.w_lbl_sims.setText(mgmt_dir)
-    QApplication.processEvents()    # allow event loop to update unprocessed events
+    from post_process_batch import settings_from_form
+
+    form.w_lbl_sims.setText(sims_dir)
+    process_gui_events()
     change_create_rslts_dir(form)
 
-    form.aggregToCsvClicked()
-    cut_csv_files(form)
-    form.writeCoardsNcClicked()
+    return settings_from_form(form)
+
+def aggregate_csv_create_coards(form, mgmt_dir):
+    """
+    aggregate to CSV files, then write Coards compliant NetCDF files of the last CUT_200_NYEARS years
+    stages whose inputs and settings are unchanged since they last completed are skipped
+    """
+    from stage_pipeline import study_pipeline, run_pipeline
+
+    settings = study_settings(form, mgmt_dir)
+    run_pipeline(study_pipeline(settings, ['coards'], CUT_200_NYEARS), settings)
+    descriptor, form.trans_defn = ecosse_results_files(form.w_lbl_rslts.text(), 'Results: ')
+    form.w_lbl06.setText(descriptor)
 
     return
 
@@ -145,15 +176,18 @@ def check_cut_csv_files(form):
     """
     switch w_cut_csv push button off or on
     """
-    if len(form.trans_defn['file_list']) > 0 and form.trans_defn['nfields'] == 3600:
+    if len(form.trans_defn['file_list']) > 0 and form.trans_defn['nfields'] == 3600 and \
+                                                                        form.trans_defn.get('store_dir') is None:
         form.w_cut_csv.setEnabled(True)
     else:
         form.w_cut_csv.setEnabled(False)
 
-def cut_csv_files(form, cut_str = '-f1-8,2397-3608'):
+def cut_csv_files(form, strt_year = None, end_year = None, nyears_kept = CUT_200_NYEARS):
     """
-    retrieve CSV results files to be converted from 300 to 101 years i.e. to run from Jan 2001 to 2100
-                                                or 300 to 141 years i.e. to run from Jan 1961 to 2100
+    retrieve CSV results files to be converted from 300 to 101 years i.e. to run from Jan 2000 to 2100
+                                                or 300 to 140 years i.e. to run from Jan 1961 to 2100
+    period defaults to the last nyears_kept years of the results files
+    returns output directory only when every file has been cut, otherwise None
     """
     rslts_dir = form.w_lbl_rslts.text()
 
@@ -165,18 +199,105 @@ def cut_csv_files(form, cut_str = '-f1-8,2397-3608'):
     form.trans_defn is a list of files created in function ecosse_results_files which is 
     called whenever the results directory changes
     """
-    for fname in form.trans_defn['file_list']:
+    file_list = form.trans_defn['file_list']
+    if len(file_list) == 0:
+        print('No CSV files to cut')
+        return None
+
+    if not hasattr(form, 'study_defn') and not read_study_definition(form):
+        return None
 
-        dum, fn_short = split(fname)
-        fn_out = join(out_dir, fn_short)
-        print('Creating new file: ' + fn_out)
-        cmd_str = CUT_EXE_PATH + ' ' + cut_str + ' ' + fname
+    if end_year is None:
+        end_year = results_period(form)[1]
+    if strt_year is None:
+        strt_year = end_year - nyears_kept + 1
 
-        with open(fn_out, 'wb') as out_fobj, open('stderr.txt', 'wb') as err_fobj:
-            Popen(cmd_str, stdout = out_fobj, stderr = err_fobj)
+    nsuccess = cut_results_files(file_list, out_dir, strt_year, end_year, form.study_defn['futEndYr'])
+    if nsuccess != len(file_list):
+        return None
 
     return out_dir
 
+def results_period(form):
+    """
+    return first year, last year and number of values per year of the results files or results store
+    a results store does not retain the header so is assumed to end in the future end year of the study
+    """
+    fut_end_year = form.study_defn['futEndYr']
+    nfields = form.trans_defn['nfields']
+    if form.trans_defn.get('store_dir') is None and len(form.trans_defn['file_list']) > 0:
+        return results_file_years(fetch_results_index(form.trans_defn['file_list'][0]), fut_end_year)
+
+    nvals_per_year = 365 if nfields > MAX_FLDS_MNTHLY else 12
+    return fut_end_year - nfields // nvals_per_year + 1, fut_end_year, nvals_per_year
+
+def last_years_period(form, nyears_kept):
+    """
+    start and end year of the last nyears_kept years of the results
+    """
+    end_year = results_period(form)[1]
+
+    return end_year - nyears_kept + 1, end_year
+
+def period_trans_defn(form, strt_year = None, end_year = None):
+    """
+    return copy of form.trans_defn restricted to the years strt_year to end_year, or None if the period lies outside
+    the years of the results; nfields becomes the number of values in the period and col_window the columns of
+    those values; when the period spans all years form.trans_defn is returned unchanged
+    """
+    trans_defn = form.trans_defn
+    first_year, last_year, nvals_per_year = results_period(form)
+    if strt_year is None:
+        strt_year = first_year
+    if end_year is None:
+        end_year = last_year
+
+    if strt_year < first_year or end_year > last_year or strt_year > end_year:
+        print(ERROR_STR + 'period {} to {} lies outside the years {} to {} of the results'
+                                                                    .format(strt_year, end_year, first_year, last_year))
+        return None
+
+    if strt_year == first_year and end_year == last_year:
+        return trans_defn
+
+    # converters identify daily results by their number of values
+    # ============================================================
+    if nvals_per_year == 365 and (end_year - strt_year + 1) * 365 <= MAX_FLDS_MNTHLY:
+        print(ERROR_STR + 'period of daily results must exceed {} years'.format(MAX_FLDS_MNTHLY // 365))
+        return None
+
+    period_defn = dict(trans_defn)
+    period_defn['nfields_file'] = trans_defn['nfields']
+    period_defn['nfields'] = (end_year - strt_year + 1) * nvals_per_year
+    icol_strt = (strt_year - first_year) * nvals_per_year
+    period_defn['col_window'] = (icol_strt, icol_strt + period_defn['nfields'])
+    period_defn['period'] = (strt_year, end_year)
+    print('Will convert years {} to {} of results spanning {} to {}'.format(strt_year, end_year, first_year, last_year))
+
+    return period_defn
+
+@contextmanager
+def conversion_period(form, strt_year = None, end_year = None):
+    """
+    converters and the NC file creation functions they call read form.trans_defn, which is replaced by its
+    restriction to the period for the duration of the conversion; yields False if the period is invalid
+    """
+    trans_defn = form.trans_defn
+    if strt_year is None and end_year is None:
+        yield True
+        return
+
+    period_defn = period_trans_defn(form, strt_year, end_year)
+    if period_defn is None:
+        yield False
+        return
+
+    form.trans_defn = period_defn
+    try:
+        yield True
+    finally:
+        form.trans_defn = trans_defn
+
 def change_create_rslts_dir(form):
     """
     change and, if reqested, create a results directory for this study
@@ -203,17 +324,21 @@ def change_create_rslts_dir(form):
     return
 
 def ecosse_simulations_files(sims_dir):
+    """
+    counts are taken from the simulations inventory - only the first weather directory is listed
+    """
+    inventory = fetch_sims_inventory(sims_dir)
+    if inventory is None:
+        return 'No simulations directory'
 
-    wthr_list = glob(sims_dir + '\\[0-9]*')
-    sims_list = glob(sims_dir + '\\lat*')
-    if len(wthr_list) == 0:
-        clim_fnames = []
-    else:
-        clim_fnames = glob(wthr_list[0] + '\\met*')
+    nclim = 0
+    for wthr_dir in inventory.iter_wthr_dirs():
+        nclim = len(glob(join(sims_dir, wthr_dir, 'met*')))
+        break
 
-    nsims_str = format_string("%d", len(sims_list), grouping=True)
-    nwthr_str = format_string("%d", len(wthr_list), grouping=True)
-    nclim_str = format_string("%d", len(clim_fnames), grouping=True)
+    nsims_str = format_string("%d", inventory.nsims, grouping=True)
+    nwthr_str = format_string("%d", inventory.nwthr_dirs, grouping=True)
+    nclim_str = format_string("%d", nclim, grouping=True)
 
     description = 'Found {} simulations\t{} weather sets\t{} met files per weather set'\
                                             .format(nsims_str, nwthr_str, nclim_str)
@@ -347,12 +472,78 @@ def open_file_sets(trans_files, crop_name = 'dummy', remove_flag = True):
 
     return trans_fobjs, soil_header
 
+def read_results_blocks(trans_defn, trans_files, crop_name = 'dummy', block_nrows = BLOCK_NROWS, dtype = float32):
+    """
+    generator yielding a ResultsBlock for each block of rows
+    values are read from the binary results store if there is one, otherwise from the text files
+    rows whose number of fields differs from that of the files are rejected and counted in each block
+    when trans_defn has a column window only values for the period are parsed
+    """
+    nfields = trans_defn.get('nfields_file', trans_defn['nfields'])
+    col_window = trans_defn.get('col_window')
+    store_dir = trans_defn.get('store_dir')
+    if store_dir is not None:
+        if crop_name == 'dummy':
+            keys = [splitext(fname)[0].split('_')[-1] for fname in trans_files]
+        else:
+            keys = [crop_name]
+
+        for block in read_store_blocks(store_dir, keys, nfields, block_nrows, dtype, col_window):
+            yield block
+        return
+
+    trans_fobjs, soil_header = open_file_sets(trans_files, crop_name)
+    try:
+        for block in read_text_blocks(trans_fobjs, nfields, block_nrows, dtype, col_window):
+            yield block
+    finally:
+        for key in trans_fobjs:
+            trans_fobjs[key].close()
+
+def generate_results_lines(trans_defn, trans_files, crop_name = 'dummy'):
+    """
+    generator yielding, for each cell, number of time values, number of soil metrics, line prefix and
+    dictionary of values for each metric - rejected rows have no values
+    values are parsed as float64 since net GHG fluxes are derived from differences between successive SOC stocks
+    """
+    trans_blocks = read_results_blocks(trans_defn, trans_files, crop_name, dtype = float64)
+    try:
+        for block in trans_blocks:
+            for line in block.lines():
+                yield line
+    finally:
+        trans_blocks.close()
+
+def _store_results_defn(dir_name, descriptor_prefix, store_dir):
+    """
+    describe results held only in a binary results store
+    file list comprises the names of the text files which would have been written so that names of NC files
+    can be derived in the usual way
+    """
+    store = ResultsStore(store_dir)
+    varnames = [metric for metric in ALL_METRICS if metric in store.varnames]
+    nfields = store.ntimes[varnames[0]] if len(varnames) > 0 else 0
+    if nfields > MAX_FLDS_MNTHLY:
+        nyears = int(nfields/365)
+        timestep = 'Daily'
+    else:
+        nyears = int(nfields/12)
+        timestep = 'Monthly'
+
+    ncells_str = format_string("%d", store.ncells, grouping=True)
+    descriptor = '   ' + descriptor_prefix + ', '.join(varnames) + '   results store: {} cells   years: {}'\
+                                                                                        .format(ncells_str, nyears)
+    descriptor += '   timestep: ' + timestep
+    ret_dict = {'file_list': [virtual_fname(store_dir, metric) for metric in varnames], 'nfields': nfields,
+                                                        'nlines': store.ncells + 1, 'store_dir': store_dir}
+    return descriptor, ret_dict
+
 def ecosse_results_files(dir_name, descriptor_prefix):
     """
     TODO: use spaces rather than tabs
     """
     timestep = 'Not set'
-    ret_dict = {'file_list': [], 'nfields': 0, 'nlines': 0}
+    ret_dict = {'file_list': [], 'nfields': 0, 'nlines': 0, 'store_dir': None}
     
     # identify files for processing
     # =============================
@@ -368,26 +559,21 @@ def ecosse_results_files(dir_name, descriptor_prefix):
             # ==============================
             if metric == 'soil':
                 continue
-            with open(files[0], 'r') as fobj:
-                dummy = fobj.readline()
-                first_rec = fobj.readline()
-
-            rec = first_rec.split()
-            if len(rec) == 1:
-                rec = first_rec.split(',')
-
-            nfields = len(rec) - DATA_REC_PREFIX_LEN
-            if nfields > MAX_FLDS_MNTHLY:
-                nyears = int((nfields)/365)
-                timestep = 'Daily'
-            else:
-                nyears = int((nfields)/12)
-                timestep = 'Monthly'
+            results_index = fetch_results_index(files[0])
+            nfields = results_index['nfields']
+            nyears = results_index['nyears']
+            timestep = results_index['timestep']
         else:
             missing_metrics.append(metric)
 
     descriptor = '   ' + descriptor_prefix + descriptor.rstrip(', ')
 
+    # binary results store takes precedence unless it is older than the text files
+    # =============================================================================
+    store_dir = check_results_store(dir_name, split(dir_name)[1], file_list)
+    if store_dir is not None:
+        return _store_results_defn(dir_name, descriptor_prefix, store_dir)
+
     # convert to file size to kilobytes
     # =================================
     if len(file_list) == 0:
@@ -400,9 +586,7 @@ def ecosse_results_files(dir_name, descriptor_prefix):
     fsize_kb = format_string("%d", fname_info.st_size/1024, grouping=True)
     descriptor += '   file size: {} Kb   years: {}'.format(str(fsize_kb),str(nyears))
 
-    # TODO: find faster method
-    with open(fname, 'r') as fobj:
-        nlines = len(fobj.readlines())
+    nlines = fetch_results_index(fname)['nlines']
 
     for fname in file_list:
             nlines_str = format_string("%d", nlines, grouping=True)
@@ -416,47 +600,3 @@ def ecosse_results_files(dir_name, descriptor_prefix):
 
     return descriptor, ret_dict
 
-def read_one_line(file_objs):
-    """
-    read in one line of data from via each file object and return three data elements:
-      - number of data points
-      - line prefix list:  province, latitude, longitude, mu_global, climate_scenario, num_dom_soils, land_use, area_km2
-      - a dictionary of values whose keys are typically the metrics: ch4, co2, n2o, soc
-                                and whose objects comprise a list of monthly values for the corresponding metric
-    """
-
-    # defaults for end of file
-    num_time_vals = -1
-    nsoil_metrics = -1
-    line_prefix  = []
-
-    # read one line of data from each file
-    # ====================================
-    vals = {}
-    for key in file_objs.keys():
-        rec = file_objs[key].readline()
-
-        # check for end of file
-        # =====================
-        if rec == '':
-            vals = None
-            break
-
-        # check for delimiter
-        # ===================
-        data_rec = rec.split()
-        if len(data_rec) == 1:
-            data_rec = rec.split(',')
-
-        line_prefix = data_rec[0:DATA_REC_PREFIX_LEN]
-        num_vals = len(data_rec) - DATA_REC_PREFIX_LEN
-        vals[key] = []
-        for k in range(num_vals):
-            vals[key].append(float(data_rec[k + DATA_REC_PREFIX_LEN]))  # first 8 cols are province, east, north, etc
-
-        if key == 'soil':
-            nsoil_metrics = num_vals
-        else:
-            num_time_vals = num_vals    # number of time values e.g. monthly
-
-    return num_time_vals, nsoil_metrics, line_prefix, vals
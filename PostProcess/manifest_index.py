@@ -0,0 +1,160 @@
+#-------------------------------------------------------------------------------
+# Name:        manifest_index.py
+# Purpose:     consolidate grid cell manifest files into a single index which is kept on disk
+# Author:      agent
+# Created:     18/10/2026
+# Description: the index is held alongside the study definition file and is keyed by cell id e.g.
+#              lat0002438_lon0023793_mu10090 or, for OSGB, 73500_870500
+#              manifest files, with their modification times and sizes, are taken from the simulations inventory
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'manifest_index.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import replace
+from os.path import join, split, isfile
+from json import load as json_load, dump as json_dump
+from time import time
+
+from sims_inventory import fetch_sims_inventory, MANIFEST_PREFIX, MANIFEST_SUFFIX
+
+INDEX_VERSION = 1
+LOCATION_KEYS = ['province', 'area', 'latitude', 'longitude']
+
+WARNING_STR = '*** Warning *** '
+
+def make_cell_id(sim_dir):
+    """
+    last 4 characters of lat/lon simulations directory indicates soil, so ignore
+    """
+    cell_id = split(sim_dir)[1]
+    if cell_id.find('lat') >= 0:
+        cell_id = cell_id[0:-4]
+
+    return cell_id
+
+def _compact_manifest(manifest):
+    """
+    retain location, mu_global percentages and granular longitudes only
+    """
+    compact = {'location': {}}
+    for key in LOCATION_KEYS:
+        if key in manifest['location']:
+            compact['location'][key] = manifest['location'][key]
+
+    for key in manifest:
+        if key.isdigit() or key == 'granular_longs':
+            compact[key] = manifest[key]
+
+    return compact
+
+class ManifestIndex(object):
+    """
+    index of all manifest files for a simulations directory - entries are refreshed whenever the modification time
+    or size of a manifest file changes
+    """
+    def __init__(self, lgr, sims_dir, cells=None):
+        """
+        cells is supplied when a subset of an existing index is required, otherwise read and validate index file
+        """
+        self.lgr = lgr
+        self.sims_dir = sims_dir
+        root_dir, study = split(sims_dir)
+        self.index_fn = join(root_dir, study + '_manifest_index.json')
+
+        if cells is None:
+            self.cells = {}
+            self._refresh()
+        else:
+            self.cells = cells
+
+    def __len__(self):
+        """
+        number of manifests in index
+        """
+        return len(self.cells)
+
+    def lookup(self, sim_dir):
+        """
+        return manifest for simulation directory or None - manifest must not be modified by caller
+        """
+        cell_id = make_cell_id(sim_dir)
+        if cell_id in self.cells:
+            return self.cells[cell_id][2]
+        else:
+            return None
+
+    def subset(self, sim_dirs):
+        """
+        return index comprising only the cells for these simulation directories e.g. to pass to a worker process
+        """
+        cells = {}
+        for sim_dir in sim_dirs:
+            cell_id = make_cell_id(sim_dir)
+            if cell_id in self.cells:
+                cells[cell_id] = self.cells[cell_id]
+
+        return ManifestIndex(self.lgr, self.sims_dir, cells)
+
+    def _refresh(self):
+        """
+        read index file then reread only those manifests which are new or have changed
+        """
+        strt_time = time()
+        stored_cells = {}
+        if isfile(self.index_fn):
+            try:
+                with open(self.index_fn, 'r') as fobj:
+                    index = json_load(fobj)
+                if index['version'] == INDEX_VERSION:
+                    stored_cells = index['cells']
+            except (OSError, IOError, ValueError, KeyError) as err:
+                print(WARNING_STR + 'could not read manifest index {} - will rebuild'.format(self.index_fn))
+
+        inventory = fetch_sims_inventory(self.sims_dir)
+        if inventory is None:
+            return
+
+        print('Checking manifest files in ' + self.sims_dir + ' against index...')
+        nread = 0
+        nfailed = 0
+        for fname, mtime_ns, size in inventory.iter_manifests():
+            cell_id = fname[len(MANIFEST_PREFIX):-len(MANIFEST_SUFFIX)]
+            if cell_id in stored_cells:
+                if stored_cells[cell_id][:2] == [mtime_ns, size]:
+                    self.cells[cell_id] = stored_cells[cell_id]
+                    continue
+
+            mani_fn = join(self.sims_dir, fname)
+            try:
+                with open(mani_fn, 'r') as fmani:
+                    manifest = _compact_manifest(json_load(fmani))
+            except (OSError, IOError, ValueError, KeyError) as err:
+                print(WARNING_STR + 'could not read manifest file {}\t{}'.format(mani_fn, err))
+                nfailed += 1
+                continue
+
+            self.cells[cell_id] = [mtime_ns, size, manifest]
+            nread += 1
+
+        nremoved = len(set(stored_cells) - set(self.cells))
+        if nread > 0 or nremoved > 0 or not isfile(self.index_fn):
+            self._write()
+
+        mess = 'Manifest index has {} cells: {} manifests read, {} removed, {} unreadable in {:.1f} seconds'\
+                                        .format(len(self.cells), nread, nremoved, nfailed, time() - strt_time)
+        print(mess)
+        self.lgr.info(mess)
+
+    def _write(self):
+        """
+        write to a temporary file first so that an interrupted write does not corrupt the index
+        """
+        tmp_fn = self.index_fn + '.tmp'
+        try:
+            with open(tmp_fn, 'w') as fobj:
+                json_dump({'version': INDEX_VERSION, 'cells': self.cells}, fobj, separators=(',', ':'))
+            replace(tmp_fn, self.index_fn)
+        except (OSError, IOError) as err:
+            print(WARNING_STR + 'could not write manifest index {}\t{}'.format(self.index_fn, err))
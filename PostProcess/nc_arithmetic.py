@@ -0,0 +1,239 @@
+#-------------------------------------------------------------------------------
+# Name:        nc_arithmetic.py
+# Purpose:     difference, ratio and scaled sum of the variables of two NC files without recourse to CDO
+# Author:      agent
+# Created:     18/10/2026
+# Description: variables over latitude and longitude, other than area and mu_global, are combined chunk by chunk
+#              along the time axis; all other variables and the global attributes are copied from the first file
+#              grids and time axes of the two files must match; each output is written to a temporary file which
+#              is renamed only when complete and independent operations are run concurrently in a process pool
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'nc_arithmetic.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import replace, remove, cpu_count
+from os.path import isfile, split
+from multiprocessing import Pool
+from time import time
+
+from netCDF4 import Dataset
+from numpy import ma, allclose, array_equal, float64, dtype as np_dtype
+
+from nc_profiles import create_profiled_variable, apply_chunk_cache, DEFAULT_PROFILE
+
+LAT_DIMS = ('latitude', 'lat')
+LON_DIMS = ('longitude', 'lon')
+STATIC_VARNAMES = ['area', 'mu_global']      # copied from the first file rather than combined
+OPERATIONS = {'sub': 'difference sa*a - sb*b', 'div': 'ratio sa*a / sb*b', 'add': 'scaled sum sa*a + sb*b'}
+CHUNK_MB = 64           # memory used by a chunk of values from each file
+COORD_TOLERANCE = 1.0e-5
+MISSING_VALUE = -999.0
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+def _combined_varnames(nc_dset):
+    """
+    variables over latitude and longitude which are combined
+    """
+    var_names = []
+    for var_name, varia in nc_dset.variables.items():
+        if var_name in STATIC_VARNAMES:
+            continue
+        if any(dim in LAT_DIMS for dim in varia.dimensions) and any(dim in LON_DIMS for dim in varia.dimensions):
+            var_names.append(var_name)
+
+    return var_names
+
+def check_nc_alignment(nc_a, nc_b, var_names):
+    """
+    return None if the variables of both files share the same grid and time axis otherwise an error message
+    """
+    for var_name in var_names:
+        if var_name not in nc_b.variables:
+            return 'variable {} is missing from the second file'.format(var_name)
+
+        var_a = nc_a.variables[var_name]
+        var_b = nc_b.variables[var_name]
+        if var_a.dimensions != var_b.dimensions or var_a.shape != var_b.shape:
+            return 'variable {} has dimensions {} {} and {} {}'.format(var_name, var_a.dimensions, var_a.shape,
+                                                                                    var_b.dimensions, var_b.shape)
+
+        for dim in var_a.dimensions:
+            if dim not in nc_a.variables:
+                continue
+
+            if dim not in nc_b.variables:
+                return 'coordinate variable {} is missing from the second file'.format(dim)
+
+            vals_a = nc_a.variables[dim][:]
+            vals_b = nc_b.variables[dim][:]
+            if dim in LAT_DIMS or dim in LON_DIMS:
+                if not allclose(vals_a, vals_b, rtol=0.0, atol=COORD_TOLERANCE):
+                    return 'grids differ for coordinate {}'.format(dim)
+            else:
+                units_a = getattr(nc_a.variables[dim], 'units', None)
+                units_b = getattr(nc_b.variables[dim], 'units', None)
+                if not array_equal(vals_a, vals_b) or units_a != units_b:
+                    return 'time axes differ for coordinate {}'.format(dim)
+
+    return None
+
+def _evaluate(operation, vals_a, vals_b, scales):
+    """
+    combine two masked arrays - result is masked where either input is masked and, since masked arrays are
+    used, where a divisor is zero
+    """
+    vals_a = ma.asarray(vals_a, dtype=float64) * scales[0]
+    vals_b = ma.asarray(vals_b, dtype=float64) * scales[1]
+    if operation == 'sub':
+        return vals_a - vals_b
+    elif operation == 'add':
+        return vals_a + vals_b
+    else:
+        return vals_a / vals_b
+
+def _create_output_nc(nc_a, nc_fname, var_names, operation, profile_name):
+    """
+    output file has the dimensions, global attributes and variables of the first file
+    """
+    nc_out = Dataset(nc_fname, 'w', format='NETCDF4')
+    for attr_name in nc_a.ncattrs():
+        nc_out.setncattr(attr_name, nc_a.getncattr(attr_name))
+    nc_out.operation = OPERATIONS[operation]
+
+    for dim_name, dim in nc_a.dimensions.items():
+        nc_out.createDimension(dim_name, None if dim.isunlimited() else len(dim))
+
+    for var_name, var_a in nc_a.variables.items():
+        attrs = {attr_name: var_a.getncattr(attr_name) for attr_name in var_a.ncattrs()}
+        fill_value = attrs.pop('_FillValue', None)
+        if var_name in var_names:
+            datatype = var_a.dtype if np_dtype(var_a.dtype).kind == 'f' else 'f4'
+            if fill_value is None:
+                fill_value = MISSING_VALUE
+            var_out = create_profiled_variable(nc_out, profile_name, var_name, datatype, var_a.dimensions,
+                                                                                                fill_value=fill_value)
+        else:
+            var_out = create_profiled_variable(nc_out, profile_name, var_name, var_a.dtype, var_a.dimensions,
+                                                                                                fill_value=fill_value)
+        for attr_name, attr_val in attrs.items():
+            var_out.setncattr(attr_name, attr_val)
+
+    apply_chunk_cache(nc_out, profile_name)
+
+    return nc_out
+
+def _time_chunks(varia):
+    """
+    yield slices of the variable, each comprising as many steps of the leading non spatial axis as fit in CHUNK_MB
+    """
+    dims = varia.dimensions
+    time_axes = [iax for iax, dim in enumerate(dims) if dim not in LAT_DIMS and dim not in LON_DIMS]
+    if len(time_axes) == 0 or varia.size == 0:
+        yield tuple([slice(None)] * len(dims))
+        return
+
+    time_axis = time_axes[0]
+    ntimes = varia.shape[time_axis]
+    step_bytes = varia.size // ntimes * 8
+    chunk_ntimes = max(1, (CHUNK_MB * 1024 * 1024) // step_bytes)
+    for strt in range(0, ntimes, chunk_ntimes):
+        slices = [slice(None)] * len(dims)
+        slices[time_axis] = slice(strt, min(strt + chunk_ntimes, ntimes))
+        yield tuple(slices)
+
+def nc_operation(fn_a, fn_b, fn_out, operation='sub', scales=None, profile_name=DEFAULT_PROFILE):
+    """
+    write result of applying the operation to the variables of two NC files
+    return None on success otherwise an error message
+    """
+    if operation not in OPERATIONS:
+        return 'unknown operation {} - must be one of {}'.format(operation, ', '.join(OPERATIONS))
+    if scales is None:
+        scales = (1.0, 1.0)
+
+    for fname in (fn_a, fn_b):
+        if not isfile(fname):
+            return 'file {} does not exist'.format(fname)
+
+    fn_tmp = fn_out + '.tmp'
+    try:
+        with Dataset(fn_a, 'r') as nc_a, Dataset(fn_b, 'r') as nc_b:
+            var_names = _combined_varnames(nc_a)
+            if len(var_names) == 0:
+                return 'no variables over latitude and longitude in {}'.format(fn_a)
+
+            err_mess = check_nc_alignment(nc_a, nc_b, var_names)
+            if err_mess is not None:
+                return err_mess
+
+            nc_out = _create_output_nc(nc_a, fn_tmp, var_names, operation, profile_name)
+            try:
+                for var_name, var_a in nc_a.variables.items():
+                    var_out = nc_out.variables[var_name]
+                    if var_name not in var_names:
+                        if var_a.ndim == 0:
+                            var_out.assignValue(var_a.getValue())
+                        else:
+                            var_out[:] = var_a[:]
+                        continue
+
+                    var_b = nc_b.variables[var_name]
+                    for slices in _time_chunks(var_a):
+                        var_out[slices] = _evaluate(operation, var_a[slices], var_b[slices], scales)
+            finally:
+                nc_out.close()
+
+        replace(fn_tmp, fn_out)
+
+    except (OSError, IndexError, ValueError, RuntimeError) as err:
+        if isfile(fn_tmp):
+            remove(fn_tmp)
+        return str(err)
+
+    return None
+
+def _nc_task(nc_task):
+    """
+    run one operation in a worker process - return output file name, error or None and elapsed time
+    """
+    strt_time = time()
+    fn_a, fn_b, fn_out, operation, scales, profile_name = nc_task
+
+    return fn_out, nc_operation(fn_a, fn_b, fn_out, operation, scales, profile_name), time() - strt_time
+
+def run_nc_operations(nc_tasks, nworkers=None):
+    """
+    each task comprises: first file, second file, output file, operation, scales and profile name
+    independent tasks are run concurrently - returns number of output files successfully written
+    """
+    strt_time = time()
+    if len(nc_tasks) == 0:
+        return 0
+
+    if nworkers is None:
+        nworkers = cpu_count() or 1
+    nworkers = max(1, min(nworkers, len(nc_tasks)))
+
+    if nworkers == 1:
+        outcomes = [_nc_task(nc_task) for nc_task in nc_tasks]
+    else:
+        with Pool(nworkers) as pool:
+            outcomes = pool.map(_nc_task, nc_tasks)
+
+    nsuccess = 0
+    for nc_task, (fn_out, err_mess, elapsed) in zip(nc_tasks, outcomes):
+        fn_a, fn_b, fn_out, operation, scales, profile_name = nc_task
+        if err_mess is None:
+            print('Wrote {} from {} {} {} in {:.1f} seconds'.format(split(fn_out)[1], split(fn_a)[1], operation,
+                                                                                        split(fn_b)[1], elapsed))
+            nsuccess += 1
+        else:
+            print(ERROR_STR + 'could not write {} - {}'.format(fn_out, err_mess))
+
+    print('Completed {} of {} NC operations in {:.1f} seconds'.format(nsuccess, len(nc_tasks), time() - strt_time))
+
+    return nsuccess
@@ -0,0 +1,343 @@
+#-------------------------------------------------------------------------------
+# Name:        nc_coarsen.py
+# Purpose:     area weighted coarsening of COARDS compliant NC files to integer multiples of the study resolution
+# Author:      agent
+# Created:     18/10/2026
+# Description: the area variable supplies the weights - stocks, e.g. SOC, become area weighted means and fluxes
+#              become totals over each coarse cell; the input is read one time slice at a time and each slice is
+#              written to every coarse file so that memory is bounded by the size of a slice and a full pyramid
+#              of resolutions is produced in a single pass
+#              usage: python nc_coarsen.py EU_Wheat_A1B_soc.nc --factors 5 10 [--pyramid] [--profile archive]
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'nc_coarsen.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from argparse import ArgumentParser
+from os import remove
+from os.path import isfile, splitext, join, split
+from sys import exit
+from time import time
+
+from netCDF4 import Dataset
+from numpy import asarray, zeros, where, float64, ma
+
+from create_coards_nc_class import find_metric_in_flist_names, MISSING_VALUE
+from nc_profiles import create_profiled_variable, apply_chunk_cache, report_nc_file, fetch_nc_profile, \
+                                                                                    DEFAULT_PROFILE, NC_PROFILES
+from csv_to_coards_nc import NC_METRICS
+
+PROGRAM_ID = 'nc_coarsen'
+M2_PER_KM2 = 1000000.0
+FLUX_UNITS_SUFFIX = 'yr-1'      # variables whose units are per year are fluxes, otherwise stocks
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+class CoarseOutput(object):
+    """
+    one coarse resolution NC file being written
+    """
+    def __init__(self, grid, nc_fname, nc_dset):
+        """
+        C
+        """
+        self.grid = grid
+        self.nc_fname = nc_fname
+        self.nc_dset = nc_dset
+
+class CoarseGrid(object):
+    """
+    coarse cells are aligned with multiples of the coarse resolution e.g. 0.5 degree cells start at whole and half
+    degrees, so the fine grid is offset within the first coarse cell along each axis
+    """
+    def __init__(self, alats, alons, factor, resolution):
+        """
+        C
+        """
+        self.factor = factor
+        self.lat_offset, self.alats = _coarse_axis(alats, factor, resolution)
+        self.lon_offset, self.alons = _coarse_axis(alons, factor, resolution)
+        self.nlats = len(self.alats)
+        self.nlons = len(self.alons)
+
+    def block_sum(self, vals):
+        """
+        sum each factor x factor block of a 2D array, padding with zeros where blocks extend beyond the fine grid
+        """
+        nlats, nlons = vals.shape
+        factor = self.factor
+        padded = zeros((self.nlats * factor, self.nlons * factor), dtype=float64)
+        padded[self.lat_offset:self.lat_offset + nlats, self.lon_offset:self.lon_offset + nlons] = vals
+
+        return padded.reshape(self.nlats, factor, self.nlons, factor).sum(axis=(1, 3))
+
+def _coarse_axis(vals, factor, resolution):
+    """
+    return number of fine cells preceding the fine grid in the first coarse cell and centres of the coarse cells
+    """
+    step = float(vals[1] - vals[0]) if len(vals) > 1 else resolution
+    sign = 1.0 if step > 0.0 else -1.0
+    crse_resol = resolution * factor
+    edge = float(vals[0]) - step / 2.0
+    offset = int(round(((sign * edge) % crse_resol) / resolution)) % factor
+    ncrse = -(-(len(vals) + offset) // factor)
+    crse_edge = edge - sign * offset * resolution
+
+    return offset, asarray([crse_edge + sign * crse_resol * (indx + 0.5) for indx in range(ncrse)])
+
+def _time_dependent_vars(nc_dset):
+    """
+    variables over time, latitude and longitude
+    """
+    return [name for name, varia in nc_dset.variables.items() if varia.dimensions == ('time', 'latitude', 'longitude')]
+
+def coarse_fname(nc_fname, resol):
+    """
+    e.g. EU_Wheat_A1B_soc.nc at 0.5 degrees becomes EU_Wheat_A1B_soc_0.5deg.nc
+    """
+    return splitext(nc_fname)[0] + '_{:g}deg.nc'.format(resol)
+
+def _create_coarse_nc(nc_in, grid, resol, nc_fname, var_names, flux_flags, profile_name):
+    """
+    create coarse NC file with the same time axis and global attributes as the input file
+    """
+    factor = grid.factor
+    nc_dset = Dataset(nc_fname, 'w', format='NETCDF4')
+    for attr_name in nc_in.ncattrs():
+        nc_dset.setncattr(attr_name, nc_in.getncattr(attr_name))
+    nc_dset.coarsened = 'area weighted means of stocks and totals of fluxes over {} x {} cells'.format(factor, factor)
+
+    nc_dset.createDimension('latitude', grid.nlats)
+    nc_dset.createDimension('longitude', grid.nlons)
+    nc_dset.createDimension('time', len(nc_in.dimensions['time']))
+    nc_dset.createDimension('bnds', 2)
+
+    lats = nc_dset.createVariable('latitude', 'f4', ('latitude',))
+    lats.description = 'degrees of latitude North to South in ' + str(resol) + ' degree steps'
+    lats.units = 'degrees_north'
+    lats.long_name = 'latitude'
+    lats.axis = 'Y'
+    lats[:] = grid.alats
+
+    lons = nc_dset.createVariable('longitude', 'f4', ('longitude',))
+    lons.description = 'degrees of longitude West to East in ' + str(resol) + ' degree steps'
+    lons.units = 'degrees_east'
+    lons.long_name = 'longitude'
+    lons.axis = 'X'
+    lons[:] = grid.alons
+
+    times = nc_dset.createVariable('time', 'f4', ('time',))
+    for attr_name in nc_in.variables['time'].ncattrs():
+        times.setncattr(attr_name, nc_in.variables['time'].getncattr(attr_name))
+    times[:] = nc_in.variables['time'][:]
+
+    if 'time_bnds' in nc_in.variables:
+        time_bnds = nc_dset.createVariable('time_bnds', 'f4', ('time', 'bnds'), fill_value=MISSING_VALUE)
+        time_bnds[:] = nc_in.variables['time_bnds'][:]
+
+    areas = create_profiled_variable(nc_dset, profile_name, 'area', 'f4', ('latitude', 'longitude'),
+                                                                                            fill_value=MISSING_VALUE)
+    areas.units = 'km**2'
+    areas.MISSING_VALUE = MISSING_VALUE
+
+    for var_name, flux_flag in zip(var_names, flux_flags):
+        var_in = nc_in.variables[var_name]
+        var_varia = create_profiled_variable(nc_dset, profile_name, var_name, 'f4', ('time', 'latitude', 'longitude'),
+                                                                                            fill_value=MISSING_VALUE)
+        if 'long_name' in var_in.ncattrs():
+            var_varia.long_name = var_in.long_name
+        units = var_in.units if 'units' in var_in.ncattrs() else ''
+        if flux_flag:
+            var_varia.units = units.replace(' m-2', '')     # total over each coarse cell
+            var_varia.cell_methods = 'area: sum'
+        else:
+            var_varia.units = units
+            var_varia.cell_methods = 'area: mean'
+
+    apply_chunk_cache(nc_dset, profile_name)
+
+    return nc_dset
+
+def coarsen_coards_nc(nc_fname, factors, resolution=None, profile_name=DEFAULT_PROFILE, delete_flag=True):
+    """
+    write a coarse NC file for each factor, an integer multiple of the resolution of the input file
+    return list of coarse NC file names
+    """
+    strt_time = time()
+    try:
+        nc_in = Dataset(nc_fname, 'r')
+    except (OSError, TypeError) as err:
+        print(ERROR_STR + 'Unable to open {}. {}'.format(nc_fname, err))
+        return []
+
+    var_names = _time_dependent_vars(nc_in)
+    if len(var_names) == 0 or 'area' not in nc_in.variables:
+        print(ERROR_STR + '{} requires area and time dependent variables over latitude and longitude'.format(nc_fname))
+        nc_in.close()
+        return []
+
+    alats = nc_in.variables['latitude'][:]
+    if resolution is None:
+        resolution = abs(float(alats[-1]) - float(alats[0])) / (len(alats) - 1) if len(alats) > 1 else 1.0
+        resolution = float('{:.6g}'.format(resolution))       # coordinates are stored as 4 byte floats
+
+    flux_flags = []
+    for var_name in var_names:
+        units = getattr(nc_in.variables[var_name], 'units', '')
+        flux_flags.append(units.endswith(FLUX_UNITS_SUFFIX))
+
+    # weights are the cell areas, zero where missing
+    # ==============================================
+    area = ma.filled(ma.asarray(nc_in.variables['area'][:], dtype=float64), 0.0)
+    area = where(area > 0.0, area, 0.0)
+    alons = nc_in.variables['longitude'][:]
+
+    # create coarse files
+    # ===================
+    coarse_outputs = []
+    for factor in sorted(set(factors)):
+        if factor < 2:
+            print(WARNING_STR + 'factor {} ignored - must be an integer of at least 2'.format(factor))
+            continue
+
+        resol = resolution * factor
+        fout_name = coarse_fname(nc_fname, resol)
+        if isfile(fout_name):
+            if not delete_flag:
+                print('File ' + fout_name + ' already exists')
+                continue
+            try:
+                remove(fout_name)
+            except PermissionError:
+                print(WARNING_STR + 'could not delete file: ' + fout_name)
+                continue
+
+        grid = CoarseGrid(alats, alons, factor, resolution)
+        nc_dset = _create_coarse_nc(nc_in, grid, resol, fout_name, var_names, flux_flags, profile_name)
+        area_sum = grid.block_sum(area)
+        nc_dset.variables['area'][:] = where(area_sum > 0.0, area_sum, MISSING_VALUE)
+        coarse_outputs.append(CoarseOutput(grid, fout_name, nc_dset))
+
+    if len(coarse_outputs) == 0:
+        nc_in.close()
+        return []
+
+    # stream through time slices, each slice is read once and written to every coarse file
+    # =====================================================================================
+    ntimes = len(nc_in.dimensions['time'])
+    for var_name, flux_flag in zip(var_names, flux_flags):
+        var_in = nc_in.variables[var_name]
+        for itime in range(ntimes):
+            vals = ma.asarray(var_in[itime, :, :], dtype=float64)
+            valid = ~ma.getmaskarray(vals) & (area > 0.0)
+            weights = where(valid, area, 0.0)
+            weighted_vals = where(valid, ma.filled(vals, 0.0), 0.0) * weights
+
+            for coarse in coarse_outputs:
+                wsum = coarse.grid.block_sum(weighted_vals)
+                wgts = coarse.grid.block_sum(weights)
+                if flux_flag:
+                    crse_vals = where(wgts > 0.0, wsum * M2_PER_KM2, MISSING_VALUE)
+                else:
+                    crse_vals = where(wgts > 0.0, wsum / where(wgts > 0.0, wgts, 1.0), MISSING_VALUE)
+
+                coarse.nc_dset.variables[var_name][itime, :, :] = crse_vals
+
+    nc_in.close()
+
+    fout_names = []
+    for coarse in coarse_outputs:
+        coarse.nc_dset.close()
+        report_nc_file(coarse.nc_fname, profile_name, strt_time)
+        fout_names.append(coarse.nc_fname)
+
+    return fout_names
+
+def pyramid_factors(nc_fname):
+    """
+    successive doublings of the resolution until the grid would comprise a single cell
+    """
+    with Dataset(nc_fname, 'r') as nc_dset:
+        max_len = max(len(nc_dset.dimensions['latitude']), len(nc_dset.dimensions['longitude']))
+
+    factors = []
+    factor = 2
+    while factor < max_len:
+        factors.append(factor)
+        factor *= 2
+
+    return factors
+
+def resolution_factors(resolution, resolutions):
+    """
+    convert required resolutions to integer multiples of the study resolution
+    """
+    factors = []
+    for resol in resolutions:
+        factor = int(round(resol / resolution))
+        if factor < 2 or abs(factor * resolution - resol) > 1.0e-6 * resol:
+            print(WARNING_STR + 'resolution {} is not an integer multiple of {} - ignored'.format(resol, resolution))
+            continue
+        factors.append(factor)
+
+    return factors
+
+def coarsen_coards_outputs(form, resolutions=None, pyramid_flag=False):
+    """
+    coarsen COARDS NC files of the current results, written by csv_to_coards_netcdf, and net CO2e NC file
+    """
+    if resolutions is None:
+        resolutions = [0.5, 1.0]
+
+    resolution = form.study_defn['resolution']
+    profile_name = fetch_nc_profile(form)
+    file_list = form.trans_defn['file_list']
+    factors = resolution_factors(resolution, resolutions)
+
+    nc_fnames = []
+    for metric in NC_METRICS:
+        fname = find_metric_in_flist_names(file_list, metric)
+        if fname is not None and isfile(splitext(fname)[0] + '.nc'):
+            nc_fnames.append(splitext(fname)[0] + '.nc')
+
+    out_dir = form.w_lbl_rslts.text()
+    co2e_fname = join(out_dir, split(out_dir)[1] + '_co2e.nc')    # as named by csv_to_co2e_netcdf
+    if isfile(co2e_fname):
+        nc_fnames.append(co2e_fname)
+
+    ncoarse = 0
+    for nc_fname in nc_fnames:
+        nc_factors = factors + pyramid_factors(nc_fname) if pyramid_flag else factors
+        ncoarse += len(coarsen_coards_nc(nc_fname, nc_factors, resolution, profile_name, form.w_del_nc.isChecked()))
+
+    print('Wrote {} coarse NC files from {} NC files'.format(ncoarse, len(nc_fnames)))
+
+    return ncoarse
+
+def main():
+    """
+    Entry point
+    """
+    parser = ArgumentParser(prog=PROGRAM_ID, description='Area weighted coarsening of COARDS compliant NC files')
+    parser.add_argument('nc_fnames', nargs='+', help='COARDS compliant NC files')
+    parser.add_argument('--factors', type=int, nargs='*', default=[], help='integer multiples of the resolution')
+    parser.add_argument('--pyramid', action='store_true', help='add successive doublings of the resolution')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, choices=list(NC_PROFILES), help='NetCDF profile')
+    args = parser.parse_args()
+
+    nfailed = 0
+    for nc_fname in args.nc_fnames:
+        factors = args.factors + pyramid_factors(nc_fname) if args.pyramid else args.factors
+        if len(factors) == 0:
+            print(ERROR_STR + 'no factors given for ' + nc_fname)
+            exit(1)
+
+        if len(coarsen_coards_nc(nc_fname, factors, profile_name=args.profile)) == 0:
+            nfailed += 1
+
+    exit(1 if nfailed > 0 else 0)
+
+if __name__ == '__main__':
+    main()
@@ -15,9 +15,11 @@ __author__ = 's03mm5'
 from sys import stdout
 from _datetime import datetime
 from locale import format_string
-from numpy import arange
+from numpy import arange, asarray, rint, int64
 from time import time
 
+from progress_events import report_progress, check_cancelled
+
 missing_value = -999.0
 sleepTime = 3
 imiss_value = int(missing_value)
@@ -28,6 +30,9 @@ def update_progress_bar(last_time, trans_nlines, num_out_lines, num_bad_lines):
         """
         Update progress bar
         """
+        report_progress(num_out_lines + num_bad_lines, trans_nlines, 'lines')
+        check_cancelled()
+
         new_time = time()
         if new_time - last_time > sleepTime:
             last_time = new_time
@@ -70,12 +75,14 @@ def generate_mnthly_atimes(fut_start_year, num_months):
 
     return atimes, atimes_strt, atimes_end
 
-def get_nc_coords(form, latitude, longitude, max_lat_indx, max_lon_indx):
+def get_nc_coords(form, latitude, longitude, max_lat_indx, max_lon_indx, bbox_nc=None):
     """
-
+    bbox_nc overrides form.bbox_nc when several NC files with differing extents are written at once
     """
     NUDGE = 0.001   # avoids anomaly whereby round(48.5) and round(47.5) both give 48
-    ll_lon, ll_lat, ur_lon, ur_lat = form.bbox_nc
+    if bbox_nc is None:
+        bbox_nc = form.bbox_nc
+    ll_lon, ll_lat, ur_lon, ur_lat = bbox_nc
     resol = form.study_defn['resolution']
 
     lat_indx = round((latitude - ll_lat - NUDGE)/resol)
@@ -95,6 +102,23 @@ def get_nc_coords(form, latitude, longitude, max_lat_indx, max_lon_indx):
 
     return lat_indx, lon_indx
 
+def get_nc_coords_block(bbox_nc, resol, latitudes, longitudes, max_lat_indx, max_lon_indx):
+    """
+    vectorised get_nc_coords for arrays of latitudes and longitudes - indices of cells out of bounds are set to -1
+    NB rint, as with round, rounds halves to the nearest even integer
+    """
+    NUDGE = 0.001   # avoids anomaly whereby round(48.5) and round(47.5) both give 48
+    ll_lon, ll_lat, ur_lon, ur_lat = bbox_nc
+
+    lat_indxs = rint((asarray(latitudes) - ll_lat - NUDGE)/resol).astype(int64)
+    lon_indxs = rint((asarray(longitudes) - ll_lon - NUDGE)/resol).astype(int64)
+
+    outside = (lat_indxs < 0) | (lat_indxs > max_lat_indx) | (lon_indxs < 0) | (lon_indxs > max_lon_indx)
+    lat_indxs[outside] = -1
+    lon_indxs[outside] = -1
+
+    return lat_indxs, lon_indxs
+
 def generate_yearly_atimes(fut_start_year, num_years):
     """
     expect 1092 for 91 years plus 2 extras for 40 and 90 year differences
@@ -0,0 +1,97 @@
+#-------------------------------------------------------------------------------
+# Name:        nc_profiles.py
+# Purpose:     named chunking and compression profiles for NetCDF variables created by the converters
+# Author:      agent
+# Created:     18/10/2026
+# Description: each profile sets chunk shape, zlib compression level, shuffle filter and HDF5 chunk cache for the
+#              variables with latitude and longitude dimensions; coordinate variables are left unchanged
+#                   default            - netCDF4 library defaults i.e. contiguous and uncompressed
+#                   map-access         - one time step per chunk, suited to reading complete maps
+#                   time-series-access - full time axis per chunk, suited to reading the history of a few cells
+#                   archive            - a year of months per chunk with heavy compression
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'nc_profiles.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os.path import isfile, getsize, split
+from time import time
+
+LAT_DIMS = ('latitude', 'lat')
+LON_DIMS = ('longitude', 'lon')
+DEFAULT_PROFILE = 'default'
+
+# time_chunk of None means the whole time axis
+# ============================================
+NC_PROFILES = {
+    'default': None,
+    'map-access': {'time_chunk': 1, 'space_chunk': 512, 'zlib': True, 'complevel': 4, 'shuffle': True,
+                                                                                                    'cache_mb': 16},
+    'time-series-access': {'time_chunk': None, 'space_chunk': 8, 'zlib': True, 'complevel': 4, 'shuffle': True,
+                                                                                                    'cache_mb': 64},
+    'archive': {'time_chunk': 12, 'space_chunk': 64, 'zlib': True, 'complevel': 9, 'shuffle': True, 'cache_mb': 32}
+}
+
+WARNING_STR = '*** Warning *** '
+
+def fetch_nc_profile(form):
+    """
+    profile selected in the GUI or, for batch use, set as an attribute of the form object
+    """
+    if hasattr(form, 'w_nc_profile'):
+        profile_name = form.w_nc_profile.currentText()
+    else:
+        profile_name = getattr(form, 'nc_profile', DEFAULT_PROFILE)
+
+    if profile_name not in NC_PROFILES:
+        print(WARNING_STR + 'unknown NetCDF profile {} - will use {}'.format(profile_name, DEFAULT_PROFILE))
+        profile_name = DEFAULT_PROFILE
+
+    return profile_name
+
+def create_profiled_variable(nc_dset, profile_name, var_name, datatype, dimensions, fill_value=None):
+    """
+    wrapper for createVariable which applies the chunking and compression of the profile
+    """
+    profile = NC_PROFILES[profile_name]
+    if profile is None or not any(dim in LAT_DIMS for dim in dimensions):
+        return nc_dset.createVariable(var_name, datatype, dimensions, fill_value=fill_value)
+
+    chunksizes = []
+    for dim in dimensions:
+        dim_len = len(nc_dset.dimensions[dim])
+        if dim in LAT_DIMS or dim in LON_DIMS:
+            chunk_len = profile['space_chunk']
+        else:
+            chunk_len = profile['time_chunk']
+
+        if chunk_len is None or chunk_len > dim_len:
+            chunk_len = dim_len
+        chunksizes.append(max(1, chunk_len))
+
+    return nc_dset.createVariable(var_name, datatype, dimensions, fill_value=fill_value, chunksizes=chunksizes,
+                                zlib=profile['zlib'], complevel=profile['complevel'], shuffle=profile['shuffle'])
+
+def apply_chunk_cache(nc_dset, profile_name):
+    """
+    chunk cache is a property of an open dataset rather than of the file so is set each time a file is opened
+    """
+    profile = NC_PROFILES[profile_name]
+    if profile is None:
+        return
+
+    for var in nc_dset.variables.values():
+        if any(dim in LAT_DIMS for dim in var.dimensions):
+            var.set_var_chunk_cache(size=profile['cache_mb'] * 1024 * 1024)
+
+def report_nc_file(nc_fname, profile_name, strt_time):
+    """
+    report size and write time of a completed NC file
+    """
+    if not isfile(nc_fname):
+        return
+
+    fsize_mb = getsize(nc_fname) / (1024 * 1024)
+    print('NC file {} using profile {}: size {:.2f} MB written in {:.1f} seconds'
+                                            .format(split(nc_fname)[1], profile_name, fsize_mb, time() - strt_time))
@@ -0,0 +1,300 @@
+#-------------------------------------------------------------------------------
+# Name:        nc_statistics.py
+# Purpose:     write per cell temporal statistics of each metric as 2D (latitude, longitude) NC variables
+# Author:      agent
+# Created:     18/10/2026
+# Description: statistics are calculated from annual values - the mean of the months for SOC and the sum for
+#              fluxes, as with the _yrs variables of the raw NC file - for whole blocks of rows at once and are
+#              held in latitude by longitude grids which are written when the pass is complete:
+#                  mean, minimum and maximum of the annual values
+#                  trend, the least squares slope of the annual values per year
+#                  change, last less first value - for SOC the last month less the first, as with soc_diff
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'nc_statistics.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os.path import normpath, isfile, join, split, splitext
+from os import remove
+from time import time, strftime
+
+from netCDF4 import Dataset
+from numpy import arange, full, float32, float64, asarray
+
+from input_output_funcs import read_results_blocks, conversion_period
+from nc_low_level_fns import get_nc_coords_block
+from nc_profiles import fetch_nc_profile, create_profiled_variable, report_nc_file
+from progress_events import report_progress, check_cancelled
+
+METRICS = ['ch4', 'co2', 'no3', 'n2o', 'soc', 'npp']
+STOCK_METRICS = ['soc']
+STATISTICS = {'mean': 'mean of annual values', 'trend': 'least squares slope of annual values per year',
+              'change': 'last less first value', 'min': 'minimum annual value', 'max': 'maximum annual value'}
+MAX_FIELDS_MONTHLY = 3600     # if number of fields exceeeds this then assume timestep is daily
+MISSING_VALUE = -999.0
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+def temporal_statistics(vals, nvals_per_year, stock_flag):
+    """
+    vals is a matrix with one row for each cell - return dictionary of arrays with one value for each cell
+    trailing values which do not make up a whole year are ignored
+    """
+    vals = asarray(vals, dtype=float64)
+    nyears = vals.shape[1] // nvals_per_year
+    annual = vals[:, :nyears * nvals_per_year].reshape(vals.shape[0], nyears, nvals_per_year).sum(axis=2)
+    if stock_flag:
+        annual /= nvals_per_year
+
+    stats = {'mean': annual.mean(axis=1), 'min': annual.min(axis=1), 'max': annual.max(axis=1)}
+
+    # least squares slope using centred years
+    # =======================================
+    years = arange(nyears, dtype=float64)
+    years -= years.mean()
+    sum_sqrs = (years * years).sum()
+    if sum_sqrs > 0.0:
+        stats['trend'] = (annual - stats['mean'][:, None]) @ years / sum_sqrs
+    else:
+        stats['trend'] = full(vals.shape[0], 0.0)
+
+    if stock_flag:
+        stats['change'] = vals[:, -1] - vals[:, 0]
+    else:
+        stats['change'] = annual[:, -1] - annual[:, 0]
+
+    return stats
+
+def stat_units(metric, stat):
+    """
+    annual values of a stock are in kg/hectare and those of a flux in kg/hectare/year; a trend is a change per year
+    """
+    if metric in STOCK_METRICS:
+        return 'kg/hectare/year' if stat == 'trend' else 'kg/hectare'
+    else:
+        return 'kg/hectare/year**2' if stat == 'trend' else 'kg/hectare/year'
+
+class StatsOutput(object):
+    """
+    statistics NC file together with grids of each statistic of each metric which are filled as cells arrive
+    has the attributes and methods of NcOutput so that it can be written during the single pass of csv_to_all_ncs
+    """
+    def __init__(self, nc_fname, bbox_nc, metrics, nvals_per_year):
+        """
+        grids are written to the NC file when it is closed
+        """
+        self.product = 'stats'
+        self.nc_fname = nc_fname
+        self.bbox_nc = bbox_nc
+        self.metric = None
+        self.rqrd_metrics = None
+        self.metrics = metrics
+        self.nvals_per_year = nvals_per_year
+        with Dataset(nc_fname, 'r') as nc_dset:
+            nlats = nc_dset.variables['latitude'].shape[0]
+            nlons = nc_dset.variables['longitude'].shape[0]
+        self.max_lat_indx = nlats - 1
+        self.max_lon_indx = nlons - 1
+        self.grids = {'area': full((nlats, nlons), MISSING_VALUE, dtype=float32)}
+        for metric in metrics:
+            for stat in STATISTICS:
+                self.grids[metric + '_' + stat] = full((nlats, nlons), MISSING_VALUE, dtype=float32)
+        self.num_out_lines = 0
+        self.num_bad_lines = 0
+
+    def is_complete(self, atom_tran, ntrans_fields):
+        """
+        cells are written if at least one metric has the expected number of values
+        """
+        for metric in self.metrics:
+            if metric in atom_tran and len(atom_tran[metric]) == ntrans_fields:
+                return True
+
+        return False
+
+    def add_cells(self, lat_indxs, lon_indxs, areas, vals):
+        """
+        vals is a dictionary of matrices, one row for each cell, keyed by metric; cells with an index of -1 lie
+        outside the grid and are ignored
+        """
+        lat_indxs = asarray(lat_indxs)
+        lon_indxs = asarray(lon_indxs)
+        inside = lat_indxs >= 0
+        lat_indxs = lat_indxs[inside]
+        lon_indxs = lon_indxs[inside]
+        self.grids['area'][lat_indxs, lon_indxs] = asarray(areas)[inside]
+        for metric in self.metrics:
+            if metric not in vals or len(vals[metric]) == 0:
+                continue
+
+            metric_vals = asarray(vals[metric], dtype=float64)
+            if metric == 'npp':
+                metric_vals = metric_vals/2     # flux co2 from dry matter, as in the raw NC file
+            stats = temporal_statistics(metric_vals, self.nvals_per_year, metric in STOCK_METRICS)
+            for stat in STATISTICS:
+                self.grids[metric + '_' + stat][lat_indxs, lon_indxs] = stats[stat][inside]
+
+        return int(inside.sum())
+
+    def close(self):
+        """
+        write grids and close NC file - return False if grids could not be written
+        """
+        try:
+            with Dataset(self.nc_fname, 'a') as nc_dset:
+                for varname, grid in self.grids.items():
+                    nc_dset.variables[varname][:, :] = grid
+            retcode = True
+        except (OSError, IndexError, ValueError, RuntimeError) as err:
+            print('\n' + ERROR_STR + '{}\nwriting statistics to {}'.format(err, self.nc_fname))
+            retcode = False
+
+        return retcode
+
+def create_stats_nc_dset(form, metrics, out_dir=None):
+    """
+    grid is that of the raw NC file - return name of NC file or 1 on failure
+    """
+    study = form.study_defn['study']
+    profile_name = fetch_nc_profile(form)
+    resol = form.study_defn['resolution']
+    if resol is None:
+        print(ERROR_STR + 'cannot proceed - resolution is set to None')
+        return 1
+
+    # expand bounding box to make sure all results are included
+    # =========================================================
+    ll_lon, ll_lat, ur_lon, ur_lat = form.study_defn['bbox']
+    resol_d2 = resol/2.0
+    ll_lon = resol*int(ll_lon/resol) - resol_d2
+    ll_lat = resol*int(ll_lat/resol) - resol_d2
+    ur_lon = resol*int(ur_lon/resol) + resol + resol_d2
+    ur_lat = resol*int(ur_lat/resol) + resol + resol_d2
+    form.bbox_nc = [ll_lon, ll_lat, ur_lon, ur_lat]
+
+    alons = arange(ll_lon, ur_lon, resol, dtype=float64)
+    alats = arange(ll_lat, ur_lat, resol, dtype=float64)
+
+    fut_strt_year, fut_end_year = form.trans_defn.get('period', (form.study_defn['futStrtYr'],
+                                                                                    form.study_defn['futEndYr']))
+
+    # construct the output file name and delete if it already exists
+    # ==============================================================
+    if out_dir is None:
+        out_dir = form.w_lbl_rslts.text()
+    fout_name = normpath(join(out_dir, study + '_stats.nc'))
+    if isfile(fout_name):
+        try:
+            remove(fout_name)
+            print('Deleted file: ' + fout_name)
+        except PermissionError:
+            print(ERROR_STR + 'could not delete file: ' + fout_name)
+            return 1
+
+    nc_dset = Dataset(fout_name, 'w')
+    nc_dset.history = 'temporal statistics of ' + study + ' study'
+    nc_dset.attributation = 'Created at ' + strftime('%H:%M %d-%m-%Y') + ' from Spatial Ecosse '
+    nc_dset.period = '{} to {}'.format(fut_strt_year, fut_end_year)
+
+    nc_dset.createDimension('lat', len(alats))
+    nc_dset.createDimension('lon', len(alons))
+
+    lats = nc_dset.createVariable('latitude', 'f4', ('lat',))
+    lats.units = 'degrees of latitude North to South in ' + str(resol) + ' degree steps'
+    lats.long_name = 'latitude'
+    lats[:] = alats
+
+    lons = nc_dset.createVariable('longitude', 'f4', ('lon',))
+    lons.units = 'degrees of longitude West to East in ' + str(resol) + ' degree steps'
+    lons.long_name = 'longitude'
+    lons[:] = alons
+
+    var_varia = create_profiled_variable(nc_dset, profile_name, 'area', 'f4', ('lat', 'lon'), fill_value=MISSING_VALUE)
+    var_varia.units = 'km**2'
+    var_varia.missing_value = MISSING_VALUE
+
+    # one 2D variable for each statistic of each metric
+    # =================================================
+    for metric in metrics:
+        for stat, description in STATISTICS.items():
+            var_varia = create_profiled_variable(nc_dset, profile_name, metric + '_' + stat, 'f4', ('lat', 'lon'),
+                                                                                               fill_value=MISSING_VALUE)
+            var_varia.description = description
+            var_varia.long_name = '{} {} {} to {}'.format(metric, stat, fut_strt_year, fut_end_year)
+            var_varia.units = stat_units(metric, stat)
+            var_varia.missing_value = MISSING_VALUE
+
+    nc_dset.close()
+    print('Created {} netCDF file'.format(fout_name))
+
+    return fout_name
+
+def open_stats_output(form, metrics, nvals_per_year, out_dir=None):
+    """
+    create statistics NC file and return StatsOutput or None on failure
+    """
+    nc_fname = create_stats_nc_dset(form, metrics, out_dir)
+    if isinstance(nc_fname, int):
+        return None
+
+    return StatsOutput(nc_fname, list(form.bbox_nc), metrics, nvals_per_year)
+
+def _metric_of(fname):
+    """
+    metric is the last part of the name of a results file e.g. soc from EU_Wheat_A1B_soc.txt
+    """
+    return splitext(fname)[0].split('_')[-1]
+
+def csv_to_stats_netcdf(form, strt_year=None, end_year=None, out_dir=None):
+    """
+    when a start and/or end year is given statistics are for that period only
+    """
+    with conversion_period(form, strt_year, end_year) as period_flag:
+        if period_flag:
+            return _csv_to_stats_netcdf(form, out_dir)
+
+    return
+
+def _csv_to_stats_netcdf(form, out_dir):
+    """
+    read CSV result files, or results store, in blocks and calculate statistics for each block of cells at once
+    a row is rejected if any metric lacks the expected number of values
+    """
+    strt_time = time()
+    ntrans_fields = form.trans_defn['nfields']
+    nvals_per_year = 365 if ntrans_fields > MAX_FIELDS_MONTHLY else 12
+    trans_files = [fname for fname in form.trans_defn['file_list'] if _metric_of(fname) in METRICS]
+    if len(trans_files) == 0:
+        print('No result files for statistics')
+        return
+
+    metrics = [_metric_of(fname) for fname in trans_files]
+    stats_output = open_stats_output(form, metrics, nvals_per_year, out_dir)
+    if stats_output is None:
+        return
+
+    nlines = 0
+    for block in read_results_blocks(form.trans_defn, trans_files, dtype=float64):
+        nlines += block.nrows
+        stats_output.num_bad_lines += block.nbad
+        prefixes = [prefix for prefix, good_flag in zip(block.line_prefixes, block.good_rows) if good_flag]
+        if len(prefixes) == 0:
+            continue
+
+        lats = [float(prefix[1]) for prefix in prefixes]
+        lons = [float(prefix[2]) for prefix in prefixes]
+        areas = [float(prefix[7]) for prefix in prefixes]
+        lat_indxs, lon_indxs = get_nc_coords_block(stats_output.bbox_nc, form.study_defn['resolution'], lats, lons,
+                                                                stats_output.max_lat_indx, stats_output.max_lon_indx)
+        stats_output.num_out_lines += stats_output.add_cells(lat_indxs, lon_indxs, areas, block.vals)
+        report_progress(nlines, form.trans_defn['nlines'], 'lines')
+        check_cancelled()
+
+    retcode = stats_output.close()
+    print('Read {} lines and wrote statistics of {} cells to {}\trejected: {}'
+                    .format(nlines, stats_output.num_out_lines, stats_output.nc_fname, stats_output.num_bad_lines))
+    report_nc_file(stats_output.nc_fname, fetch_nc_profile(form), strt_time)
+
+    return retcode
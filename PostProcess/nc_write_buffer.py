@@ -0,0 +1,185 @@
+#-------------------------------------------------------------------------------
+# Name:        nc_write_buffer.py
+# Purpose:     buffer grid cell writes to NetCDF variables and flush them as large contiguous writes
+# Author:      agent
+# Created:     18/10/2026
+# Description: writing one grid cell at a time to a (time, latitude, longitude) variable is a strided write across
+#              every time slice, which is very slow in HDF5; instead cells are accumulated in latitude bands, or the
+#              full cube when it fits the memory budget, and each band is written with a single call per variable
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'nc_write_buffer.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from collections import OrderedDict
+from time import time
+
+from numpy import full, ma, dtype as np_dtype
+from netCDF4 import default_fillvals
+
+LAT_DIMS = ('latitude', 'lat')
+LON_DIMS = ('longitude', 'lon')
+MEM_BUDGET_MB = 512     # memory available to buffers of all variables
+MIN_ACTIVE_BANDS = 4    # when the full cube does not fit, size bands so that at least this many can be held
+
+class NcWriteBuffer(object):
+    """
+    buffers writes of individual grid cells to those variables of an open dataset which have latitude and longitude
+    dimensions; cells may arrive in any order - a band which has already been flushed is read back before further
+    cells are added to it
+    """
+    def __init__(self, nc_dset, varnames=None, mem_budget_mb=MEM_BUDGET_MB):
+        """
+        varnames defaults to all variables with latitude and longitude dimensions
+        """
+        self.nc_dset = nc_dset
+        self.layouts = {}
+        nlats = None
+        bytes_per_lat = 0
+        for varname, var in nc_dset.variables.items():
+            if varnames is not None and varname not in varnames:
+                continue
+
+            dims = var.dimensions
+            lat_axis = [iax for iax, dim in enumerate(dims) if dim in LAT_DIMS]
+            lon_axis = [iax for iax, dim in enumerate(dims) if dim in LON_DIMS]
+            if len(lat_axis) != 1 or len(lon_axis) != 1:
+                continue
+
+            lat_axis = lat_axis[0]
+            nlats = var.shape[lat_axis]
+            if '_FillValue' in var.ncattrs():
+                fill_value = var.getncattr('_FillValue')
+            else:
+                fill_value = default_fillvals[var.dtype.str[1:]]
+
+            self.layouts[varname] = (lat_axis, lon_axis[0], var.shape, var.dtype, fill_value)
+            bytes_per_lat += var.size // nlats * np_dtype(var.dtype).itemsize
+
+        # full cube if it fits otherwise bands of latitudes
+        # =================================================
+        mem_budget = mem_budget_mb * 1024 * 1024
+        self.nlats = 0 if nlats is None else nlats
+        if bytes_per_lat == 0 or bytes_per_lat * self.nlats <= mem_budget:
+            self.band_nlats = max(1, self.nlats)
+            self.max_bands = 1
+        else:
+            self.band_nlats = max(1, mem_budget // (MIN_ACTIVE_BANDS * bytes_per_lat))
+            self.max_bands = max(1, mem_budget // (self.band_nlats * bytes_per_lat))
+
+        self.bands = OrderedDict()      # most recently used band last
+        self.flushed_bands = set()
+        self.nflushes = 0
+        self.flush_time = 0.0
+
+    def set(self, varname, lat_indx, lon_indx, vals):
+        """
+        equivalent to variable[..., lat_indx, lon_indx, :len(vals)] = vals where the variable has at most one
+        dimension besides latitude and longitude; vals is a scalar for 2D variables
+        """
+        band_id = lat_indx // self.band_nlats
+        band = self._fetch_band(band_id)
+        lat_axis, lon_axis, shape, var_dtype, fill_value = self.layouts[varname]
+
+        indices = []
+        for iax in range(len(shape)):
+            if iax == lat_axis:
+                indices.append(lat_indx - band_id * self.band_nlats)
+            elif iax == lon_axis:
+                indices.append(lon_indx)
+            else:
+                indices.append(slice(0, len(vals)))
+
+        band[varname][tuple(indices)] = vals
+
+    def set_cells(self, varname, lat_indxs, lon_indxs, vals):
+        """
+        set for each cell of a block, vals having one element or row per cell; cells whose indices are -1, i.e. lie
+        outside the grid, are skipped - return number of cells set
+        """
+        ncells = 0
+        for indx in range(len(lat_indxs)):
+            if lat_indxs[indx] == -1:
+                continue
+            self.set(varname, int(lat_indxs[indx]), int(lon_indxs[indx]), vals[indx])
+            ncells += 1
+
+        return ncells
+
+    def _fetch_band(self, band_id):
+        """
+        return buffers for band, creating them if necessary and evicting least recently used band if over budget
+        """
+        if band_id in self.bands:
+            self.bands.move_to_end(band_id)
+            return self.bands[band_id]
+
+        if len(self.bands) >= self.max_bands:
+            evict_id, evict_band = self.bands.popitem(last=False)
+            self._write_band(evict_id, evict_band)
+
+        lat_strt, lat_end = self._band_limits(band_id)
+        band = {}
+        for varname, (lat_axis, lon_axis, shape, var_dtype, fill_value) in self.layouts.items():
+            if band_id in self.flushed_bands:
+                data = self.nc_dset.variables[varname][self._band_slice(lat_axis, len(shape), lat_strt, lat_end)]
+                band[varname] = ma.filled(ma.asarray(data), fill_value).astype(var_dtype)
+            else:
+                band_shape = list(shape)
+                band_shape[lat_axis] = lat_end - lat_strt
+                band[varname] = full(band_shape, fill_value, dtype=var_dtype)
+
+        self.bands[band_id] = band
+
+        return band
+
+    def _band_limits(self, band_id):
+        """
+        first and last plus one latitude indices of band
+        """
+        lat_strt = band_id * self.band_nlats
+        return lat_strt, min(lat_strt + self.band_nlats, self.nlats)
+
+    def _band_slice(self, lat_axis, ndims, lat_strt, lat_end):
+        """
+        indices selecting the band from a variable
+        """
+        indices = [slice(None)] * ndims
+        indices[lat_axis] = slice(lat_strt, lat_end)
+
+        return tuple(indices)
+
+    def _write_band(self, band_id, band):
+        """
+        one contiguous write per variable
+        """
+        strt_time = time()
+        lat_strt, lat_end = self._band_limits(band_id)
+        for varname, data in band.items():
+            lat_axis = self.layouts[varname][0]
+            self.nc_dset.variables[varname][self._band_slice(lat_axis, data.ndim, lat_strt, lat_end)] = data
+
+        self.flushed_bands.add(band_id)
+        self.nflushes += 1
+        self.flush_time += time() - strt_time
+
+    def flush(self):
+        """
+        write all outstanding bands
+        """
+        while len(self.bands) > 0:
+            band_id, band = self.bands.popitem(last=False)
+            self._write_band(band_id, band)
+
+    def close(self):
+        """
+        flush and report - the dataset itself is closed by the caller
+        """
+        self.flush()
+        if self.band_nlats >= self.nlats:
+            mode = 'full cube'
+        else:
+            mode = 'bands of {} latitudes'.format(self.band_nlats)
+        print('Wrote {} variables in {} as {} flushes taking {:.2f} seconds'
+                                                    .format(len(self.layouts), mode, self.nflushes, self.flush_time))
@@ -17,11 +17,12 @@ from os import remove
 import time
 from netCDF4 import Dataset
 from numpy import arange, float64
+from nc_profiles import fetch_nc_profile, create_profiled_variable
 
 MISSING_VALUE = -999.0
 IMISS_VALUE = int(MISSING_VALUE)
 
-def create_raw_nc_dset(form, metrics, soil_metrics):
+def create_raw_nc_dset(form, metrics, soil_metrics, out_dir = None):
     """
     call this function before running spec against simulation files
     output_variables = list(['soc', 'co2', 'ch4', 'no3', 'n2o'])
@@ -30,6 +31,7 @@ def create_raw_nc_dset(form, metrics, soil_metrics):
     func_name = __prog__ + ' create_raw_nc_dset'
 
     study = form.study_defn['study']
+    profile_name = fetch_nc_profile(form)
 
     if form.study_defn['resolution'] is None:
         print('Error - cannot proceed - resolution is set to None')
@@ -68,13 +70,16 @@ def create_raw_nc_dset(form, metrics, soil_metrics):
     sys.stdout.write(mess)
     sys.stdout.flush()
     '''
-    years = arange(form.study_defn['futStrtYr'], form.study_defn['futEndYr'] + 1)
+    fut_strt_year, fut_end_year = form.trans_defn.get('period', (form.study_defn['futStrtYr'],
+                                                                                    form.study_defn['futEndYr']))
+    years = arange(fut_strt_year, fut_end_year + 1)
     nyears = len(years)
     atimes = arange(form.trans_defn['nfields'] + 2)  # expect 1092 for 91 years plus 2 extras for 40 and 90 year differences
 
     # construct the output file name and delete if it already exists
     # ==============================================================
-    out_dir = form.w_lbl_rslts.text()
+    if out_dir is None:
+        out_dir = form.w_lbl_rslts.text()
     fout_name = normpath(join(out_dir, study + '.nc'))
     if isfile(fout_name):
         if delete_flag:
@@ -125,32 +130,35 @@ def create_raw_nc_dset(form, metrics, soil_metrics):
 
     # TODO: check these
     times = nc_dset.createVariable('time', 'i2', ('time',))
-    times.units = 'months from January {} - {} years'.format(form.study_defn['futStrtYr'], nyears)
+    times.units = 'months from January {} - {} years'.format(fut_strt_year, nyears)
     times[:] = atimes
 
     # create the area variable
     # ========================
-    var_varia = nc_dset.createVariable('area', 'f4', ('lat', 'lon'), fill_value=MISSING_VALUE)
+    var_varia = create_profiled_variable(nc_dset, profile_name, 'area', 'f4', ('lat', 'lon'), fill_value=MISSING_VALUE)
     var_varia.units = 'km**2'
     var_varia.missing_value = MISSING_VALUE
 
     # create the mu_global variable
     # =============================
-    var_varia = nc_dset.createVariable('mu_global', 'i4', ('lat', 'lon'), fill_value=IMISS_VALUE)
+    var_varia = create_profiled_variable(nc_dset, profile_name, 'mu_global', 'i4', ('lat', 'lon'),
+                                                                                                 fill_value=IMISS_VALUE)
     var_varia.units = 'HWSD global mapping unit'
     var_varia.missing_value = IMISS_VALUE
 
     # create the soil variables
     # =========================
     for metric in soil_metrics:
-        var_varia = nc_dset.createVariable(metric, 'f4', ('lat', 'lon'), fill_value=MISSING_VALUE)
+        var_varia = create_profiled_variable(nc_dset, profile_name, metric, 'f4', ('lat', 'lon'),
+                                                                                               fill_value=MISSING_VALUE)
         var_varia.units = soil_metrics[metric]
         var_varia.missing_value = MISSING_VALUE
 
     # create the monthly time dependent metrics and assign default data
     # =================================================================
     for var_name in metrics:
-        var_varia = nc_dset.createVariable(var_name, 'f4', ('lat', 'lon', 'time'), fill_value=MISSING_VALUE)
+        var_varia = create_profiled_variable(nc_dset, profile_name, var_name, 'f4', ('lat', 'lon', 'time'),
+                                                                                               fill_value=MISSING_VALUE)
         var_varia.units = 'kg/hectare'
         var_varia.missing_value = MISSING_VALUE
 
@@ -158,13 +166,15 @@ def create_raw_nc_dset(form, metrics, soil_metrics):
     # ================================================================
     for var_name in metrics:
         var_name_yrs = var_name + '_yrs'
-        var_varia = nc_dset.createVariable(var_name_yrs, 'f4', ('lat', 'lon', 'time_yrs'), fill_value=MISSING_VALUE)
+        var_varia = create_profiled_variable(nc_dset, profile_name, var_name_yrs, 'f4', ('lat', 'lon', 'time_yrs'),
+                                                                                               fill_value=MISSING_VALUE)
         var_varia.units = 'kg/hectare'
         var_varia.missing_value = MISSING_VALUE
 
     # create the change in soc from start of simulation to end year
     # =============================================================
-    var_varia = nc_dset.createVariable('soc_diff', 'f4', ('lat', 'lon'), fill_value=MISSING_VALUE)
+    var_varia = create_profiled_variable(nc_dset, profile_name, 'soc_diff', 'f4', ('lat', 'lon'),
+                                                                                               fill_value=MISSING_VALUE)
     var_varia.description = 'change in soc from start of simulation to end year'
     var_varia.long_name = 'soc difference last - first'
     var_varia.units = 'kg/hectare'
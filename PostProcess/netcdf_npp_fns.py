@@ -20,6 +20,7 @@ from netCDF4 import Dataset
 from numpy import arange, float64
 
 from nc_low_level_fns import generate_mnthly_atimes
+from nc_profiles import fetch_nc_profile, create_profiled_variable
 
 missing_value = -999.0
 maxFieldsMonthly = 3600     # if there are more than this number of fields then assume CSV files are from a daily timestep
@@ -39,6 +40,7 @@ def create_npp_ncs(form, metrics, crop_names, land_use, out_dir, study, npp_unit
     resolution     = form.study_defn['resolution']
     fut_end_year   = form.study_defn['futEndYr']
     fut_start_year = form.study_defn['futStrtYr']
+    profile_name = fetch_nc_profile(form)
     bbox = form.study_defn['bbox']
     clim_dset = form.study_defn['climScnr']
 
@@ -167,7 +169,8 @@ def create_npp_ncs(form, metrics, crop_names, land_use, out_dir, study, npp_unit
 
         # create the area variable
         # ========================
-        areas = nc_dset.createVariable('area','f4',('latitude','longitude'), fill_value = missing_value)
+        areas = create_profiled_variable(nc_dset, profile_name, 'area','f4',('latitude','longitude'),
+                                                                                             fill_value = missing_value)
         areas.units = 'km**2'
         areas.missing_value = missing_value
 
@@ -188,7 +191,8 @@ def create_npp_ncs(form, metrics, crop_names, land_use, out_dir, study, npp_unit
             # var_name = 'f' + metric + '_soil_' + crop
             var_name = crop
             var_names[crop][metric] = var_name
-            var_varia = nc_dset.createVariable(var_name,'f4',('time', 'latitude','longitude'), fill_value = missing_value)
+            var_varia = create_profiled_variable(nc_dset, profile_name, var_name,'f4',('time', 'latitude','longitude'),
+                                                                                             fill_value = missing_value)
 
             long_name = 'Net primary production'
             var_varia.long_name = long_name
@@ -0,0 +1,18 @@
+#-------------------------------------------------------------------------------
+# Name:        pool_settings.py
+# Purpose:     default settings of the pool of worker processes used by aggregation
+# Author:      agent
+# Created:     18/10/2026
+# Description: shared by aggregation, the configuration file of the GUI and the batch Form; has no imports so
+#              that the batch Form may use it without importing numpy
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'pool_settings.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+NWORKERS = 1
+CHUNK_SIZE = 16     # number of grid cells passed to a worker process in a single task
+MAX_FAILURES = 1000
+
+POOL_SETTINGS = {'nworkers': NWORKERS, 'chunk_size': CHUNK_SIZE, 'max_failures': MAX_FAILURES}
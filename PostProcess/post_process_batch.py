@@ -0,0 +1,462 @@
+#-------------------------------------------------------------------------------
+# Name:        post_process_batch.py
+# Purpose:     run aggregation, cutting and NetCDF conversions without the GUI
+# Author:      agent
+# Created:     18/10/2026
+# Description: the batch Form has the widgets read by the processing functions, as plain objects set from a
+#              settings dictionary or from the user_settings and extra_metrics groups of the configuration file
+#              written by PostProcessGUI; processing modules, and with them numpy, netCDF4 and PyQt5, are only
+#              imported when a stage which requires them is run
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'post_process_batch.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from argparse import ArgumentParser
+from json import load as json_load
+from logging import getLogger, FileHandler, StreamHandler, Formatter, INFO, WARNING
+from os.path import isdir, isfile, join, normpath
+from sys import exit
+from time import time
+
+from nc_profiles import NC_PROFILES, DEFAULT_PROFILE
+from pool_settings import POOL_SETTINGS
+from progress_events import report_stage
+
+PROGRAM_ID = 'post_process_batch'
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+EXTRA_METRICS = ['no3', 'npp']
+
+# keys are those of the user_settings group of the configuration file
+# ===================================================================
+DEFAULT_SETTINGS = {'aggreg_daily': True, 'make_rslts_dir': True, 'nyears_trim': 0, 'resume': False,
+                    'text_output': True, 'store_output': False, 'totals_output': False, 'region_lookup': '',
+                    'stats_output': False, 'nc_profile': DEFAULT_PROFILE, 'overwrite': True, 'results_dir': '',
+                    'sims_dir': '', 'log_dir': None}
+DEFAULT_SETTINGS.update(POOL_SETTINGS)
+DEFAULT_EXTRA_METRICS = {'no3': False, 'npp': False}
+
+class _Field(object):
+    """
+    stands in for a QLabel or QLineEdit
+    """
+    def __init__(self, text=''):
+        self._text = str(text)
+
+    def text(self):
+        return self._text
+
+    def setText(self, text):
+        self._text = str(text)
+
+    def setEnabled(self, flag):
+        pass
+
+class _CheckBox(object):
+    """
+    stands in for a QCheckBox
+    """
+    def __init__(self, flag=False):
+        self._flag = bool(flag)
+
+    def isChecked(self):
+        return self._flag
+
+    def setCheckState(self, state):
+        self._flag = bool(state)
+
+    def setEnabled(self, flag):
+        pass
+
+class _ComboBox(object):
+    """
+    stands in for a QComboBox
+    """
+    def __init__(self, text=''):
+        self._text = str(text)
+
+    def currentText(self):
+        return self._text
+
+    def setCurrentText(self, text):
+        self._text = str(text)
+
+def read_batch_config(config_file):
+    """
+    return settings from the user_settings and extra_metrics groups of a PostProcessGUI configuration file
+    """
+    if not isfile(config_file):
+        print(ERROR_STR + 'configuration file ' + config_file + ' does not exist')
+        return None
+
+    try:
+        with open(config_file, 'r') as fconfig:
+            config = json_load(fconfig)
+    except (OSError, ValueError) as err:
+        print(ERROR_STR + 'reading configuration file {} - {}'.format(config_file, err))
+        return None
+
+    settings = dict(config.get('user_settings', {}))
+    settings['extra_metrics'] = dict(config.get('extra_metrics', {}))
+    print('Read config file ' + config_file)
+
+    return settings
+
+class Form(object):
+    """
+    post processing in batch mode
+    """
+    def __init__(self, settings=None, config_file=None):
+        """
+        settings override those of the configuration file which in turn override DEFAULT_SETTINGS
+        extra metrics are given by an extra_metrics dictionary, as in the configuration file
+        """
+        all_settings = dict(DEFAULT_SETTINGS)
+        extra_metrics = dict(DEFAULT_EXTRA_METRICS)
+        for overrides in (read_batch_config(config_file) if config_file is not None else None, settings):
+            if overrides is None:
+                continue
+            for key, val in overrides.items():
+                if key == 'extra_metrics':
+                    extra_metrics.update(val)
+                elif val is not None:
+                    all_settings[key] = val
+
+        self.settings = {'config_file': config_file, 'applic_str': PROGRAM_ID}
+        self.lgr = _set_up_batch_logging(all_settings['log_dir'])
+
+        self.w_lbl_sims = _Field(normpath(all_settings['sims_dir']) if all_settings['sims_dir'] else '')
+        self.w_lbl_rslts = _Field(normpath(all_settings['results_dir']) if all_settings['results_dir'] else '')
+        self.w_lbl06 = _Field()
+        self.w_cut_csv = _Field()
+        self.w_nyears = _Field(all_settings['nyears_trim'])
+        self.w_nworkers = _Field(all_settings['nworkers'])
+        self.w_chunk_size = _Field(all_settings['chunk_size'])
+        self.w_max_fails = _Field(all_settings['max_failures'])
+        self.w_nc_profile = _ComboBox(all_settings['nc_profile'])
+        self.w_aggreg = _CheckBox(all_settings['aggreg_daily'])
+        self.w_create_outdir = _CheckBox(all_settings['make_rslts_dir'])
+        self.w_del_nc = _CheckBox(all_settings['overwrite'])
+        self.w_resume = _CheckBox(all_settings['resume'])
+        self.w_text_out = _CheckBox(all_settings['text_output'])
+        self.w_store_out = _CheckBox(all_settings['store_output'])
+        self.w_totals_out = _CheckBox(all_settings['totals_output'])
+        self.w_stats_out = _CheckBox(all_settings['stats_output'])
+        self.region_lookup_fn = all_settings['region_lookup']
+        self.w_metrics = {metric: _CheckBox(extra_metrics.get(metric, False)) for metric in EXTRA_METRICS}
+
+        self.refresh_results()
+
+    def refresh_results(self):
+        """
+        gather results files of the results directory, as is done by the GUI when the directory changes
+        """
+        from input_output_funcs import ecosse_results_files
+
+        descriptor, self.trans_defn = ecosse_results_files(self.w_lbl_rslts.text(), 'Contents: ')
+        self.w_lbl06.setText(descriptor)
+
+def settings_from_form(form):
+    """
+    settings of the GUI, or of a batch Form, from which a batch Form can be made e.g. in another process
+    """
+    settings = {'sims_dir': form.w_lbl_sims.text(), 'results_dir': form.w_lbl_rslts.text(),
+                'aggreg_daily': form.w_aggreg.isChecked(), 'make_rslts_dir': form.w_create_outdir.isChecked(),
+                'nyears_trim': form.w_nyears.text(), 'nworkers': form.w_nworkers.text(),
+                'chunk_size': form.w_chunk_size.text(), 'max_failures': form.w_max_fails.text(),
+                'resume': form.w_resume.isChecked(), 'text_output': form.w_text_out.isChecked(),
+                'store_output': form.w_store_out.isChecked(), 'totals_output': form.w_totals_out.isChecked(),
+                'region_lookup': form.region_lookup_fn, 'stats_output': form.w_stats_out.isChecked(),
+                'nc_profile': form.w_nc_profile.currentText(), 'overwrite': form.w_del_nc.isChecked(),
+                'extra_metrics': {metric: form.w_metrics[metric].isChecked() for metric in EXTRA_METRICS}}
+
+    return settings
+
+def _set_up_batch_logging(log_dir):
+    """
+    warnings are written to the console and, if a log directory is given, all messages to a log file
+    """
+    lgr = getLogger(PROGRAM_ID)
+    if len(lgr.handlers) > 0:
+        return lgr
+
+    lgr.setLevel(INFO)
+    console = StreamHandler()
+    console.setLevel(WARNING)
+    lgr.addHandler(console)
+    if log_dir is not None and isdir(log_dir):
+        log_fn = join(log_dir, PROGRAM_ID + '.log')
+        log_file = FileHandler(log_fn)
+        log_file.setFormatter(Formatter('%(asctime)s %(levelname)s %(message)s'))
+        lgr.addHandler(log_file)
+
+    return lgr
+
+def _study_definition(form):
+    """
+    read study definition of the results directory - return False if the study cannot be converted
+    """
+    from input_output_funcs import read_study_definition
+
+    if not read_study_definition(form):
+        return False
+
+    if form.study_defn['version'] == 'NetZeroPlus':
+        print(ERROR_STR + 'OSGB version not yet ready')
+        return False
+
+    return True
+
+def _conversion_years(form, strt_year, end_year, nyears_kept):
+    """
+    period converted is the last nyears_kept years of the results unless a start or end year is given
+    return None if the period lies outside the years of the results
+    """
+    from input_output_funcs import results_period
+
+    first_year, last_year, nvals_per_year = results_period(form)
+    if nyears_kept is not None and strt_year is None and end_year is None:
+        strt_year, end_year = last_year - nyears_kept + 1, last_year
+
+    if (strt_year is not None and strt_year < first_year) or (end_year is not None and end_year > last_year):
+        print(ERROR_STR + 'period {} to {} lies outside the years {} to {} of the results'
+                                                                .format(strt_year, end_year, first_year, last_year))
+        return None
+
+    return strt_year, end_year
+
+# ============= stages ==========================
+#
+def aggregate(form, **kwargs):
+    """
+    aggregate simulation results to CSV files or a results store, as aggregToCsvClicked
+    """
+    from input_output_funcs import read_study_definition
+
+    if not read_study_definition(form):
+        return False
+
+    if form.study_defn['version'] == 'NetZeroPlus':
+        from aggr_osgb_rslts_to_csv import aggreg_osgb_metrics_to_csv
+
+        retcode = aggreg_osgb_metrics_to_csv(form)
+    else:
+        from aggregate_rslts_to_csv import aggreg_metrics_to_csv
+
+        retcode = aggreg_metrics_to_csv(form)
+
+    if not retcode:
+        return False
+
+    form.refresh_results()
+
+    return True
+
+def soil_data(form, **kwargs):
+    """
+    aggregate soil data to CSV
+    """
+    if not _study_definition(form):
+        return False
+
+    from aggregate_rslts_to_csv import aggregate_soil_data_to_csv
+
+    aggregate_soil_data_to_csv(form)
+
+    return True
+
+def cut(form, nyears_kept=None, **kwargs):
+    """
+    cut CSV results files to their last nyears_kept years
+    """
+    from input_output_funcs import cut_csv_files, CUT_200_NYEARS
+
+    if nyears_kept is None:
+        nyears_kept = CUT_200_NYEARS
+
+    return cut_csv_files(form, nyears_kept=nyears_kept) is not None
+
+def coards(form, strt_year=None, end_year=None, nyears_kept=None, metrics=None, **kwargs):
+    """
+    one COARDS compliant NC file for each metric, or for each of the metrics given
+    """
+    if not _study_definition(form):
+        return False
+
+    from csv_to_coards_nc import csv_to_coards_netcdf
+
+    period = _conversion_years(form, strt_year, end_year, nyears_kept)
+    if period is None:
+        return False
+
+    return csv_to_coards_netcdf(form, strt_year=period[0], end_year=period[1], metrics=metrics)
+
+def co2e(form, strt_year=None, end_year=None, nyears_kept=None, **kwargs):
+    """
+    net CO2 equivalent NC file
+    """
+    if not _study_definition(form):
+        return False
+
+    from csv_to_co2e_nc import csv_to_co2e_netcdf
+
+    period = _conversion_years(form, strt_year, end_year, nyears_kept)
+    if period is None:
+        return False
+
+    return csv_to_co2e_netcdf(form, strt_year=period[0], end_year=period[1])
+
+def raw(form, strt_year=None, end_year=None, nyears_kept=None, **kwargs):
+    """
+    raw NC file of all metrics
+    """
+    if not _study_definition(form):
+        return False
+
+    from csv_to_raw_nc import csv_to_raw_netcdf
+
+    period = _conversion_years(form, strt_year, end_year, nyears_kept)
+    if period is None:
+        return False
+
+    return csv_to_raw_netcdf(form, strt_year=period[0], end_year=period[1])
+
+def all_ncs(form, strt_year=None, end_year=None, nyears_kept=None, **kwargs):
+    """
+    COARDS, co2e, raw and, if requested, statistics NC files in a single pass of the results
+    """
+    if not _study_definition(form):
+        return False
+
+    from csv_to_all_ncs import csv_to_all_netcdfs
+
+    period = _conversion_years(form, strt_year, end_year, nyears_kept)
+    if period is None:
+        return False
+
+    return csv_to_all_netcdfs(form, strt_year=period[0], end_year=period[1])
+
+def stats(form, strt_year=None, end_year=None, nyears_kept=None, **kwargs):
+    """
+    temporal statistics NC file
+    """
+    if not _study_definition(form):
+        return False
+
+    from nc_statistics import csv_to_stats_netcdf
+
+    period = _conversion_years(form, strt_year, end_year, nyears_kept)
+    if period is None:
+        return False
+
+    return csv_to_stats_netcdf(form, period[0], period[1]) is not False
+
+def npp(form, out_dir=None, **kwargs):
+    """
+    Miami-Dyce NPP NC file from the weather of the simulations directory, written to the results directory by default
+    """
+    if not _study_definition(form):
+        return False
+
+    from generate_npp_nc import sims_results_to_nc
+
+    if out_dir is None:
+        out_dir = form.w_lbl_rslts.text()
+
+    return sims_results_to_nc(form, out_dir=out_dir)
+
+def coarsen(form, resolutions=None, pyramid=False, **kwargs):
+    """
+    coarser resolution copies of the COARDS and net CO2e NC files, written by the coards and co2e stages
+    resolutions are in degrees, 0.5 and 1.0 by default; pyramid adds successive doublings of the resolution
+    """
+    if not _study_definition(form):
+        return False
+
+    from nc_coarsen import coarsen_coards_outputs
+
+    return coarsen_coards_outputs(form, resolutions, pyramid) > 0
+
+def trim(form, **kwargs):
+    """
+    remake SUMMARY.OUT files with the later years of each simulation
+    """
+    from input_output_funcs import read_study_definition
+
+    if not read_study_definition(form):
+        return False
+
+    from spec_utilities import trim_summaries
+
+    trim_summaries(form)
+
+    return True
+
+STAGES = {'aggregate': aggregate, 'soil': soil_data, 'cut': cut, 'coards': coards, 'co2e': co2e, 'raw': raw,
+          'all': all_ncs, 'stats': stats, 'npp': npp, 'coarsen': coarsen, 'trim': trim}
+
+def run_stages(form, stage_names, **kwargs):
+    """
+    run stages in the order given, stopping at the first which fails - return True if all complete
+    keyword arguments e.g. strt_year, end_year and nyears_kept are passed to every stage
+    """
+    for stage_name in stage_names:
+        if stage_name not in STAGES:
+            print(ERROR_STR + 'unknown stage {} - must be one of {}'.format(stage_name, ', '.join(STAGES)))
+            return False
+
+    for stage_name in stage_names:
+        strt_time = time()
+        print('\nStage {} started'.format(stage_name))
+        report_stage(stage_name)
+        if not STAGES[stage_name](form, **kwargs):
+            print(ERROR_STR + 'stage {} failed after {:.1f} seconds'.format(stage_name, time() - strt_time))
+            return False
+
+        print('Stage {} completed in {:.1f} seconds'.format(stage_name, time() - strt_time))
+
+    return True
+
+def main():
+    """
+    Entry point
+    settings given on the command line override those of the configuration file
+    """
+    argparser = ArgumentParser(prog = __prog__, description = 'post process ECOSSE results without the GUI')
+
+    argparser.add_argument('--version', action = 'version', version = '{} {}'.format(__prog__, __version__),
+                                                                        help = 'Display the version number.')
+    argparser.add_argument('stages', nargs = '+', metavar = 'stage',
+                                        help = 'stages to run in order, from: ' + ', '.join(STAGES))
+    argparser.add_argument('--config', default = None, help = 'configuration file written by PostProcessGUI')
+    argparser.add_argument('--sims_dir', default = None, help = 'simulations directory')
+    argparser.add_argument('--results_dir', default = None, help = 'results directory')
+    argparser.add_argument('--nworkers', type = int, default = None, help = 'number of worker processes')
+    argparser.add_argument('--profile', default = None, choices = list(NC_PROFILES),
+                                                                help = 'chunking and compression of output files')
+    argparser.add_argument('--log_dir', default = None, help = 'directory for the log file')
+    argparser.add_argument('--period', type = int, nargs = 2, default = (None, None), metavar = ('STRT', 'END'),
+                                                                help = 'years of results converted to NC files')
+    argparser.add_argument('--nyears_kept', type = int, default = None,
+                        help = 'last years of the results retained by the cut stage and converted by NC stages')
+    argparser.add_argument('--resolutions', type = float, nargs = '+', default = None,
+                                            help = 'resolutions in degrees of NC files written by the coarsen stage')
+    argparser.add_argument('--pyramid', action = 'store_true',
+                                help = 'coarsen stage also writes successive doublings of the resolution')
+    args = argparser.parse_args()
+
+    settings = {'sims_dir': args.sims_dir, 'results_dir': args.results_dir, 'nworkers': args.nworkers,
+                'nc_profile': args.profile, 'log_dir': args.log_dir}
+    form = Form(settings, args.config)
+
+    strt_year, end_year = args.period
+    retcode = run_stages(form, args.stages, strt_year=strt_year, end_year=end_year, nyears_kept=args.nyears_kept,
+                                                            resolutions=args.resolutions, pyramid=args.pyramid)
+
+    exit(0 if retcode else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#-------------------------------------------------------------------------------
+# Name:        progress_events.py
+# Purpose:     progress reporting and cancellation of long running operations
+# Author:      agent
+# Created:     18/10/2026
+# Description: processing functions report progress and check for cancellation through this module which does
+#              nothing unless a sink has been installed, as is done by background_operation in its worker process
+#              reports and checks are throttled so that they may be made for every line or grid cell
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'progress_events.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from time import time
+
+PROGRESS_SECS = 0.5     # minimum interval between progress reports and between checks for cancellation
+
+_progress_sink = None
+_stage_sink = None
+_cancel_event = None
+_last_report = 0.0
+_last_check = 0.0
+_cancelled = False
+
+class OperationCancelled(Exception):
+    """
+    raised by check_cancelled when the user has cancelled the operation
+    """
+    pass
+
+def install_progress_sink(progress_sink, cancel_event=None, stage_sink=None):
+    """
+    progress_sink is called with number done, total and units; cancel_event is set when the user cancels
+    stage_sink, if given, is called with the name of each stage as it starts
+    """
+    global _progress_sink, _stage_sink, _cancel_event, _last_report, _last_check, _cancelled
+
+    _progress_sink = progress_sink
+    _stage_sink = stage_sink
+    _cancel_event = cancel_event
+    _last_report = 0.0
+    _last_check = 0.0
+    _cancelled = False
+
+def report_progress(ndone, ntotal, units='lines'):
+    """
+    pass progress to the sink, if any, at most every PROGRESS_SECS
+    """
+    global _last_report
+
+    if _progress_sink is None:
+        return
+
+    this_time = time()
+    if this_time - _last_report < PROGRESS_SECS:
+        return
+
+    _last_report = this_time
+    _progress_sink(ndone, ntotal, units)
+
+def report_stage(stage_name):
+    """
+    pass the name of a stage which is starting to the sink, if any - not throttled since the sink is called
+    before the stage writes any output
+    """
+    if _stage_sink is not None:
+        _stage_sink(stage_name)
+
+def cancel_requested():
+    """
+    return True once the user has cancelled - used where a loop can stop and tidy up in its own way
+    """
+    global _last_check, _cancelled
+
+    if _cancel_event is None or _cancelled:
+        return _cancelled
+
+    this_time = time()
+    if this_time - _last_check >= PROGRESS_SECS:
+        _last_check = this_time
+        _cancelled = _cancel_event.is_set()
+
+    return _cancelled
+
+def check_cancelled():
+    """
+    raise OperationCancelled once the user has cancelled - outputs of the operation are then incomplete
+    """
+    if cancel_requested():
+        raise OperationCancelled('operation cancelled by user')
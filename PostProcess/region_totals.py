@@ -0,0 +1,214 @@
+#-------------------------------------------------------------------------------
+# Name:        region_totals.py
+# Purpose:     accumulate area weighted totals of each metric by province and by region during aggregation
+# Author:      agent
+# Created:     18/10/2026
+# Description: values of each grid cell, in kg per hectare, are multiplied by the area of the cell and added to the
+#              totals of its province and, when a lookup raster is supplied, of its region; on completion monthly
+#              and annual totals, in tonnes, are written as two small comma separated summary tables
+#              a lookup raster is a 2D integer variable of an NC file - cells with a zero or missing value belong
+#              to no region; region names are taken from the flag_values and flag_meanings attributes if present
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'region_totals.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os.path import join
+from csv import writer
+
+from numpy import asarray, zeros, ma, isfinite, rint, float64, int64
+
+TONNES_PER_KG_HA_KM2 = 0.1      # 1 km2 is 100 hectares and 1 tonne is 1000 kg
+STOCK_METRICS = ['soc']         # annual value of a stock is the mean of the months, of a flux the sum
+TOTALS_HEADERS = ['level', 'name', 'metric', 'num_cells', 'area_km2']
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+class RegionLookup(object):
+    """
+    raster of region codes over latitude and longitude
+    """
+    def __init__(self, codes, lats, lons, names=None):
+        """
+        codes:  integer array of latitudes by longitudes, zero for cells outside every region
+        names:  optional dictionary of region names keyed by code
+        """
+        self.codes = codes
+        self.names = {} if names is None else names
+        self.lat0 = float(lats[0])
+        self.lon0 = float(lons[0])
+        self.dlat = float(lats[1] - lats[0]) if len(lats) > 1 else 1.0
+        self.dlon = float(lons[1] - lons[0]) if len(lons) > 1 else 1.0
+
+    def region(self, lat, lon):
+        """
+        return name of region containing the cell or None
+        """
+        lat_indx = int(round((lat - self.lat0) / self.dlat))
+        lon_indx = int(round((lon - self.lon0) / self.dlon))
+        if lat_indx < 0 or lat_indx >= self.codes.shape[0] or lon_indx < 0 or lon_indx >= self.codes.shape[1]:
+            return None
+
+        code = int(self.codes[lat_indx, lon_indx])
+        if code == 0:
+            return None
+
+        return self.names.get(code, str(code))
+
+def read_region_lookup(lookup_fname, varname=None):
+    """
+    lookup is the first 2D variable of the NC file, unless a variable is named, over latitude and longitude
+    netCDF4 is only required when a lookup is used
+    """
+    from netCDF4 import Dataset
+
+    try:
+        nc_dset = Dataset(lookup_fname, 'r')
+    except (OSError, TypeError) as err:
+        print(ERROR_STR + 'Unable to open region lookup file {}. {}'.format(lookup_fname, err))
+        return None
+
+    lat_name = 'latitude' if 'latitude' in nc_dset.variables else 'lat'
+    lon_name = 'longitude' if 'longitude' in nc_dset.variables else 'lon'
+    if varname is None:
+        for name, varia in nc_dset.variables.items():
+            if varia.ndim == 2:
+                varname = name
+                break
+
+    if varname is None or varname not in nc_dset.variables or lat_name not in nc_dset.variables:
+        print(ERROR_STR + 'region lookup file {} requires latitude, longitude and a 2D variable'.format(lookup_fname))
+        nc_dset.close()
+        return None
+
+    varia = nc_dset.variables[varname]
+    lats = asarray(nc_dset.variables[lat_name][:], dtype=float)
+    lons = asarray(nc_dset.variables[lon_name][:], dtype=float)
+    vals = ma.filled(ma.asarray(varia[:], dtype=float), 0.0)
+
+    names = {}
+    if 'flag_values' in varia.ncattrs() and 'flag_meanings' in varia.ncattrs():
+        for code, name in zip(asarray(varia.flag_values).ravel(), varia.flag_meanings.split()):
+            names[int(code)] = name
+    nc_dset.close()
+
+    vals[~isfinite(vals)] = 0.0
+    codes = rint(vals).astype(int64)
+    nregions = len(set(codes[codes != 0].ravel().tolist()))
+    print('Region lookup {} of {} has {} regions'.format(varname, lookup_fname, nregions))
+
+    return RegionLookup(codes, lats, lons, names)
+
+class RegionTotals(object):
+    """
+    running totals, for each metric, of value times area for every month keyed by level and name
+    """
+    def __init__(self, varnames, fut_start_year, fut_end_year, region_lookup=None):
+        """
+        varnames are the metrics written by the aggregation
+        """
+        self.varnames = varnames
+        self.fut_start_year = fut_start_year
+        self.nyears = fut_end_year - fut_start_year + 1
+        self.nmnths = 12 * self.nyears
+        self.region_lookup = region_lookup
+        self.totals = {}
+        self.nshort = 0
+
+    def _group(self, level, name):
+        """
+        create totals for a province or region when first encountered
+        """
+        key = (level, name)
+        if key not in self.totals:
+            self.totals[key] = {'ncells': 0, 'area': 0.0}
+            for varname in self.varnames:
+                self.totals[key][varname] = zeros(self.nmnths, dtype=float64)
+
+        return self.totals[key]
+
+    def add_cell(self, id_mods, values):
+        """
+        id_mods and values are as returned by make_cell_values - line prefixes, of which the first field is the
+        province and the last the area, share the same values
+        """
+        areas = {}
+        for id_mod in id_mods:
+            area = float(id_mod[7])
+            keys = [('province', str(id_mod[0]))]
+            if self.region_lookup is not None:
+                region = self.region_lookup.region(float(id_mod[1]), float(id_mod[2]))
+                if region is not None:
+                    keys.append(('region', region))
+
+            for key in keys:
+                areas[key] = areas.get(key, 0.0) + area
+
+        for key, area in areas.items():
+            group = self._group(*key)
+            group['ncells'] += 1
+            group['area'] += area
+            for varname in self.varnames:
+                if varname not in values:
+                    continue
+
+                vals = asarray(values[varname], dtype=float64)
+                nvals = min(len(vals), self.nmnths)     # soils may differ in length
+                if nvals < self.nmnths:
+                    self.nshort += 1
+                group[varname][:nvals] += vals[:nvals] * area
+
+    def _annual_totals(self, varname, mnthly):
+        """
+        annual total of a flux is the sum of the months, of a stock the mean
+        """
+        annual = mnthly.reshape(self.nyears, 12).sum(axis=1)
+        if varname in STOCK_METRICS:
+            annual /= 12.0
+
+        return annual
+
+    def write_summary(self, output_dir, study):
+        """
+        write monthly and annual totals, in tonnes, with one row for each province or region and metric
+        return names of files written
+        """
+        mnthly_hdrs = []
+        annual_hdrs = []
+        for year in range(self.fut_start_year, self.fut_start_year + self.nyears):
+            annual_hdrs.append(str(year))
+            for month in range(1, 13):
+                mnthly_hdrs.append('{0}-{1:0>2}'.format(year, month))
+
+        if self.nshort > 0:
+            print(WARNING_STR + '{} cells had fewer than {} monthly values'.format(self.nshort, self.nmnths))
+
+        fnames = []
+        for period, hdrs in [('monthly', mnthly_hdrs), ('annual', annual_hdrs)]:
+            fname = join(output_dir, study + '_totals_{}.csv'.format(period))
+            try:
+                with open(fname, 'w', newline='') as fobj:
+                    totals_writer = writer(fobj)
+                    totals_writer.writerow(TOTALS_HEADERS + hdrs)
+                    for key in sorted(self.totals):
+                        group = self.totals[key]
+                        for varname in self.varnames:
+                            totals = group[varname] * TONNES_PER_KG_HA_KM2
+                            if period == 'annual':
+                                totals = self._annual_totals(varname, totals)
+
+                            totals_writer.writerow(list(key) + [varname, group['ncells'], round(group['area'], 3)]
+                                                                    + ['{0:.6g}'.format(val) for val in totals])
+            except OSError as err:
+                print(ERROR_STR + 'Unable to write totals file {}. {}'.format(fname, err))
+                continue
+
+            fnames.append(fname)
+
+        nprovinces = len([key for key in self.totals if key[0] == 'province'])
+        print('Wrote totals for {} provinces and {} regions to {}'
+                    .format(nprovinces, len(self.totals) - nprovinces, ', '.join(fnames)))
+
+        return fnames
@@ -0,0 +1,213 @@
+#-------------------------------------------------------------------------------
+# Name:        results_blocks.py
+# Purpose:     read CSV result files in blocks of rows rather than one line at a time
+# Author:      agent
+# Created:     18/10/2026
+# Description: each block comprises the 8 column line prefix of every row and, for each metric, a matrix of values
+#              for rows having the expected number of fields; the delimiter is detected once for each file and
+#              values are parsed by NumPy rather than by building lists of Python floats
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'results_blocks.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from itertools import islice
+from warnings import catch_warnings, simplefilter
+
+from numpy import fromstring, loadtxt, empty, full, stack, array, float32
+
+DATA_REC_PREFIX_LEN = 8
+BLOCK_NROWS = 1024      # rows per block - for daily files a block of 1024 rows uses around 150 MB per metric
+
+class ResultsBlock(object):
+    """
+    block of consecutive rows read from a set of result files or from a results store
+    """
+    def __init__(self, line_prefixes, num_time_vals, good_rows, vals, nsoil_metrics=-1):
+        """
+        line_prefixes: province, latitude, longitude, mu_global, climate_scenario, num_dom_soils, land_use, area_km2
+        num_time_vals: number of time values found on each row; for a rejected row this is the first count which
+                                                                                                    did not match
+        good_rows:     for each row True if every metric had the expected number of fields
+        vals:          dictionary of matrices, one row for each good row, whose keys are typically the metrics
+        """
+        self.line_prefixes = line_prefixes
+        self.num_time_vals = num_time_vals
+        self.good_rows = good_rows
+        self.vals = vals
+        self.nsoil_metrics = nsoil_metrics
+        self.nrows = len(line_prefixes)
+        self.nbad = self.nrows - int(good_rows.sum())
+
+    def lines(self):
+        """
+        generator yielding, for each row, the same four elements as the former read_one_line function
+        rejected rows are yielded with the number of fields found and no values so callers can count them
+        """
+        igood = 0
+        for irow, line_prefix in enumerate(self.line_prefixes):
+            if self.good_rows[irow]:
+                vals = {key: self.vals[key][igood] for key in self.vals}
+                igood += 1
+                yield self.num_time_vals[irow], self.nsoil_metrics, line_prefix, vals
+            else:
+                yield self.num_time_vals[irow], -1, line_prefix, {}
+
+    def good_cells(self):
+        """
+        latitudes, longitudes and areas of the good rows i.e. those of the rows of each matrix
+        """
+        prefixes = [prefix for prefix, good_flag in zip(self.line_prefixes, self.good_rows) if good_flag]
+        lats = [float(prefix[1]) for prefix in prefixes]
+        lons = [float(prefix[2]) for prefix in prefixes]
+        areas = [float(prefix[7]) for prefix in prefixes]
+
+        return lats, lons, areas
+
+def detect_delimiter(rec):
+    """
+    result files are normally tab separated, otherwise comma separated if the record does not split on whitespace
+    return None for runs of spaces, as used by str.split
+    """
+    if '\t' in rec:
+        return '\t'
+    elif len(rec.split()) == 1:
+        return ','
+    else:
+        return None
+
+def _count_fields(rest, delim):
+    """
+    number of values in the part of a record following the line prefix
+    """
+    if rest == '':
+        return 0
+    elif delim is None:
+        return len(rest.split())
+    else:
+        return rest.count(delim) + 1
+
+def _window_rest(rest, delim, col_window, nvals):
+    """
+    discard values outside the column window before they are parsed
+    """
+    icol_strt, icol_end = col_window
+    if icol_strt > 0:
+        rest = rest.split(delim, icol_strt)[-1]
+    if icol_end < nvals:
+        rest = rest.rsplit(delim, nvals - icol_end)[0]
+
+    return rest
+
+def _parse_records(recs, delim, nexpect, dtype, col_window=None):
+    """
+    split off the line prefix from each record then parse, in a single call, the values of those records which
+    have the expected number of fields - return prefixes, field counts and a matrix with a row for each such record
+    nexpect of None means take the number of fields in the first record
+    col_window of (first, last + 1) column restricts the parsed values to those columns
+    """
+    prefixes = []
+    nfound = []
+    rests = []
+    for rec in recs:
+        fields = rec.split(delim, DATA_REC_PREFIX_LEN)
+        prefixes.append(fields[:DATA_REC_PREFIX_LEN])
+        rest = fields[DATA_REC_PREFIX_LEN].rstrip() if len(fields) > DATA_REC_PREFIX_LEN else ''
+        rests.append(rest)
+        nfound.append(_count_fields(rest, delim))
+
+    if nexpect is None:
+        nexpect = nfound[0]
+
+    nout = nexpect
+    if col_window is not None:
+        nout = col_window[1] - col_window[0]
+        for irow, nvals in enumerate(nfound):
+            if nvals == nexpect:
+                rests[irow] = _window_rest(rests[irow], delim, col_window, nvals)
+
+    good_rests = [rest for rest, nvals in zip(rests, nfound) if nvals == nexpect]
+    if len(good_rests) == 0 or nout == 0:
+        return prefixes, nfound, empty((len(good_rests), nout), dtype=dtype)
+
+    try:
+        vals = loadtxt(good_rests, dtype=dtype, delimiter=delim, ndmin=2, comments=None)
+    except ValueError:
+        # at least one record has a value which cannot be parsed - parse record by record and reject those
+        # ================================================================================================
+        sep = ' ' if delim is None else delim     # for NumPy a space matches any whitespace
+        vals = []
+        for irow, rest in enumerate(rests):
+            if nfound[irow] != nexpect:
+                continue
+            try:
+                with catch_warnings():
+                    simplefilter('ignore', DeprecationWarning)   # raised by NumPy for a partially parsed record
+                    row = fromstring(rest, dtype=dtype, sep=sep)
+            except ValueError:
+                row = empty(0, dtype=dtype)
+
+            if len(row) == nout:
+                vals.append(row)
+            else:
+                nfound[irow] = len(row)
+
+        vals = stack(vals) if len(vals) > 0 else empty((0, nout), dtype=dtype)
+
+    return prefixes, nfound, vals
+
+def read_text_blocks(trans_fobjs, nfields, block_nrows=BLOCK_NROWS, dtype=float32, col_window=None):
+    """
+    generator yielding a ResultsBlock for each block_nrows rows read from the open file objects
+    file objects are keyed by metric, or soil, and positioned after the header
+    reading stops when any file is exhausted
+    rows must have nfields values; when a column window is given only values in the window are kept and
+    good rows report the number of values in the window
+    """
+    nwindow = nfields if col_window is None else col_window[1] - col_window[0]
+    delims = {}
+    nsoil_metrics = None
+    while True:
+        recs = {key: list(islice(trans_fobjs[key], block_nrows)) for key in trans_fobjs}
+        nrows = min([len(recs[key]) for key in recs]) if len(recs) > 0 else 0
+        if nrows == 0:
+            break
+
+        line_prefixes = None
+        num_time_vals = [-1] * nrows
+        good_rows = full(nrows, True)
+        key_rows = {}
+        matrices = {}
+        for key in recs:
+            if key not in delims:
+                delims[key] = detect_delimiter(recs[key][0])
+
+            if key == 'soil':
+                nexpect = nsoil_metrics
+                line_prefixes, nfound, matrices[key] = _parse_records(recs[key][:nrows], delims[key], nexpect, dtype)
+            else:
+                nexpect = nfields
+                line_prefixes, nfound, matrices[key] = _parse_records(recs[key][:nrows], delims[key], nexpect, dtype,
+                                                                                                        col_window)
+            if key == 'soil' and nsoil_metrics is None:
+                nsoil_metrics = matrices[key].shape[1]
+                nexpect = nsoil_metrics
+
+            # check data integrity - for a rejected row record the first number of fields which did not match
+            # ================================================================================================
+            key_rows[key] = array(nfound) == nexpect
+            if key != 'soil':
+                for irow in range(nrows):
+                    if good_rows[irow]:
+                        num_time_vals[irow] = nwindow if key_rows[key][irow] else nfound[irow]
+            good_rows &= key_rows[key]
+
+        # keep matrix rows for rows which are good for every file
+        # =======================================================
+        vals = {key: matrices[key][good_rows[key_rows[key]]] for key in matrices}
+
+        yield ResultsBlock(line_prefixes, num_time_vals, good_rows, vals,
+                                                                -1 if nsoil_metrics is None else nsoil_metrics)
+        if nrows < block_nrows:
+            break
@@ -0,0 +1,284 @@
+#-------------------------------------------------------------------------------
+# Name:        results_clip.py
+# Purpose:     clip results to a bounding box or raster mask writing CSV and, optionally, NC files
+# Author:      agent
+# Created:     18/10/2026
+# Description: only the latitude and longitude of the 8 column line prefix of each row are parsed - rows outside
+#              the region are skipped without converting their values and rows inside are written unchanged;
+#              a results store is clipped using its table of cells; a mask is a 2D variable of an NC file
+#              whose non-zero, non-missing cells lie inside the region
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'results_clip.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import replace, remove, mkdir, cpu_count
+from os.path import isfile, isdir, join, split
+from multiprocessing import Pool
+from time import time
+
+from netCDF4 import Dataset
+from numpy import asarray, rint, full, flatnonzero, isfinite, ma, int64
+
+from results_blocks import detect_delimiter
+from results_index import fetch_results_index
+from results_store import ResultsStore, write_store_subset, STORE_SUFFIX
+from input_output_funcs import ecosse_results_files
+from csv_to_all_ncs import csv_to_all_netcdfs
+
+IO_BUFFER_SIZE = 16 * 1024 * 1024
+CLIP_DIR = 'clip_outdir'
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+class ClipRegion(object):
+    """
+    bounding box and, optionally, a mask of cells within the bounding box
+    """
+    def __init__(self, bbox, mask=None, mask_lats=None, mask_lons=None):
+        """
+        bbox:   ll_lon, ll_lat, ur_lon, ur_lat
+        mask:   boolean array of latitudes by longitudes, True for cells in the region
+        """
+        self.bbox = list(bbox)
+        self.mask = mask
+        if mask is not None:
+            self.lat0 = float(mask_lats[0])
+            self.lon0 = float(mask_lons[0])
+            self.dlat = float(mask_lats[1] - mask_lats[0]) if len(mask_lats) > 1 else 1.0
+            self.dlon = float(mask_lons[1] - mask_lons[0]) if len(mask_lons) > 1 else 1.0
+
+    def contains(self, lat, lon):
+        """
+        test a single cell
+        """
+        ll_lon, ll_lat, ur_lon, ur_lat = self.bbox
+        if lat < ll_lat or lat > ur_lat or lon < ll_lon or lon > ur_lon:
+            return False
+
+        if self.mask is None:
+            return True
+
+        lat_indx = int(round((lat - self.lat0) / self.dlat))
+        lon_indx = int(round((lon - self.lon0) / self.dlon))
+        if lat_indx < 0 or lat_indx >= self.mask.shape[0] or lon_indx < 0 or lon_indx >= self.mask.shape[1]:
+            return False
+
+        return bool(self.mask[lat_indx, lon_indx])
+
+    def contains_block(self, lats, lons):
+        """
+        test arrays of cells e.g. the table of cells of a results store - return boolean array
+        """
+        lats = asarray(lats, dtype=float)
+        lons = asarray(lons, dtype=float)
+        ll_lon, ll_lat, ur_lon, ur_lat = self.bbox
+        inside = (lats >= ll_lat) & (lats <= ur_lat) & (lons >= ll_lon) & (lons <= ur_lon)
+        if self.mask is None:
+            return inside
+
+        lat_indxs = rint((lats - self.lat0) / self.dlat).astype(int64)
+        lon_indxs = rint((lons - self.lon0) / self.dlon).astype(int64)
+        inside &= (lat_indxs >= 0) & (lat_indxs < self.mask.shape[0])
+        inside &= (lon_indxs >= 0) & (lon_indxs < self.mask.shape[1])
+        in_mask = full(len(lats), False)
+        in_mask[inside] = self.mask[lat_indxs[inside], lon_indxs[inside]]
+
+        return in_mask
+
+def region_from_bbox(bbox):
+    """
+    bbox: ll_lon, ll_lat, ur_lon, ur_lat
+    """
+    ll_lon, ll_lat, ur_lon, ur_lat = bbox
+    if ll_lon > ur_lon or ll_lat > ur_lat:
+        print(ERROR_STR + 'invalid bounding box: {}'.format(bbox))
+        return None
+
+    return ClipRegion(bbox)
+
+def region_from_mask(mask_fname, varname=None):
+    """
+    mask is the first 2D variable of the NC file, unless a variable is named, over latitude and longitude
+    bounding box of the region is the extent of the cells in the mask
+    """
+    try:
+        nc_dset = Dataset(mask_fname, 'r')
+    except (OSError, TypeError) as err:
+        print(ERROR_STR + 'Unable to open mask file {}. {}'.format(mask_fname, err))
+        return None
+
+    lat_name = 'latitude' if 'latitude' in nc_dset.variables else 'lat'
+    lon_name = 'longitude' if 'longitude' in nc_dset.variables else 'lon'
+    if varname is None:
+        for name, varia in nc_dset.variables.items():
+            if varia.ndim == 2:
+                varname = name
+                break
+
+    if varname is None or varname not in nc_dset.variables or lat_name not in nc_dset.variables:
+        print(ERROR_STR + 'mask file {} requires latitude, longitude and a 2D mask variable'.format(mask_fname))
+        nc_dset.close()
+        return None
+
+    mask_lats = asarray(nc_dset.variables[lat_name][:], dtype=float)
+    mask_lons = asarray(nc_dset.variables[lon_name][:], dtype=float)
+    vals = ma.filled(ma.asarray(nc_dset.variables[varname][:], dtype=float), 0.0)
+    nc_dset.close()
+
+    mask = isfinite(vals) & (vals != 0.0)
+    if not mask.any():
+        print(ERROR_STR + 'mask variable {} of {} has no cells'.format(varname, mask_fname))
+        return None
+
+    # extent of the cells in the mask
+    # ===============================
+    lat_indxs = flatnonzero(mask.any(axis=1))
+    lon_indxs = flatnonzero(mask.any(axis=0))
+    dlat = abs(mask_lats[1] - mask_lats[0]) / 2.0 if len(mask_lats) > 1 else 0.0
+    dlon = abs(mask_lons[1] - mask_lons[0]) / 2.0 if len(mask_lons) > 1 else 0.0
+    lats = mask_lats[lat_indxs]
+    lons = mask_lons[lon_indxs]
+    bbox = [lons.min() - dlon, lats.min() - dlat, lons.max() + dlon, lats.max() + dlat]
+    print('Mask {} has {} cells within {}'.format(varname, int(mask.sum()), [round(float(val), 4) for val in bbox]))
+
+    return ClipRegion(bbox, mask, mask_lats, mask_lons)
+
+def _clip_file(clip_task):
+    """
+    stream one results file - return output file name, number of lines read, number kept and error or None
+    """
+    fname, fn_out, region = clip_task
+    fn_tmp = fn_out + '.tmp'
+    nlines = 0
+    nkept = 0
+    try:
+        with open(fname, 'r', buffering=IO_BUFFER_SIZE) as fin, \
+                                                        open(fn_tmp, 'w', buffering=IO_BUFFER_SIZE) as fout:
+            header = fin.readline()
+            delim = detect_delimiter(header)
+            fout.write(header)
+            for rec in fin:
+                nlines += 1
+                fields = rec.split(delim, 3)
+                try:
+                    lat = float(fields[1])
+                    lon = float(fields[2])
+                except (IndexError, ValueError):
+                    continue
+
+                if region.contains(lat, lon):
+                    fout.write(rec if rec.endswith('\n') else rec + '\n')
+                    nkept += 1
+
+        replace(fn_tmp, fn_out)
+
+    except (OSError, UnicodeDecodeError) as err:
+        if isfile(fn_tmp):
+            remove(fn_tmp)
+        return fn_out, nlines, nkept, str(err)
+
+    return fn_out, nlines, nkept, None
+
+def clip_results_files(file_list, out_dir, region, nworkers=None):
+    """
+    clip all files concurrently - returns only when every file is complete
+    return number of files successfully clipped
+    """
+    strt_time = time()
+    clip_tasks = [(fname, join(out_dir, split(fname)[1]), region) for fname in file_list]
+    if len(clip_tasks) == 0:
+        return 0
+
+    if nworkers is None:
+        nworkers = cpu_count() or 1
+    nworkers = max(1, min(nworkers, len(clip_tasks)))
+
+    if nworkers == 1:
+        outcomes = [_clip_file(clip_task) for clip_task in clip_tasks]
+    else:
+        with Pool(nworkers) as pool:
+            outcomes = pool.map(_clip_file, clip_tasks)
+
+    nsuccess = 0
+    for fname, (fn_out, nlines, nkept, err) in zip(file_list, outcomes):
+        if err is not None:
+            print(ERROR_STR + 'could not clip {} - {}'.format(fname, err))
+            continue
+
+        nrows_indx = fetch_results_index(fname)['nlines'] - 1
+        if nlines != nrows_indx:
+            print(WARNING_STR + 'read {} rows of {} but index has {}'.format(nlines, fname, nrows_indx))
+        else:
+            print('Wrote {} of {} rows to {}'.format(nkept, nlines, fn_out))
+            nsuccess += 1
+
+    print('Clipped {} of {} files in {:.1f} seconds'.format(nsuccess, len(clip_tasks), time() - strt_time))
+
+    return nsuccess
+
+def clip_results_store(store_dir, out_dir, region):
+    """
+    select cells of the store using its table of cells and write them to a store in the output directory
+    which ecosse_results_files will find
+    """
+    store = ResultsStore(store_dir)
+    cell_indxs = flatnonzero(region.contains_block(store.cells['latitude'], store.cells['longitude']))
+    out_store_dir = join(out_dir, split(out_dir)[1] + STORE_SUFFIX)
+    write_store_subset(store, out_store_dir, cell_indxs)
+    print('Wrote {} of {} cells to results store {}'.format(len(cell_indxs), store.ncells, out_store_dir))
+
+    return out_store_dir
+
+def clip_results(form, region, products=None, nworkers=None):
+    """
+    clip results files, or results store, to the region writing them to the clip output directory
+    when products are given, e.g. ['coards', 'co2e'], NC files are also written there with a grid restricted to
+    the bounding box of the region
+    returns output directory or None
+    """
+    if region is None:
+        return None
+
+    rslts_dir = form.w_lbl_rslts.text()
+    out_dir = join(rslts_dir, CLIP_DIR)
+    if not isdir(out_dir):
+        mkdir(out_dir)
+
+    file_list = form.trans_defn['file_list']
+    if len(file_list) == 0:
+        print('No results to clip')
+        return None
+
+    store_dir = form.trans_defn.get('store_dir')
+    if store_dir is not None:
+        clip_results_store(store_dir, out_dir, region)
+    elif clip_results_files(file_list, out_dir, region, nworkers) != len(file_list):
+        return None
+
+    if products is None:
+        return out_dir
+
+    # convert clipped results restricting the NC grid to the region
+    # ==============================================================
+    descriptor, clip_trans_defn = ecosse_results_files(out_dir, 'Results: ')
+    study_defn = form.study_defn
+    trans_defn = form.trans_defn
+    form.study_defn = dict(study_defn)
+    form.study_defn['bbox'] = _intersect_bbox(study_defn['bbox'], region.bbox)
+    form.trans_defn = clip_trans_defn
+    try:
+        csv_to_all_netcdfs(form, products, out_dir=out_dir)
+    finally:
+        form.study_defn = study_defn
+        form.trans_defn = trans_defn
+
+    return out_dir
+
+def _intersect_bbox(bbox1, bbox2):
+    """
+    overlap of two bounding boxes each of ll_lon, ll_lat, ur_lon, ur_lat
+    """
+    return [max(bbox1[0], bbox2[0]), max(bbox1[1], bbox2[1]), min(bbox1[2], bbox2[2]), min(bbox1[3], bbox2[3])]
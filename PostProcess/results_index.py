@@ -0,0 +1,159 @@
+#-------------------------------------------------------------------------------
+# Name:        results_index.py
+# Purpose:     fast metadata scan of CSV result files with a sidecar index file alongside each
+# Author:      agent
+# Created:     18/10/2026
+# Description: index file <results file root>.idx.json holds number of lines, number of fields, timestep, header
+#              and byte offsets of every Nth data row; it is reused while the size and modification time of the
+#              results file are unchanged, otherwise the results file is rescanned in binary using a large buffer
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'results_index.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import stat, replace, remove
+from os.path import splitext, isfile
+from json import load as json_load, dump as json_dump
+from time import time
+
+from numpy import frombuffer, flatnonzero, uint8
+
+from results_blocks import DATA_REC_PREFIX_LEN
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx.json'
+ROW_STRIDE = 1000                       # record byte offset of every ROW_STRIDE data row
+SCAN_BUFFER_SIZE = 16 * 1024 * 1024     # bytes read at a time when counting lines
+MAX_FLDS_MNTHLY = 3600     # if number of fields exceeeds this then assume timestep is daily
+NEWLINE = ord('\n')
+
+WARNING_STR = '*** Warning *** '
+
+def index_fname(fname):
+    """
+    sidecar index lives alongside the results file
+    """
+    return splitext(fname)[0] + INDEX_SUFFIX
+
+def _split_record(rec):
+    """
+    results files are tab or space separated unless the record does not split on whitespace in which case commas
+    """
+    fields = rec.split()
+    if len(fields) == 1:
+        fields = rec.split(',')
+
+    return fields
+
+def _scan_results_file(fname, row_stride):
+    """
+    count lines and record the byte offset of the start of every row_stride data row, reading in binary
+    data row 0 is the line following the header
+    """
+    nnewlines = 0
+    row_offsets = []
+    next_row = 0            # data row whose offset is next required
+    offset = 0              # byte offset of start of current buffer
+    last_byte = None
+    with open(fname, 'rb', buffering=0) as fobj:
+        while True:
+            buff = fobj.read(SCAN_BUFFER_SIZE)
+            if len(buff) == 0:
+                break
+
+            # data row n starts after newline n + 1 i.e. the newline which ends the header is newline 1
+            # =========================================================================================
+            posns = flatnonzero(frombuffer(buff, dtype=uint8) == NEWLINE)
+            nposns = len(posns)
+            while next_row + 1 <= nnewlines + nposns:
+                row_offsets.append(offset + int(posns[next_row - nnewlines]) + 1)
+                next_row += row_stride
+
+            nnewlines += nposns
+            offset += len(buff)
+            last_byte = buff[-1]
+
+    # a final line without a newline is still a line
+    # ===============================================
+    nlines = nnewlines
+    if last_byte is not None and last_byte != NEWLINE:
+        nlines += 1
+
+    # discard offset which points to end of file
+    # ==========================================
+    if len(row_offsets) > 0 and row_offsets[-1] >= offset:
+        row_offsets.pop()
+
+    return nlines, row_offsets
+
+def _build_results_index(fname, fstat, row_stride):
+    """
+    scan results file and gather metadata
+    """
+    with open(fname, 'r') as fobj:
+        header = fobj.readline().rstrip('\r\n')
+        first_rec = fobj.readline()
+
+    nfields = max(0, len(_split_record(first_rec)) - DATA_REC_PREFIX_LEN) if first_rec != '' else 0
+    if nfields > MAX_FLDS_MNTHLY:
+        nyears = int(nfields/365)
+        timestep = 'Daily'
+    else:
+        nyears = int(nfields/12)
+        timestep = 'Monthly'
+
+    nlines, row_offsets = _scan_results_file(fname, row_stride)
+
+    return {'version': INDEX_VERSION, 'size': fstat.st_size, 'mtime_ns': fstat.st_mtime_ns, 'nlines': nlines,
+            'nfields': nfields, 'nyears': nyears, 'timestep': timestep, 'header': header, 'row_stride': row_stride,
+            'row_offsets': row_offsets}
+
+def _read_index(idx_fname, fstat, row_stride):
+    """
+    return index if it describes the results file as it is now, otherwise None
+    """
+    if not isfile(idx_fname):
+        return None
+
+    try:
+        with open(idx_fname, 'r') as fobj:
+            results_index = json_load(fobj)
+    except (OSError, ValueError):
+        return None
+
+    if results_index.get('version') != INDEX_VERSION or results_index.get('row_stride') != row_stride:
+        return None
+
+    if results_index.get('size') != fstat.st_size or results_index.get('mtime_ns') != fstat.st_mtime_ns:
+        return None
+
+    return results_index
+
+def fetch_results_index(fname, row_stride=ROW_STRIDE):
+    """
+    return index of results file, from the sidecar file if current otherwise by scanning the results file
+    failure to write the sidecar file, for example in a read only directory, is not fatal
+    """
+    fstat = stat(fname)
+    idx_fname = index_fname(fname)
+    results_index = _read_index(idx_fname, fstat, row_stride)
+    if results_index is not None:
+        return results_index
+
+    strt_time = time()
+    results_index = _build_results_index(fname, fstat, row_stride)
+    if time() - strt_time > 1.0:
+        print('Indexed {} lines of {} in {:.1f} seconds'.format(results_index['nlines'], fname, time() - strt_time))
+
+    tmp_fname = idx_fname + '.tmp'
+    try:
+        with open(tmp_fname, 'w') as fobj:
+            json_dump(results_index, fobj)
+        replace(tmp_fname, idx_fname)
+    except OSError as err:
+        print(WARNING_STR + 'could not write index file {} - {}'.format(idx_fname, err))
+        if isfile(tmp_fname):
+            remove(tmp_fname)
+
+    return results_index
@@ -0,0 +1,255 @@
+#-------------------------------------------------------------------------------
+# Name:        results_store.py
+# Purpose:     binary columnar store of aggregated results as an alternative to the tab separated text files
+# Author:      agent
+# Created:     18/10/2026
+# Description: store comprises a directory <study>_store alongside the text files holding:
+#                   store.json    - header: metrics, number of cells and number of time values for each metric
+#                   cells.npy     - structured array of the 8 common header columns for each cell plus number of
+#                                   values for each metric
+#                   <metric>.f32  - float32 matrix of ncells x ntimes, row order is that of cells.npy
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'results_store.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import makedirs, remove, stat
+from os.path import join, isdir, isfile, split
+from json import load as json_load, dump as json_dump
+
+from numpy import array, asarray, full, where, float32, nan, memmap, load as np_load, save as np_save
+
+from results_blocks import ResultsBlock, BLOCK_NROWS
+
+STORE_VERSION = 1
+STORE_SUFFIX = '_store'
+HEADER_FN = 'store.json'
+CELLS_FN = 'cells.npy'
+MATRIX_SUFFIX = '.f32'
+
+NUMERIC_COLS = {'latitude': 'f8', 'longitude': 'f8', 'mu_global': 'i4', 'num_dom_soils': 'i4', 'area_km2': 'f8'}
+DATA_REC_PREFIX_LEN = 8
+
+WARNING_STR = '*** Warning *** '
+
+def store_dir_name(rslts_dir, study):
+    """
+    store lives alongside the text files
+    """
+    return join(rslts_dir, study + STORE_SUFFIX)
+
+def virtual_fname(store_dir, metric):
+    """
+    name of text file which would have been written for this metric e.g. to derive name of NC file
+    """
+    rslts_dir, store_name = split(store_dir)
+    study = store_name[:-len(STORE_SUFFIX)]
+
+    return join(rslts_dir, study + '_' + metric + '.txt')
+
+def _to_int(val):
+    """
+    e.g. mu_global is not part of OSGB simulation directory names
+    """
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return -1
+
+class ResultsStoreWriter(object):
+    """
+    accumulates cell metadata in memory and writes rows of each metric matrix as they arrive
+    """
+    def __init__(self, store_dir, varnames, common_headers, ntimes):
+        """
+        any existing store is overwritten
+        ntimes is the number of time values of each record i.e. of each row of every metric matrix
+        """
+        self.store_dir = store_dir
+        self.varnames = varnames
+        self.common_headers = common_headers
+        self.cells = []
+        self.ntimes = {varname: ntimes for varname in varnames}
+        self.fobjs = {}
+
+        if not isdir(store_dir):
+            makedirs(store_dir)
+
+        hdr_fn = join(store_dir, HEADER_FN)
+        if isfile(hdr_fn):
+            remove(hdr_fn)      # store is invalid until closed
+
+        for varname in varnames:
+            self.fobjs[varname] = open(join(store_dir, varname + MATRIX_SUFFIX), 'wb')
+
+    def add_cell(self, id_mods, values):
+        """
+        id_mods: list of 8 column prefixes, one for each record written for this cell
+        values:  arrays for each metric; rows of other lengths are truncated or padded with NaN, and a missing metric
+                 is a row of NaN, with the number of values recorded so readers can reject them
+        """
+        nvals_rec = []
+        for varname in self.varnames:
+            vals = values.get(varname, [])
+            nvals = len(vals)
+
+            ntimes = self.ntimes[varname]
+            row = full(ntimes, nan, dtype=float32)
+            nkeep = min(ntimes, nvals)
+            row[:nkeep] = vals[:nkeep]
+            nvals_rec.append(nvals)
+            for id_mod in id_mods:
+                self.fobjs[varname].write(row.tobytes())
+
+        for id_mod in id_mods:
+            self.cells.append(tuple(id_mod) + tuple(nvals_rec))
+
+    def abandon(self):
+        """
+        close matrix files without writing the header so that the incomplete store is not used
+        """
+        for varname in self.fobjs:
+            self.fobjs[varname].close()
+
+        print(WARNING_STR + 'results store {} is incomplete and will not be used'.format(self.store_dir))
+
+    def close(self):
+        """
+        write cells table and finally the header which marks the store as complete
+        """
+        for varname in self.fobjs:
+            self.fobjs[varname].close()
+
+        # columns which are not numeric are sized to fit
+        # ==============================================
+        dtype = []
+        for icol, col_name in enumerate(self.common_headers):
+            if col_name in NUMERIC_COLS:
+                dtype.append((col_name, NUMERIC_COLS[col_name]))
+            else:
+                width = max([len(str(cell[icol])) for cell in self.cells] + [1])
+                dtype.append((col_name, 'U{}'.format(width)))
+
+        for varname in self.varnames:
+            dtype.append(('nvals_' + varname, 'i4'))
+
+        ncommon = len(self.common_headers)
+        rows = []
+        for cell in self.cells:
+            row = []
+            for icol, col_name in enumerate(self.common_headers):
+                if NUMERIC_COLS.get(col_name) == 'i4':
+                    row.append(_to_int(cell[icol]))
+                elif col_name in NUMERIC_COLS:
+                    row.append(float(cell[icol]))
+                else:
+                    row.append(str(cell[icol]))
+            rows.append(tuple(row) + cell[ncommon:])
+
+        np_save(join(self.store_dir, CELLS_FN), array(rows, dtype=dtype))
+
+        header = {'version': STORE_VERSION, 'ncells': len(self.cells), 'varnames': self.varnames,
+                                                                                        'ntimes': self.ntimes}
+        with open(join(self.store_dir, HEADER_FN), 'w') as fobj:
+            json_dump(header, fobj, indent=2)
+
+        print('Wrote {} cells to results store {}'.format(len(self.cells), self.store_dir))
+
+        return len(self.cells)
+
+class ResultsStore(object):
+    """
+    read access to a completed store - metric matrices are memory mapped
+    """
+    def __init__(self, store_dir):
+        """
+        read header and cells table
+        """
+        self.store_dir = store_dir
+        with open(join(store_dir, HEADER_FN), 'r') as fobj:
+            header = json_load(fobj)
+
+        self.ncells = header['ncells']
+        self.varnames = header['varnames']
+        self.ntimes = header['ntimes']
+        self.cells = np_load(join(store_dir, CELLS_FN))
+
+    def matrix(self, varname):
+        """
+        return ncells x ntimes float32 array
+        """
+        fname = join(self.store_dir, varname + MATRIX_SUFFIX)
+        if self.ncells == 0 or self.ntimes[varname] == 0:
+            return full((self.ncells, self.ntimes[varname]), nan, dtype=float32)
+
+        return memmap(fname, dtype=float32, mode='r', shape=(self.ncells, self.ntimes[varname]))
+
+def write_store_subset(store, out_store_dir, cell_indxs):
+    """
+    write the given cells of an open store to a new store, header last so the new store is complete only when
+    all its matrices have been written
+    """
+    if not isdir(out_store_dir):
+        makedirs(out_store_dir)
+
+    hdr_fn = join(out_store_dir, HEADER_FN)
+    if isfile(hdr_fn):
+        remove(hdr_fn)
+
+    for varname in store.varnames:
+        asarray(store.matrix(varname)[cell_indxs], dtype=float32).tofile(join(out_store_dir, varname + MATRIX_SUFFIX))
+
+    np_save(join(out_store_dir, CELLS_FN), store.cells[cell_indxs])
+
+    header = {'version': STORE_VERSION, 'ncells': len(cell_indxs), 'varnames': store.varnames,
+                                                                                            'ntimes': store.ntimes}
+    with open(hdr_fn, 'w') as fobj:
+        json_dump(header, fobj, indent=2)
+
+    return len(cell_indxs)
+
+def check_results_store(rslts_dir, study, text_fnames):
+    """
+    return store directory if a complete store exists which is at least as recent as the text files, else None
+    """
+    store_dir = store_dir_name(rslts_dir, study)
+    hdr_fn = join(store_dir, HEADER_FN)
+    if not isfile(hdr_fn):
+        return None
+
+    store_mtime = stat(hdr_fn).st_mtime
+    for fname in text_fnames:
+        if stat(fname).st_mtime > store_mtime:
+            print(WARNING_STR + 'results store {} is older than text files - will use text files'.format(store_dir))
+            return None
+
+    return store_dir
+
+def read_store_blocks(store_dir, keys, nfields, block_nrows=BLOCK_NROWS, dtype=float32, col_window=None):
+    """
+    generator which mimics read_text_blocks, yielding a ResultsBlock for each block_nrows cells
+    """
+    icol_strt, icol_end = (0, nfields) if col_window is None else col_window
+    store = ResultsStore(store_dir)
+    keys = [key for key in keys if key in store.varnames]
+    matrices = {key: store.matrix(key) for key in keys}
+    prefix_names = store.cells.dtype.names[:DATA_REC_PREFIX_LEN]
+
+    for irow1 in range(0, store.ncells, block_nrows):
+        cells = store.cells[irow1:irow1 + block_nrows]
+        line_prefixes = [[cell[name].item() for name in prefix_names] for cell in cells]
+        num_time_vals = full(len(cells), -1)
+        good_rows = full(len(cells), True)
+        for key in keys:
+            nvals = cells['nvals_' + key]
+            num_time_vals = where(good_rows & (nvals != nfields), nvals, num_time_vals)
+            good_rows &= (nvals == nfields)
+        num_time_vals = where(good_rows, icol_end - icol_strt, num_time_vals)
+
+        vals = {}
+        for key in keys:
+            block = matrices[key][irow1:irow1 + len(cells), icol_strt:icol_end]
+            vals[key] = asarray(block[good_rows], dtype=dtype)
+
+        yield ResultsBlock(line_prefixes, num_time_vals.tolist(), good_rows, vals)
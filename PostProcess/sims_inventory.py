@@ -0,0 +1,257 @@
+#-------------------------------------------------------------------------------
+# Name:        sims_inventory.py
+# Purpose:     single inventory of a simulations directory which is kept on disk and shared by all operations
+# Author:      agent
+# Created:     18/10/2026
+# Description: the simulations directory is listed once, using scandir, and its entries are classified as they
+#              arrive and written to a text file, one line for each grid cell, weather directory or manifest file;
+#              a small header, written last, records the modification time of the simulations directory and the
+#              inventory is rebuilt only when that changes i.e. when entries have been added, removed or renamed
+#              simulation directories of each grid cell, that is the _s01.._s09 soils, are grouped as for the
+#              original serial loop: a new grid cell starts with the first dominant soil
+#              both files are held alongside the study definition file, as with the manifest index
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'sims_inventory.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from os import scandir, replace, remove, stat
+from os.path import join, split, isfile, isdir, normpath
+from json import load as json_load, dump as json_dump
+from time import time
+
+INVENTORY_VERSION = 1
+HEADER_SUFFIX = '_sims_inventory.json'
+ENTRIES_SUFFIX = '_sims_inventory.txt'
+MANIFEST_PREFIX = 'manifest_'
+MANIFEST_SUFFIX = '.txt'
+
+CELL, WTHR, MANIFEST = 'C', 'W', 'M'    # first field of each line of the entries file
+
+WARNING_STR = '*** Warning *** '
+
+def inventory_fnames(sims_dir):
+    """
+    header and entries files live alongside the study definition file
+    """
+    root_dir, study = split(normpath(sims_dir))
+
+    return join(root_dir, study + HEADER_SUFFIX), join(root_dir, study + ENTRIES_SUFFIX)
+
+def classify_entry(entry):
+    """
+    return CELL for a lat/lon simulation directory e.g. lat0002374_lon0024154_mu10090_s01, WTHR for a directory named
+    after granular coordinates e.g. 4770_20490, which for OSGB studies is a simulation directory e.g. 73500_870500,
+    MANIFEST for a manifest file or None
+    """
+    name = entry.name
+    if name.startswith(MANIFEST_PREFIX) and name.endswith(MANIFEST_SUFFIX):
+        return MANIFEST if entry.is_file() else None
+
+    segs = name.split('_')
+    if len(segs) == 4 and name[0:5] == 'lat00':
+        return CELL if entry.is_dir() else None
+
+    if len(segs) == 2 and segs[0].isdigit() and segs[1].isdigit():
+        return WTHR if entry.is_dir() else None
+
+    return None
+
+def _scan_entries(sims_dir, counts):
+    """
+    yield a line for each grid cell, weather directory and manifest file in the order scandir returns them
+    """
+    cell_sub_dirs = []
+    with scandir(sims_dir) as entries:
+        for entry in entries:
+            kind = classify_entry(entry)
+            if kind is None:
+                continue
+
+            if kind == CELL:
+                counts['nsims'] += 1
+                if entry.name[-4:] == '_s01' and len(cell_sub_dirs) > 0:
+                    counts['ncells'] += 1
+                    yield '\t'.join([CELL] + cell_sub_dirs) + '\n'
+                    cell_sub_dirs = []
+
+                cell_sub_dirs.append(entry.name)
+
+            elif kind == WTHR:
+                counts['nwthr_dirs'] += 1
+                yield WTHR + '\t' + entry.name + '\n'
+
+            else:
+                counts['nmanifests'] += 1
+                fstat = entry.stat()
+                yield '{}\t{}\t{}\t{}\n'.format(MANIFEST, entry.name, fstat.st_mtime_ns, fstat.st_size)
+
+    if len(cell_sub_dirs) > 0:
+        counts['ncells'] += 1
+        yield '\t'.join([CELL] + cell_sub_dirs) + '\n'
+
+class SimsInventory(object):
+    """
+    simulation directories grouped by grid cell, weather directories and manifest files of a simulations directory
+    entries are streamed from the entries file and are only held in memory if the file could not be written
+    """
+    def __init__(self, sims_dir, header, entries_fn=None, lines=None):
+        """
+        either entries_fn or lines is supplied
+        """
+        self.sims_dir = sims_dir
+        self.header = header
+        self.entries_fn = entries_fn
+        self.lines = lines
+
+    @property
+    def nsims(self):
+        return self.header['nsims']
+
+    @property
+    def ncells(self):
+        return self.header['ncells']
+
+    @property
+    def nwthr_dirs(self):
+        return self.header['nwthr_dirs']
+
+    @property
+    def nmanifests(self):
+        return self.header['nmanifests']
+
+    def _iter_fields(self, kind):
+        """
+        yield fields, less the first, of each line of the given kind
+        """
+        if self.lines is None:
+            with open(self.entries_fn, 'r') as fobj:
+                for line in fobj:
+                    if line[0] == kind:
+                        yield line.rstrip('\n').split('\t')[1:]
+        else:
+            for line in self.lines:
+                if line[0] == kind:
+                    yield line.rstrip('\n').split('\t')[1:]
+
+    def iter_cells(self):
+        """
+        yield list of simulation directory names for each grid cell
+        """
+        return self._iter_fields(CELL)
+
+    def iter_sim_dirs(self, version=None):
+        """
+        yield simulation directory names - for OSGB studies these are named after their coordinates
+        """
+        for cell_sub_dirs in self._iter_fields(CELL):
+            for sub_dir in cell_sub_dirs:
+                yield sub_dir
+
+        if version == 'NetZeroPlus':
+            for fields in self._iter_fields(WTHR):
+                yield fields[0]
+
+    def iter_wthr_dirs(self):
+        """
+        yield weather directory names
+        """
+        for fields in self._iter_fields(WTHR):
+            yield fields[0]
+
+    def iter_manifests(self):
+        """
+        yield name, modification time and size of each manifest file as recorded when the inventory was built
+        """
+        for name, mtime_ns, size in self._iter_fields(MANIFEST):
+            yield name, int(mtime_ns), int(size)
+
+    def description(self):
+        """
+        summary for display and logging
+        """
+        return 'simulations directory {} has {} simulations in {} grid cells, {} weather directories and {} manifests'\
+            .format(self.sims_dir, self.nsims, self.ncells, self.nwthr_dirs, self.nmanifests)
+
+def _read_header(header_fn):
+    """
+    return header or None if absent or unreadable
+    """
+    if not isfile(header_fn):
+        return None
+
+    try:
+        with open(header_fn, 'r') as fobj:
+            header = json_load(fobj)
+    except (OSError, ValueError) as err:
+        print(WARNING_STR + 'could not read simulations inventory {} - {} - will rebuild'.format(header_fn, err))
+        return None
+
+    if header.get('version') != INVENTORY_VERSION:
+        return None
+
+    return header
+
+def _build_inventory(sims_dir, header_fn, entries_fn, mtime_ns):
+    """
+    stream entries to a temporary file, falling back to memory if it cannot be written, then write the header
+    """
+    strt_time = time()
+    print('Building inventory of simulations directory ' + sims_dir + '...')
+    counts = {'nsims': 0, 'ncells': 0, 'nwthr_dirs': 0, 'nmanifests': 0}
+    header = {'version': INVENTORY_VERSION, 'sims_dir': sims_dir, 'mtime_ns': mtime_ns}
+
+    if isfile(header_fn):
+        try:
+            remove(header_fn)      # inventory is invalid until the header has been rewritten
+        except OSError:
+            pass
+
+    tmp_fn = entries_fn + '.tmp'
+    lines = None
+    try:
+        with open(tmp_fn, 'w') as fobj:
+            fobj.writelines(_scan_entries(sims_dir, counts))
+        replace(tmp_fn, entries_fn)
+    except (OSError, IOError) as err:
+        print(WARNING_STR + 'could not write simulations inventory {} - will hold in memory\t{}'.format(entries_fn, err))
+        counts = {key: 0 for key in counts}
+        lines = list(_scan_entries(sims_dir, counts))
+
+    header.update(counts)
+    if lines is None:
+        tmp_fn = header_fn + '.tmp'
+        try:
+            with open(tmp_fn, 'w') as fobj:
+                json_dump(header, fobj, indent=2)
+            replace(tmp_fn, header_fn)
+        except (OSError, IOError) as err:
+            print(WARNING_STR + 'could not write simulations inventory {}\t{}'.format(header_fn, err))
+
+    inventory = SimsInventory(sims_dir, header, entries_fn, lines)
+    print('Built inventory of {} in {:.1f} seconds'.format(inventory.description(), time() - strt_time))
+
+    return inventory
+
+def fetch_sims_inventory(sims_dir, rebuild=False):
+    """
+    return inventory of the simulations directory, which is rebuilt when the modification time of the directory has
+    changed since it was written, or None if the directory does not exist
+    files changed in place, for example SUMMARY.OUT files or a manifest overwritten rather than replaced, are not
+    detected - set rebuild to force a fresh listing
+    """
+    if not isdir(sims_dir):
+        print(WARNING_STR + 'simulations directory ' + sims_dir + ' does not exist')
+        return None
+
+    sims_dir = normpath(sims_dir)
+    header_fn, entries_fn = inventory_fnames(sims_dir)
+    mtime_ns = stat(sims_dir).st_mtime_ns
+
+    if not rebuild:
+        header = _read_header(header_fn)
+        if header is not None and header['mtime_ns'] == mtime_ns and isfile(entries_fn):
+            return SimsInventory(sims_dir, header, entries_fn)
+
+    return _build_inventory(sims_dir, header_fn, entries_fn, mtime_ns)
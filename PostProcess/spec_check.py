@@ -5,17 +5,15 @@ __version__ = '0.0.0'
 __author__ = 's03mm5'
 
 from os.path import split, join, isfile, isdir
-from os import rename, chdir, getcwd, walk, system, remove
+from os import rename, chdir, getcwd, system, remove
 from time import time
 from glob import glob
 import filecmp
 from locale import format_string
-from netCDF4 import Dataset
 from sys import stdout
 
 from spec_utilities import update_progress_check
-from input_output_funcs import open_file_sets, read_one_line
-from nc_low_level_fns import get_nc_coords
+from sims_inventory import fetch_sims_inventory
 
 ERROR_STR = '*** Error *** '
 
@@ -26,6 +24,7 @@ WC_EXE = 'E:\\Freeware\\UnxUtils\\usr\\local\\wbin\\wc.exe'
 SMRY_OUT = 'SUMMARY.OUT'
 
 SV_DIR = 'G:\\GlblEcssOutputs\\EcosseOutputs'
+IRELAND_BBOX = [-10.6, 50.8, -5.6, 55.0]
 
 ASIA_WHT = 'Asia_Wheat_Asia_Wheat'
 WARNING_STR = '*** Warning *** '
@@ -33,120 +32,13 @@ sleepTime = 5.0
 
 def csv_to_csv_ireland(form):
     """
-    C
+    clip results to Ireland writing CSV files to the clip output directory
+    results_clip, and with it netCDF4, is imported here so that aggregation, which uses verify_subdir, does not
+    require it
     """
-    nc_fname = 'G:\\HoliSoils\\GlblEcssVcSpTest\\EcosseOutputs\\EFISCENSE_BAU_0.1_26_ELUM\\'
-    nc_fname += 'EFISCENSE_BAU_0.1_26_ELUM_co2e.nc'
-    bbox = list([-10.6, 50.8, -5.6, 55.0])
-
-    try:
-        nc_dset = Dataset(nc_fname, 'a')
-    except TypeError as err:
-        print(ERROR_STR + 'Unable to open output file. {}'.format(err))
-        return
-
-    # max_lines = int(form.w_nlines.text())
-    max_lines = 9999999                                        # stop processing after this number of lines
-    max_lat_indx = nc_dset.variables['latitude'].shape[0] - 1
-    max_lon_indx = nc_dset.variables['longitude'].shape[0] - 1
-
-    trans_files = form.trans_defn['file_list']     # Files comprising the LU transition result
-    if len(trans_files) == 0:
-        print('No transition files to process')
-        return
-
-    # open all files
-    # ==============
-    trans_fobjs, soil_header = open_file_sets(trans_files)
-
-    # read and process each line
-    # ==========================
-    ll_lon, ll_lat, ur_lon, ur_lat = bbox
-    max_lines = 99999999
-    nline = 0
-    num_out_lines = 0
-    num_skip_lines = 0
-    num_bad_lines = 0
-    last_time = time()
-    lat_lons = []
-    while nline <= max_lines:
-
-        # read in land use transition results
-        # ===================================
-        num_trans_time_vals, nsoil_metrics, line_prefix, atom_tran = read_one_line(trans_fobjs)
-        if atom_tran is None:
-            break
-        nline += 1
-
-        # check data integrity
-        # ====================
-        if num_trans_time_vals != form.trans_defn['nfields']:
-
-            # write to file....
-            # writers[bad_fobj_key].writerow(line_prefix)
-
-            if num_bad_lines == 0:
-                nline_str = format_string("%d", int(nline), grouping=True)
-                print('\nBad data at line {}\tfound {} trans fields, expected {} - will skip'
-                                                .format(nline_str, num_trans_time_vals, form.trans_defn['nfields']))
-            num_bad_lines += 1
-        else:
-            # write final result to NetCDF file
-            # =================================
-            total_area = 0.0
-            province, slat, slon, smu_global, wthr_set, num_soil, dummy, sarea = line_prefix
-            area = float(sarea)
-            total_area += area
-            mu_global = int(smu_global)
-            lat = float(slat)
-            lon = float(slon)
-
-            if (lat >= ll_lat and lat <= ur_lat) and (lon >= ll_lon and lon <= ur_lon):
-                pass
-            else:
-                num_skip_lines += 1
-                continue
-
-            '''
-            lat_indx, lon_indx = get_nc_coords(form, lat, lon, max_lat_indx, max_lon_indx)
-            if lat_indx == -1:
-                continue
-            '''
-            for varname in atom_tran.keys():
-                if varname != 'soc':
-                    continue
-                '''
-                if atom_tran[varname] is None or varname not in nc_dset.variables:
-                    continue
-                '''
-                lat_lons.append([lat,lon])
-                num_out_lines += 1
-
-                nvals = len(atom_tran[varname])
-                nyears = nvals // 12
-                if nvals % 12 != 0 and nline == 1:
-                    print(WARNING_STR + 'Number of months {} should be divisable by 12'.format(nvals))
-
-                    atom_rec = atom_tran[varname]
-
-        # inform user with progress message
-        # =================================
-        new_time = time()
-        if new_time - last_time > sleepTime:
-            last_time = new_time
-            num_out_str = format_string("%d", int(num_out_lines), grouping=True)
-            nremain = format_string("%d", form.trans_defn['nlines'] - num_out_lines, grouping=True)
-            stdout.write('\rLines output: {}\trejected: {}\tremaining: {}'
-                                    .format(num_out_str, num_bad_lines, nremain))
-
-    # close file objects
-    # ==================
-    for key in trans_fobjs:
-        trans_fobjs[key].close()
-
-    nc_dset.close()
-
-    print('\nDone - having processed ' + format_string("%d", int(nline), grouping=True) + ' lines')
+    from results_clip import clip_results, region_from_bbox
+
+    clip_results(form, region_from_bbox(IRELAND_BBOX))
 
     return
 
@@ -201,20 +93,10 @@ def check_spec_results(form):
     sims_dir = form.w_lbl_sims.text()
     sims_targ_dir = join(split(sims_dir)[0], 'EU28_45_10_grz_mnr')
 
-    print('Gathering all simulation directories from ' + sims_dir + '...')
-    for directory, subdirs_raw, files in walk(sims_dir):
-        break
-    del directory
-    del files
-
-    # filter weather directories to leave only simulation directories
-    # ===============================================================
-    subdirs = []
-    for subdir in subdirs_raw:
-        if subdir[0:5] == 'lat00':
-            subdirs.append(subdir)
-    num_sims = len(subdirs)
-    del (subdirs_raw)
+    # simulation directories are streamed from the inventory
+    # ======================================================
+    inventory = fetch_sims_inventory(sims_dir)
+    num_sims = inventory.nsims
 
     # counters: Number of summary files trimmed or not found
     # ======================================================
@@ -225,7 +107,7 @@ def check_spec_results(form):
     start_time = time()
     last_time = start_time
 
-    for subdir in subdirs:
+    for subdir in inventory.iter_sim_dirs():
 
         ref_dir = join(sims_dir, subdir)
         targ_dir = join(sims_targ_dir, subdir)
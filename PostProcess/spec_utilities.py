@@ -5,7 +5,7 @@ __version__ = '0.0.0'
 __author__ = 's03mm5'
 
 from os.path import split, join, isfile, isdir
-from os import rename, chdir, getcwd, walk, system, remove
+from os import rename, chdir, getcwd, system, remove
 from subprocess import check_output
 from locale import format_string
 
@@ -13,8 +13,11 @@ import json
 from time import time
 import sys
 import csv
+from numpy import loadtxt, empty
 
 from input_output_funcs import check_summary_out_row
+from progress_events import report_progress
+from sims_inventory import fetch_sims_inventory
 
 ERROR_STR = '*** Error *** '
 SUMMARY_VARNAMES = {
@@ -42,6 +45,8 @@ SMRY_ORIG = 'SUMMARY_orig.OUT'
 def update_progress_check(last_time, start_time,  nident, num_sims, not_ident):
 
     """Update progress bar"""
+    report_progress(nident + not_ident, num_sims, 'simulations')
+
     this_time = time()
     if (this_time - last_time) > 5.0:
         remain_str = format_string("%d", num_sims - nident - not_ident, grouping=True)
@@ -75,20 +80,10 @@ def trim_summaries(form):
     curr_dir = getcwd()
     sims_dir = form.w_lbl_sims.text()
 
-    print('Gathering all simulation directories from ' + sims_dir + '...')
-    for directory, subdirs_raw, files in walk(sims_dir):
-        break
-    del directory
-    del files
-
-    # filter weather directories to leave only simulation directories
-    # ===============================================================
-    subdirs = []
-    for subdir in subdirs_raw:
-        if subdir[0:5] == 'lat00':
-            subdirs.append(subdir)
-    num_sims = len(subdirs)
-    del (subdirs_raw)
+    # simulation directories are streamed from the inventory
+    # ======================================================
+    inventory = fetch_sims_inventory(sims_dir)
+    num_sims = inventory.nsims
 
     # counters: Number of summary files trimmed or not found
     # ======================================================
@@ -99,7 +94,7 @@ def trim_summaries(form):
     start_time = time()
     last_time = start_time
 
-    for subdir in subdirs:
+    for subdir in inventory.iter_sim_dirs():
 
         this_dir = join(sims_dir, subdir)
         if isdir(this_dir):
@@ -305,23 +300,18 @@ def _make_mapping_dict(columns):
 def retrieve_results(lggr, sim_dir):
     """
     extract necessary results from the completed simulation's output file
+    the file is read in one call and only the required columns are converted, to float arrays, by numpy - rows
+    which fail this fast path, typically where ECOSSE has run two values together, are repaired row by row
     """
     path = join(sim_dir, 'SUMMARY.OUT')
     if not isfile(path):
         print(ERROR_STR + 'No SUMMARY.OUT file in: ' + split(path)[0])
         return None
 
-    summary = {}
     with open(path, 'r') as fobj:
-        reader = csv.reader(fobj, dialect = EcosseDialect)
-        try:
-            next(reader)  # Skip the units description line
-        except StopIteration as err:
-            print('\nCheck: ' + path + ' is empty')
-            return None
-        try:
-            columns = next(reader)
-        except StopIteration as err:
+        fobj.readline()  # Skip the units description line
+        columns = fobj.readline().split()
+        if len(columns) == 0:
             print('\nCheck: ' + path + ' is empty')
             return None
 
@@ -331,42 +321,75 @@ def retrieve_results(lggr, sim_dir):
         if smmry_vars_dict is None:
             print('SUMMARY.OUT file: ' + path + ' not recognised')
             return None
-        
-        for column in columns:
-            summary[column] = []
-        for irow, row in enumerate(reader):
-            row = check_summary_out_row (row)
-            for icol, val_str in enumerate(row):
-                try:
-                    val = float(val_str)
-                except ValueError as err:
-                    icol_nxt = icol + 1
-                    if icol_nxt < len(columns):
-                        metric_str = '\tmetrics: ' + columns[icol] + ' ' + columns[icol_nxt]
-                    else:
-                        metric_str = '\tmetric: ' + columns[icol]
-
-                    lggr.info(ERROR_STR + 'on row ' + str(irow + 3) + ' ' + str(err) + metric_str + '\n\tin: ' + path)
-                    return None
-
-                summary[columns[icol]].append(val)
+
+        # last column is included so that rows with missing or run together values are rejected by the fast path
+        # =======================================================================================================
+        ncols = len(columns)
+        icols = [columns.index(lv_name) for lv_name in smmry_vars_dict.values()]
+        usecols = icols + [ncols - 1]
+        try:
+            data = loadtxt(fobj, usecols=usecols, ndmin=2)
+        except ValueError:
+            fobj.seek(0)
+            data = _retrieve_repaired_rows(lggr, path, fobj.readlines()[2:], columns, usecols)
+            if data is None:
+                return None
 
     # build result
     # ============
     full_result = {}
-    for sv_name, lv_name in smmry_vars_dict.items():
-        full_result[sv_name] = list(summary[lv_name])    # sv_name = short variable name; lv_name = long
+    for icol, sv_name in enumerate(smmry_vars_dict):
+        full_result[sv_name] = data[:, icol].copy()    # sv_name = short variable name
 
     if len(full_result) == 0:
         full_result = None
 
     return full_result
 
-def load_manifest(lgr, sim_dir):
+def _retrieve_repaired_rows(lggr, path, rows, columns, usecols):
+    """
+    slow path for SUMMARY.OUT files with rows which numpy cannot parse - each row is checked and repaired if necessary
+    blank rows are skipped, as by loadtxt
+    """
+    ncols = len(columns)
+    data = empty((len(rows), len(usecols)))
+    ndata_rows = 0
+    for irow, line in enumerate(rows):
+        row = line.split()
+        if len(row) == 0:
+            continue
+
+        if len(row) != ncols:
+            row = check_summary_out_row(row, ncols)
+        for jcol, icol in enumerate(usecols):
+            try:
+                data[ndata_rows, jcol] = float(row[icol])
+            except (ValueError, IndexError) as err:
+                icol_nxt = icol + 1
+                if icol_nxt < len(columns):
+                    metric_str = '\tmetrics: ' + columns[icol] + ' ' + columns[icol_nxt]
+                else:
+                    metric_str = '\tmetric: ' + columns[icol]
+
+                lggr.info(ERROR_STR + 'on row ' + str(irow + 3) + ' ' + str(err) + metric_str + '\n\tin: ' + path)
+                return None
+
+        ndata_rows += 1
+
+    return data[:ndata_rows]
+
+def load_manifest(lgr, sim_dir, mani_index=None):
     """
-    construct the name of the manifest file and read it
+    construct the name of the manifest file and read it or, preferably, look up manifest in the index
     last 4 characters of lat/lon simulations directory indicates soil, so ignore
     """
+    if mani_index is not None:
+        manifest = mani_index.lookup(sim_dir)
+        if manifest is None:
+            print('manifest for ' + sim_dir + ' is not in manifest index')
+
+        return manifest
+
     root_dir, cell_id = split(sim_dir)
 
     # identify if lat/lon or OSGB
@@ -405,6 +428,8 @@ def update_progress_post(last_time, start_time, num_grid_cells, num_manifests, s
                          .format(completed, skipped, warning_count,
                          h, m, int(round(s)), h2, m2, int(round(s2))))
     '''
+    report_progress(num_grid_cells, num_manifests, 'cells')
+
     this_time = time()
     if (this_time - last_time) > 5.0:
         remain_str = format_string("%d", num_manifests - num_grid_cells, grouping=True)
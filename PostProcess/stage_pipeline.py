@@ -0,0 +1,409 @@
+#-------------------------------------------------------------------------------
+# Name:        stage_pipeline.py
+# Purpose:     run the aggregation, cut and NetCDF stages of a study as a graph, skipping stages which are current
+# Author:      agent
+# Created:     18/10/2026
+# Description: each stage names the stages it depends on, the files it reads and the files it writes; when a stage
+#              completes a fingerprint of the sizes and modification times of its inputs, together with its
+#              settings, is recorded with the state of its outputs in the ledger <study>_pipeline.json of the
+#              results directory; a stage is skipped when its fingerprint is unchanged and its outputs are as
+#              recorded - NB a directory is represented by its own modification time so that changes to files
+#              within its subdirectories are not detected; the aggregation stage therefore also takes a digest of
+#              the SUMMARY.OUT and manifest files of the simulations directory, listed using its inventory
+#              stages whose dependencies are complete run concurrently, each in its own process so that it may in
+#              turn use a pool of workers, and are run by post_process_batch using a batch Form made from settings
+#-------------------------------------------------------------------------------
+#
+__prog__ = 'stage_pipeline.py'
+__version__ = '0.0.0'
+__author__ = 'agent'
+
+from argparse import ArgumentParser
+from functools import partial
+from hashlib import sha1
+from json import dumps as json_dumps, load as json_load, dump as json_dump
+from multiprocessing import Process, Queue
+from os import stat, replace, cpu_count
+from os.path import isfile, join, split, splitext
+from queue import Empty
+from sys import exit
+from time import time
+
+from post_process_batch import Form, STAGES, EXTRA_METRICS, read_batch_config
+from progress_events import report_stage
+from sims_inventory import fetch_sims_inventory
+
+LEDGER_SUFFIX = '_pipeline.json'
+LEDGER_VERSION = 1
+POLL_SECS = 2.0             # interval at which running stages are checked should one exit without reporting
+
+# settings which affect the outputs of each kind of stage
+# =======================================================
+AGGREG_SETTINGS = ['aggreg_daily', 'text_output', 'store_output', 'totals_output', 'region_lookup', 'extra_metrics']
+NC_SETTINGS = ['aggreg_daily', 'nc_profile']
+
+ERROR_STR = '*** Error *** '
+WARNING_STR = '*** Warning *** '
+
+class PipelineStage(object):
+    """
+    node of the graph of stages
+    """
+    def __init__(self, name, stage, deps=None, inputs=None, outputs=None, settings_keys=None, kwargs=None,
+                                                                                                    digests=None):
+        """
+        name:          unique name of this node e.g. coards_soc
+        stage:         name of the stage function in STAGES of post_process_batch e.g. coards
+        deps:          names of nodes which must complete first
+        inputs:        files or directories whose sizes and modification times make up the fingerprint
+        outputs:       files written, not all of which need be present
+        settings_keys: settings which are included in the fingerprint
+        kwargs:        keyword arguments of the stage function, also included in the fingerprint
+        digests:       functions, without arguments, returning a digest of inputs which are not simple files
+        """
+        self.name = name
+        self.stage = stage
+        self.deps = [] if deps is None else list(deps)
+        self.inputs = [] if inputs is None else list(inputs)
+        self.outputs = [] if outputs is None else list(outputs)
+        self.settings_keys = [] if settings_keys is None else list(settings_keys)
+        self.kwargs = {} if kwargs is None else dict(kwargs)
+        self.digests = [] if digests is None else list(digests)
+
+def _path_state(path):
+    """
+    size and modification time of a file or directory, or None if it does not exist
+    """
+    try:
+        info = stat(path)
+    except OSError:
+        return None
+
+    return [info.st_size, info.st_mtime_ns]
+
+def sims_dir_digest(sims_dir):
+    """
+    hash of the sizes and modification times of the SUMMARY.OUT file of each simulation and of the manifest files
+    i.e. of the files read by aggregation, so that a file rewritten in place is detected
+    """
+    inventory = fetch_sims_inventory(sims_dir)
+    if inventory is None:
+        return None
+
+    hash_obj = sha1()
+    for sub_dir in inventory.iter_sim_dirs('NetZeroPlus'):      # includes OSGB simulation directories
+        state = _path_state(join(sims_dir, sub_dir, 'SUMMARY.OUT'))
+        if state is not None:
+            hash_obj.update('{}\t{}\t{}\n'.format(sub_dir, state[0], state[1]).encode())
+
+    for mani_fname, dummy, dummy in inventory.iter_manifests():
+        hash_obj.update('{}\t{}\n'.format(mani_fname, _path_state(join(sims_dir, mani_fname))).encode())
+
+    return hash_obj.hexdigest()
+
+def stage_fingerprint(pipe_stage, settings):
+    """
+    hash of the state of the inputs, the settings used and the keyword arguments of the stage
+    """
+    items = {'stage': pipe_stage.stage, 'kwargs': pipe_stage.kwargs,
+             'settings': {key: settings.get(key) for key in pipe_stage.settings_keys},
+             'inputs': {path: _path_state(path) for path in pipe_stage.inputs},
+             'digests': [digest() for digest in pipe_stage.digests]}
+
+    return sha1(json_dumps(items, sort_keys=True, default=str).encode()).hexdigest()
+
+class PipelineLedger(object):
+    """
+    fingerprint and state of the outputs of each stage as last completed
+    """
+    def __init__(self, ledger_fn):
+        """
+        ledger which cannot be read is treated as empty so that every stage is run
+        """
+        self.ledger_fn = ledger_fn
+        self.stages = {}
+        if isfile(ledger_fn):
+            try:
+                with open(ledger_fn, 'r') as fobj:
+                    ledger = json_load(fobj)
+                if ledger.get('version') == LEDGER_VERSION:
+                    self.stages = ledger['stages']
+            except (OSError, ValueError, KeyError) as err:
+                print(WARNING_STR + 'could not read pipeline ledger {} - {}'.format(ledger_fn, err))
+
+    def is_current(self, name, fingerprint):
+        """
+        stage is current if its fingerprint is unchanged and at least one output remains exactly as written
+        """
+        record = self.stages.get(name)
+        if record is None or record['fingerprint'] != fingerprint:
+            return False
+
+        outputs = record['outputs']
+        if all(state is None for state in outputs.values()):
+            return False
+
+        return all(_path_state(path) == state for path, state in outputs.items())
+
+    def record(self, pipe_stage, fingerprint):
+        """
+        ledger is rewritten after each stage so that completed stages are retained should a later one fail
+        """
+        self.stages[pipe_stage.name] = {'fingerprint': fingerprint,
+                                        'outputs': {path: _path_state(path) for path in pipe_stage.outputs}}
+        try:
+            with open(self.ledger_fn + '.tmp', 'w') as fobj:
+                json_dump({'version': LEDGER_VERSION, 'stages': self.stages}, fobj, indent=2, sort_keys=True)
+            replace(self.ledger_fn + '.tmp', self.ledger_fn)
+        except OSError as err:
+            print(WARNING_STR + 'could not write pipeline ledger {} - {}'.format(self.ledger_fn, err))
+
+def _check_stages(pipe_stages):
+    """
+    return None if names are unique, stages and dependencies are known and there are no cycles
+    otherwise an error message
+    """
+    names = [pipe_stage.name for pipe_stage in pipe_stages]
+    if len(set(names)) != len(names):
+        return 'stage names must be unique'
+
+    for pipe_stage in pipe_stages:
+        if pipe_stage.stage not in STAGES:
+            return 'unknown stage {} of {}'.format(pipe_stage.stage, pipe_stage.name)
+        for dep in pipe_stage.deps:
+            if dep not in names:
+                return 'unknown dependency {} of {}'.format(dep, pipe_stage.name)
+
+    # remove stages whose dependencies are resolved until none remain
+    # ================================================================
+    resolved = set()
+    remaining = list(pipe_stages)
+    while len(remaining) > 0:
+        ready = [pipe_stage for pipe_stage in remaining if all(dep in resolved for dep in pipe_stage.deps)]
+        if len(ready) == 0:
+            return 'dependencies of stages {} form a cycle'.format(', '.join(ps.name for ps in remaining))
+        for pipe_stage in ready:
+            resolved.add(pipe_stage.name)
+            remaining.remove(pipe_stage)
+
+    return None
+
+def _run_stage(name, stage, settings, kwargs, queue=None):
+    """
+    run a stage using a batch Form made from the settings - outcome is returned or, when run in its own process,
+    put on the queue
+    """
+    strt_time = time()
+    form = Form(settings)
+    retcode = bool(STAGES[stage](form, **kwargs))
+    outcome = (name, retcode, time() - strt_time)
+    if queue is not None:
+        queue.put(outcome)
+
+    return outcome
+
+def _wait_for_stage(queue, running):
+    """
+    return outcome of the next stage to finish, including one whose process exits without reporting
+    """
+    while True:
+        try:
+            return queue.get(timeout=POLL_SECS)
+        except Empty:
+            for name, (process, fingerprint, strt_time) in running.items():
+                if not process.is_alive():
+                    try:
+                        return queue.get(timeout=POLL_SECS)    # outcome may have been put just before exit
+                    except Empty:
+                        print(ERROR_STR + 'stage {} exited with code {}'.format(name, process.exitcode))
+                        return name, False, time() - strt_time
+
+def _fetch_nconcurrent(settings, nconcurrent):
+    """
+    by default stages share the CPUs with the worker pools they use
+    """
+    if nconcurrent is not None:
+        return max(1, nconcurrent)
+
+    try:
+        nworkers = max(1, int(settings.get('nworkers', 1)))
+    except ValueError:
+        nworkers = 1
+
+    return max(1, (cpu_count() or 1) // nworkers)
+
+def run_pipeline(pipe_stages, settings, nconcurrent=None, force=False):
+    """
+    run stages whose fingerprints have changed, in dependency order, with up to nconcurrent at once
+    stages which depend on a stage which fails are not run; force runs every stage
+    return dictionary of outcomes keyed by stage name: run, skipped, failed or blocked
+    """
+    err_mess = _check_stages(pipe_stages)
+    if err_mess is not None:
+        print(ERROR_STR + err_mess)
+        return None
+
+    strt_time = time()
+    rslts_dir = settings['results_dir']
+    ledger = PipelineLedger(join(rslts_dir, split(rslts_dir)[1] + LEDGER_SUFFIX))
+    nconcurrent = _fetch_nconcurrent(settings, nconcurrent)
+    stages_by_name = {pipe_stage.name: pipe_stage for pipe_stage in pipe_stages}
+
+    pending = [pipe_stage.name for pipe_stage in pipe_stages]
+    done = set()
+    failed = set()
+    outcomes = {}
+    running = {}
+    queue = Queue()
+    while len(pending) > 0 or len(running) > 0:
+
+        # start, or skip, stages whose dependencies are complete
+        # ======================================================
+        progress = False
+        for name in list(pending):
+            pipe_stage = stages_by_name[name]
+            if any(dep in failed for dep in pipe_stage.deps):
+                pending.remove(name)
+                failed.add(name)
+                outcomes[name] = 'blocked'
+                print(WARNING_STR + 'stage {} not run since a stage it depends on failed'.format(name))
+                progress = True
+                continue
+
+            if not all(dep in done for dep in pipe_stage.deps):
+                continue
+
+            fingerprint = stage_fingerprint(pipe_stage, settings)
+            if not force and ledger.is_current(name, fingerprint):
+                pending.remove(name)
+                done.add(name)
+                outcomes[name] = 'skipped'
+                print('Stage {} is up to date'.format(name))
+                progress = True
+                continue
+
+            if len(running) >= nconcurrent:
+                continue
+
+            pending.remove(name)
+            progress = True
+            print('Stage {} started'.format(name))
+            report_stage(name)
+            if nconcurrent == 1:
+                outcome = _run_stage(name, pipe_stage.stage, settings, pipe_stage.kwargs)
+                running[name] = (None, fingerprint, time())
+                queue.put(outcome)
+                break
+            else:
+                process = Process(target=_run_stage, args=(name, pipe_stage.stage, settings, pipe_stage.kwargs, queue))
+                process.start()
+                running[name] = (process, fingerprint, time())
+
+        if progress and len(running) < nconcurrent:
+            continue
+
+        if len(running) == 0:
+            break
+
+        # record outcome of next stage to finish
+        # ======================================
+        name, retcode, elapsed = _wait_for_stage(queue, running)
+        process, fingerprint, dummy = running.pop(name)
+        if process is not None:
+            process.join()
+
+        if retcode:
+            ledger.record(stages_by_name[name], fingerprint)
+            done.add(name)
+            outcomes[name] = 'run'
+            print('Stage {} completed in {:.1f} seconds'.format(name, elapsed))
+        else:
+            failed.add(name)
+            outcomes[name] = 'failed'
+            print(ERROR_STR + 'stage {} failed after {:.1f} seconds'.format(name, elapsed))
+
+    nrun = list(outcomes.values()).count('run')
+    nskipped = list(outcomes.values()).count('skipped')
+    print('Pipeline ran {} and skipped {} of {} stages in {:.1f} seconds'
+                                                .format(nrun, nskipped, len(pipe_stages), time() - strt_time))
+    return outcomes
+
+def study_pipeline(settings, products=('coards', 'co2e'), nyears_kept=None, cut_flag=False):
+    """
+    stages of a study: aggregation followed by, independently, cutting, one COARDS file for each metric aggregated
+    and the co2e file; when nyears_kept is given the NC files cover the last nyears_kept years of the results
+    """
+    from input_output_funcs import ALL_METRICS
+    from results_store import store_dir_name, HEADER_FN
+
+    sims_dir = settings['sims_dir']
+    rslts_dir = settings['results_dir']
+    study = split(rslts_dir)[1]
+    study_defn_fn = join(split(sims_dir)[0], study + '_study_definition.txt')
+    store_hdr_fn = join(store_dir_name(rslts_dir, study), HEADER_FN)
+
+    extra_metrics = settings.get('extra_metrics', {})
+    metrics = [metric for metric in ALL_METRICS if metric not in EXTRA_METRICS or extra_metrics.get(metric, False)]
+    rslt_fns = {metric: join(rslts_dir, study + '_' + metric + '.txt') for metric in metrics}
+    nc_kwargs = {} if nyears_kept is None else {'nyears_kept': nyears_kept}
+
+    pipe_stages = [PipelineStage('aggregate', 'aggregate', inputs=[sims_dir, study_defn_fn],
+                                 outputs=list(rslt_fns.values()) + [store_hdr_fn], settings_keys=AGGREG_SETTINGS,
+                                 digests=[partial(sims_dir_digest, sims_dir)])]
+    if cut_flag:
+        cut_dir = join(rslts_dir, 'cut_outdir')
+        pipe_stages.append(PipelineStage('cut', 'cut', deps=['aggregate'], inputs=list(rslt_fns.values()),
+                                         outputs=[join(cut_dir, split(fname)[1]) for fname in rslt_fns.values()],
+                                         kwargs={'nyears_kept': nyears_kept}))
+    if 'coards' in products:
+        for metric, rslt_fn in rslt_fns.items():
+            kwargs = dict(nc_kwargs, metrics=[metric])
+            pipe_stages.append(PipelineStage('coards_' + metric, 'coards', deps=['aggregate'],
+                                             inputs=[rslt_fn, store_hdr_fn, study_defn_fn],
+                                             outputs=[splitext(rslt_fn)[0] + '.nc'], settings_keys=NC_SETTINGS,
+                                             kwargs=kwargs))
+    if 'co2e' in products:
+        from csv_to_co2e_nc import METRICS as CO2E_METRICS
+
+        inputs = [rslt_fns[metric] for metric in CO2E_METRICS if metric in rslt_fns] + [store_hdr_fn, study_defn_fn]
+        pipe_stages.append(PipelineStage('co2e', 'co2e', deps=['aggregate'], inputs=inputs,
+                                         outputs=[join(rslts_dir, study + '_co2e.nc')], settings_keys=NC_SETTINGS,
+                                         kwargs=nc_kwargs))
+    return pipe_stages
+
+def main():
+    """
+    Entry point
+    settings given on the command line override those of the configuration file
+    """
+    argparser = ArgumentParser(prog = __prog__, description = 'aggregate and convert a study, skipping current stages')
+
+    argparser.add_argument('--version', action = 'version', version = '{} {}'.format(__prog__, __version__),
+                                                                        help = 'Display the version number.')
+    argparser.add_argument('--config', default = None, help = 'configuration file written by PostProcessGUI')
+    argparser.add_argument('--sims_dir', default = None, help = 'simulations directory')
+    argparser.add_argument('--results_dir', default = None, help = 'results directory')
+    argparser.add_argument('--products', nargs = '+', default = ['coards', 'co2e'], choices = ['coards', 'co2e'],
+                                                                        help = 'NC files written after aggregation')
+    argparser.add_argument('--nyears_kept', type = int, default = None,
+                                                help = 'last years of the results converted and, with --cut, cut')
+    argparser.add_argument('--cut', action = 'store_true', help = 'also cut CSV results files')
+    argparser.add_argument('--nconcurrent', type = int, default = None, help = 'number of stages run at once')
+    argparser.add_argument('--force', action = 'store_true', help = 'run every stage')
+    args = argparser.parse_args()
+
+    settings = {} if args.config is None else read_batch_config(args.config)
+    if settings is None:
+        exit(1)
+
+    for key, val in (('sims_dir', args.sims_dir), ('results_dir', args.results_dir)):
+        if val is not None:
+            settings[key] = val
+
+    pipe_stages = study_pipeline(settings, args.products, args.nyears_kept, args.cut)
+    outcomes = run_pipeline(pipe_stages, settings, args.nconcurrent, args.force)
+
+    exit(0 if outcomes is not None and 'failed' not in outcomes.values() else 1)
+
+if __name__ == '__main__':
+    main()